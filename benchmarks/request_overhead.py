@@ -0,0 +1,64 @@
+"""
+Measures the CPU overhead of `AbstractAPIClient.request`, excluding the
+network: the client's connection pool is replaced with an adapter that
+returns a canned response.
+
+    python benchmarks/request_overhead.py
+
+"""
+import timeit
+
+import requests
+from requests.adapters import BaseAdapter
+
+from directory_client_core import authentication
+from directory_client_core.base import AbstractAPIClient
+
+
+class StubAdapter(BaseAdapter):
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{}'
+        response.request = request
+        response.url = request.url
+        return response
+
+    def close(self):
+        pass
+
+
+class BenchmarkAPIClient(AbstractAPIClient):
+    version = 1
+
+
+def create_client():
+    client = BenchmarkAPIClient(
+        base_url='https://example.com/api/',
+        api_key='secret',
+        sender_id='benchmark',
+        timeout=5,
+    )
+    client.session_manager.create_adapter = StubAdapter
+    return client
+
+
+def main(number=5000):
+    client = create_client()
+    authenticator = authentication.BearerAuthenticator('token')
+    cases = {
+        'get': lambda: client.get('/pages/home/'),
+        'get with params and authenticator': lambda: client.get(
+            '/pages/home/', params={'lang': 'en'}, authenticator=authenticator
+        ),
+        'post json': lambda: client.post('/pages/', data={'key': 'value'}),
+    }
+    for name, func in cases.items():
+        func()
+        seconds = min(timeit.repeat(func, number=number, repeat=5))
+        print(f'{name:40} {seconds / number * 1e6:8.1f} us per request')
+
+
+if __name__ == '__main__':
+    main()
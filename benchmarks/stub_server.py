@@ -0,0 +1,100 @@
+"""
+A local HTTP server for the benchmarks, so they measure the client rather
+than a remote API.
+
+    /payload/<size>/    a JSON body of about <size> bytes, with an ETag. It
+                        responds 304 if the request sends the same ETag
+    /status/<code>/     an empty response with the given status code
+
+Any path accepts `?delay=<seconds>` to simulate a slow API.
+
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+
+def build_payload(size):
+    # a list of small objects, as returned by the list endpoints
+    item = {'id': 0, 'title': 'Lorem ipsum dolor sit amet', 'live': True}
+    item_size = len(json.dumps(item)) + 2
+    items = [dict(item, id=i) for i in range(max(1, size // item_size))]
+    return json.dumps({'results': items}).encode()
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, which would otherwise wait
+    # on delayed ACKs
+    disable_nagle_algorithm = True
+    payloads = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        if 'delay' in query:
+            time.sleep(float(query['delay'][0]))
+        segments = [item for item in parts.path.split('/') if item]
+        if len(segments) == 2 and segments[0] == 'payload':
+            self.send_payload(int(segments[1]))
+        elif len(segments) == 2 and segments[0] == 'status':
+            self.send_body(int(segments[1]), b'')
+        else:
+            self.send_body(404, b'')
+
+    do_POST = do_GET
+
+    def send_payload(self, size):
+        if size not in self.payloads:
+            self.payloads[size] = build_payload(size)
+        etag = f'"{size}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_body(304, b'', etag=etag)
+        else:
+            self.send_body(200, self.payloads[size], etag=etag)
+
+    def send_body(self, status_code, body, etag=None):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default of 5 drops connections opened concurrently
+    request_queue_size = 128
+
+
+class StubServer:
+    """Runs the server on a free local port in a daemon thread."""
+
+    def __init__(self):
+        self.server = StubHTTPServer(('127.0.0.1', 0), StubRequestHandler)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}/'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,331 @@
+"""
+Benchmarks for the client and `helpers.fallback` hot paths, run against a
+local stub server and an in-memory Django cache.
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --compare results.json
+
+Every result has `per_call_us`, the best of the repeats, so results stored
+by one version can be compared with another. Results of runs on different
+machines are not comparable.
+
+"""
+import argparse
+import asyncio
+from importlib import metadata
+import json
+import logging
+import platform
+import statistics
+import sys
+import time
+import warnings
+
+from django.conf import settings
+from django.core.cache import CacheKeyWarning
+
+from benchmarks.stub_server import StubServer
+
+
+PAYLOAD_SIZES = (1024, 64 * 1024, 1024 * 1024)
+CALLS_PER_SIZE = {1024: 500, 64 * 1024: 200, 1024 * 1024: 20}
+CONCURRENCY_LEVELS = (1, 4, 16)
+CONCURRENT_REQUESTS = 64
+# per request, so concurrency has something to overlap
+SERVER_DELAY = 0.01
+
+
+def configure_django():
+    if not settings.configured:
+        settings.configure(
+            DIRECTORY_CLIENT_CORE_CACHE_EXPIRE_SECONDS=60 * 60,
+            CACHES={
+                'fallback': {
+                    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                    'LOCATION': 'benchmarks',
+                }
+            },
+        )
+    # fallback logs cache events, which are expected here
+    logging.getLogger('directory_client_core').addHandler(logging.NullHandler())
+    warnings.simplefilter('ignore', CacheKeyWarning)
+
+
+def measure(func, number, repeat=5):
+    func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number * 1e6)
+    return {
+        'per_call_us': min(timings),
+        'median_us': statistics.median(timings),
+        'calls': number,
+    }
+
+
+def create_client(client_class, base_url, **kwargs):
+    class BenchmarkAPIClient(client_class):
+        version = 1
+
+    return BenchmarkAPIClient(
+        base_url=base_url,
+        api_key='secret',
+        sender_id='benchmark',
+        timeout=5,
+        **kwargs
+    )
+
+
+def benchmark_client(base_url, scale):
+    from directory_client_core import transports
+    from directory_client_core.base import AbstractAPIClient
+
+    number = int(1000 * scale) or 1
+    results = {}
+    # results of the default transport keep their names, so they can be
+    # compared with results stored before transports were added
+    for prefix, transport in (
+        ('client', None),
+        ('client.urllib3', transports.Urllib3Transport()),
+    ):
+        client = create_client(AbstractAPIClient, base_url, transport=transport)
+        url = client.build_url(base_url, 'payload/1024/')
+        prepared_request = client.prepare_bodyless_request(
+            'GET', url, headers=client.build_headers()
+        )
+        with client:
+            if transport is None:
+                results['client.sign_request'] = measure(
+                    lambda: client.sign_request(prepared_request), number
+                )
+            results[f'{prefix}.send'] = measure(
+                lambda: client.send('GET', url, headers=client.build_headers()),
+                number,
+            )
+            results[f'{prefix}.request'] = measure(
+                lambda: client.get('payload/1024/'), number
+            )
+            results[f'{prefix}.post'] = measure(
+                lambda: client.post('payload/1024/', {'key': 'value'}), number
+            )
+    return results
+
+
+def benchmark_fallback(base_url, scale):
+    from django.core.cache import caches
+
+    from directory_client_core import compression, helpers, invalidation
+    from directory_client_core.base import AbstractAPIClient
+    from directory_client_core.local_cache import LocalCache
+
+    cache = caches['fallback']
+    local_cache = LocalCache(fresh_seconds=60 * 60)
+    invalidator = invalidation.TagInvalidator(cache)
+
+    class FallbackClient(AbstractAPIClient):
+        version = 1
+
+        @helpers.fallback(cache=cache)
+        def get(self, *args, **kwargs):
+            return super().get(*args, **kwargs)
+
+    class LocalFallbackClient(FallbackClient):
+
+        @helpers.fallback(cache=cache, local_cache=local_cache)
+        def get(self, *args, **kwargs):
+            return AbstractAPIClient.get(self, *args, **kwargs)
+
+    class CompressedFallbackClient(FallbackClient):
+
+        @helpers.fallback(cache=cache, compressor=compression.Compressor())
+        def get(self, *args, **kwargs):
+            return AbstractAPIClient.get(self, *args, **kwargs)
+
+    class TaggedFallbackClient(FallbackClient):
+
+        @helpers.fallback(cache=cache, invalidator=invalidator)
+        def get(self, *args, **kwargs):
+            return AbstractAPIClient.get(self, *args, **kwargs)
+
+    client = create_client(FallbackClient, base_url)
+    tagged_client = create_client(TaggedFallbackClient, base_url)
+    compressed_client = create_client(CompressedFallbackClient, base_url)
+    local_client = create_client(LocalFallbackClient, base_url)
+    plain_client = create_client(AbstractAPIClient, base_url)
+
+    results = {}
+    for size in PAYLOAD_SIZES:
+        number = int(CALLS_PER_SIZE[size] * scale) or 1
+        url = f'payload/{size}/'
+        error_params = {'size': str(size)}
+
+        def miss():
+            cache.clear()
+            client.get(url)
+
+        cache.clear()
+        local_cache.clear()
+        results[f'fallback.miss.{size}'] = measure(miss, number)
+        # the entry stored by the last miss, with the ETag of the payload
+        results[f'fallback.304.{size}'] = measure(
+            lambda: client.get(url), number
+        )
+        # the entry is stored again with tags
+        cache.clear()
+        tagged_client.get(url)
+        results[f'fallback.tagged.304.{size}'] = measure(
+            lambda: tagged_client.get(url), number
+        )
+        results[f'fallback.hit.{size}'] = measure(
+            lambda: local_client.get(url), number
+        )
+        cache.set(
+            helpers.build_entry_key('status/500/', error_params),
+            helpers.build_cache_entry(plain_client.get(url)),
+        )
+        results[f'fallback.error.{size}'] = measure(
+            lambda: client.get('status/500/', params=error_params), number
+        )
+        # the payload is repetitive, so this is the cost of decompressing
+        cache.set(
+            helpers.build_entry_key('status/500/', error_params),
+            compression.Compressor().encode_entry(
+                helpers.build_cache_entry(plain_client.get(url))
+            ),
+        )
+        results[f'fallback.compressed.error.{size}'] = measure(
+            lambda: compressed_client.get(
+                'status/500/', params=error_params
+            ).content,
+            number,
+        )
+    for item in (
+        client, compressed_client, local_client, plain_client, tagged_client
+    ):
+        item.close()
+    return results
+
+
+def summarize_concurrency(timings):
+    per_call = min(timings) / CONCURRENT_REQUESTS
+    return {
+        'per_call_us': per_call * 1e6,
+        'median_us': statistics.median(timings) / CONCURRENT_REQUESTS * 1e6,
+        'calls': CONCURRENT_REQUESTS,
+        'requests_per_second': 1 / per_call,
+    }
+
+
+def benchmark_threads(base_url, repeat=3):
+    from directory_client_core.base import AbstractAPIClient
+
+    specs = [
+        ('payload/1024/', {'delay': str(SERVER_DELAY)}, None)
+    ] * CONCURRENT_REQUESTS
+    results = {}
+    for level in CONCURRENCY_LEVELS:
+        client = create_client(
+            AbstractAPIClient, base_url,
+            max_concurrent_requests=level, pool_maxsize=level,
+        )
+        with client:
+            client.get_many(specs[:level])
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                client.get_many(specs)
+                timings.append(time.perf_counter() - start)
+        results[f'threads.{level}'] = summarize_concurrency(timings)
+    return results
+
+
+def benchmark_async(base_url, repeat=3):
+    from directory_client_core.async_base import AsyncAbstractAPIClient
+
+    specs = [
+        ('payload/1024/', {'delay': str(SERVER_DELAY)}, None)
+    ] * CONCURRENT_REQUESTS
+
+    async def run(level):
+        client = create_client(
+            AsyncAbstractAPIClient, base_url, max_concurrent_requests=level,
+        )
+        async with client:
+            await client.get_many(specs[:level])
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                await client.get_many(specs)
+                timings.append(time.perf_counter() - start)
+        return timings
+
+    return {
+        f'async.{level}': summarize_concurrency(asyncio.run(run(level)))
+        for level in CONCURRENCY_LEVELS
+    }
+
+
+def get_version():
+    try:
+        return metadata.version('directory_client_core')
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def run(scale=1.0):
+    configure_django()
+    results = {}
+    with StubServer() as server:
+        results.update(benchmark_client(server.base_url, scale))
+        results.update(benchmark_fallback(server.base_url, scale))
+        results.update(benchmark_threads(server.base_url))
+        try:
+            results.update(benchmark_async(server.base_url))
+        except ImportError:
+            # httpx is an optional dependency
+            pass
+    return {
+        'version': get_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': time.time(),
+        'results': results,
+    }
+
+
+def compare(previous, current):
+    for name, result in current['results'].items():
+        if name not in previous['results']:
+            continue
+        before = previous['results'][name]['per_call_us']
+        after = result['per_call_us']
+        print(f'{name:32} {before:10.1f} {after:10.1f} {after / before - 1:+8.1%}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--compare', help='compare with stored results')
+    parser.add_argument(
+        '--scale', type=float, default=1.0,
+        help='multiplies the number of calls, e.g., 0.1 for a quick run',
+    )
+    args = parser.parse_args(argv)
+
+    report = run(scale=args.scale)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    else:
+        for name, result in report['results'].items():
+            print(f'{name:32} {result["per_call_us"]:10.1f} us per call')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
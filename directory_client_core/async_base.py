@@ -0,0 +1,419 @@
+import asyncio
+from datetime import timedelta
+import logging
+import weakref
+
+from monotonic import monotonic
+import httpx
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from directory_client_core import instrumentation, sessions, streaming
+from directory_client_core.base import (
+    DEFAULT_MAX_CONCURRENT_REQUESTS, BaseAPIClient, normalize_get_spec
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+
+# network streams (connections) that have had a response, to tell whether a
+# response came over a reused connection
+_used_streams = weakref.WeakSet()
+
+
+class StreamedBody:
+    """
+    The `raw` stream of a `requests.Response` built from a streamed
+    `httpx.Response`, read with `read` or `stream` as a urllib3 response is.
+    The body is decoded, as httpx decodes it.
+
+    """
+
+    def __init__(self, raw_response):
+        self.raw_response = raw_response
+        self.chunks = raw_response.iter_bytes()
+        self.buffer = b''
+
+    def stream(self, amt=streaming.DEFAULT_CHUNK_SIZE, decode_content=None):
+        while True:
+            chunk = self.read(amt)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self, amt=None, *args, **kwargs):
+        if amt is None:
+            data = self.buffer + b''.join(self.chunks)
+            self.buffer = b''
+            return data
+        while len(self.buffer) < amt:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        data, self.buffer = self.buffer[:amt], self.buffer[amt:]
+        return data
+
+    def close(self):
+        self.raw_response.close()
+
+
+def build_response(raw_response, elapsed, stream=False):
+    """
+    Converts a `httpx.Response` into a `requests.Response` so callers and
+    `helpers` handle responses from the sync and async clients alike. With
+    `stream` the body is left to be read from `raw`.
+
+    """
+
+    response = requests.Response()
+    response.status_code = raw_response.status_code
+    response.headers = CaseInsensitiveDict(raw_response.headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.reason = raw_response.reason_phrase
+    response.url = str(raw_response.url)
+    response.elapsed = elapsed
+    response.request = raw_response.request
+    if stream:
+        response.raw = StreamedBody(raw_response)
+    else:
+        response._content = raw_response.content
+        response._content_consumed = True
+    stream = raw_response.extensions.get('network_stream')
+    if stream is None:
+        response.connection_reused = None
+    else:
+        response.connection_reused = stream in _used_streams
+        _used_streams.add(stream)
+    return response
+
+
+def translate_exception(exception):
+    """
+    Maps httpx errors onto their `requests` equivalent, so `except
+    RequestException` handles failures from the sync and async clients alike.
+
+    """
+
+    if isinstance(exception, httpx.ConnectTimeout):
+        return requests.exceptions.ConnectTimeout(str(exception))
+    if isinstance(exception, httpx.ReadTimeout):
+        return requests.exceptions.ReadTimeout(str(exception))
+    if isinstance(exception, httpx.TimeoutException):
+        return requests.exceptions.Timeout(str(exception))
+    if isinstance(exception, httpx.TooManyRedirects):
+        return requests.exceptions.TooManyRedirects(str(exception))
+    if isinstance(exception, httpx.TransportError):
+        return requests.exceptions.ConnectionError(str(exception))
+    return requests.exceptions.RequestException(str(exception))
+
+
+class AsyncAbstractAPIClient(BaseAPIClient):
+    """
+    Asyncio counterpart of `AbstractAPIClient`. The request methods are
+    coroutines backed by a pooled `httpx.AsyncClient`, and return
+    `requests.Response` instances.
+
+    With `http2` concurrent requests to a host are multiplexed over one
+    HTTP/2 connection, where the server offers HTTP/2 (which needs the h2
+    package). `http2_prior_knowledge` speaks HTTP/2 without negotiating it,
+    to plain http:// servers that support it.
+
+    """
+
+    def __init__(
+        self, base_url, api_key, sender_id, timeout,
+        max_connections=DEFAULT_MAX_CONNECTIONS,
+        max_keepalive_connections=DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+        max_concurrent_requests=DEFAULT_MAX_CONCURRENT_REQUESTS,
+        retry_policy=None,
+        circuit_breaker=None,
+        json_backend=None,
+        http2=False,
+        http2_prior_knowledge=False,
+    ):
+        super().__init__(
+            base_url=base_url,
+            api_key=api_key,
+            sender_id=sender_id,
+            timeout=timeout,
+            retry_policy=retry_policy,
+            circuit_breaker=circuit_breaker,
+            json_backend=json_backend,
+        )
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self.max_concurrent_requests = max_concurrent_requests
+        self.http2 = http2 or http2_prior_knowledge
+        self.http1 = not http2_prior_knowledge
+        self.http_client = None
+        self.generation = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    async def aclose(self):
+        """Closes the pooled connections. Later requests open new ones."""
+        http_client = self.http_client
+        self.http_client = None
+        if http_client and self.generation == sessions._fork_generation:
+            await http_client.aclose()
+
+    def create_http_client(self):
+        return httpx.AsyncClient(
+            limits=self.limits,
+            timeout=self.timeout,
+            follow_redirects=True,
+            http1=self.http1,
+            http2=self.http2,
+        )
+
+    def get_http_client(self):
+        # connections inherited from the parent process are abandoned
+        if (
+            self.http_client is None or
+            self.generation != sessions._fork_generation
+        ):
+            self.http_client = self.create_http_client()
+            self.generation = sessions._fork_generation
+        return self.http_client
+
+    async def request_many(self, calls):
+        """
+        Async counterpart of `AbstractAPIClient.request_many`, running at most
+        `max_concurrent_requests` calls at a time on the event loop.
+
+        """
+
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+
+        async def run(call):
+            kwargs = dict(call)
+            method = getattr(self, kwargs.pop('method').lower())
+            async with semaphore:
+                return await method(**kwargs)
+
+        return await asyncio.gather(
+            *[run(call) for call in calls], return_exceptions=True
+        )
+
+    async def get_many(self, specs):
+        return await self.request_many(
+            [normalize_get_spec(spec) for spec in specs]
+        )
+
+    async def put(self, url, data, authenticator=None):
+        return await self.request(
+            url=url,
+            method="PUT",
+            content_type="application/json",
+            data=self.json_backend.dumps(data),
+            authenticator=authenticator,
+        )
+
+    async def patch(self, url, data, files=None, authenticator=None):
+        if files:
+            response = await self.request(
+                url=url,
+                method="PATCH",
+                data=data,
+                files=files,
+                authenticator=authenticator
+            )
+        else:
+            response = await self.request(
+                url=url,
+                method="PATCH",
+                content_type="application/json",
+                data=self.json_backend.dumps(data),
+                authenticator=authenticator,
+            )
+        return response
+
+    async def get(
+        self, url, params=None, authenticator=None, cache_control=None
+    ):
+        return await self.request(
+            url=url,
+            method="GET",
+            params=params,
+            authenticator=authenticator,
+            cache_control=cache_control,
+        )
+
+    async def post(self, url, data={}, files=None, authenticator=None):
+        if files:
+            response = await self.request(
+                url=url,
+                method="POST",
+                data=data,
+                files=files,
+                authenticator=authenticator,
+            )
+        else:
+            response = await self.request(
+                url=url,
+                method="POST",
+                content_type="application/json",
+                data=self.json_backend.dumps(data),
+                authenticator=authenticator,
+            )
+        return response
+
+    async def delete(self, url, data=None, authenticator=None):
+        return await self.request(
+            url=url,
+            method="DELETE",
+            authenticator=authenticator,
+            data=data,
+        )
+
+    async def request(
+        self, method, url, content_type=None, data=None, params=None,
+        files=None, authenticator=None, cache_control=None,
+    ):
+
+        logger.debug("API request %s %s", method, url)
+        headers = self.build_headers(
+            content_type=content_type,
+            authenticator=authenticator,
+            cache_control=cache_control,
+        )
+        url = self.build_url(self.base_url, url)
+
+        start_time = monotonic()
+        if instrumentation.listeners:
+            instrumentation.emit(
+                instrumentation.REQUEST_STARTED, method=method, url=url
+            )
+
+        attempt = 1
+        response = None
+        try:
+            while True:
+                try:
+                    response = await self.send_attempt(
+                        method=method,
+                        url=url,
+                        headers=headers,
+                        data=data,
+                        params=params,
+                        files=files,
+                    )
+                except requests.exceptions.RequestException as exception:
+                    response = None
+                    delay = self.get_retry_delay(
+                        method, attempt, start_time, files,
+                        exception=exception, url=url,
+                    )
+                    if delay is None:
+                        raise
+                else:
+                    delay = self.get_retry_delay(
+                        method, attempt, start_time, files,
+                        response=response, url=url,
+                    )
+                    if delay is None:
+                        return response
+                await asyncio.sleep(delay)
+                attempt += 1
+        finally:
+            logger.debug(
+                "API %s request on %s finished in %s",
+                method, url, monotonic() - start_time,
+            )
+            if instrumentation.listeners:
+                self.emit_finished(method, url, start_time, attempt, response)
+
+    def sign_request(self, prepared_request):
+        headers = self.request_signer.get_signature_headers(
+            url=prepared_request.url.raw_path.decode('ascii'),
+            body=prepared_request.content,
+            method=prepared_request.method,
+            content_type=prepared_request.headers.get('Content-Type'),
+        )
+        prepared_request.headers.update(headers)
+        return prepared_request
+
+    async def send_attempt(self, **kwargs):
+        if self.circuit_breaker is None:
+            return await self.send(**kwargs)
+        await self.circuit_breaker.abefore_request(self.base_url)
+        try:
+            response = await self.send(**kwargs)
+        except Exception as exception:
+            await self.circuit_breaker.arecord_outcome(
+                self.base_url, exception=exception
+            )
+            raise
+        await self.circuit_breaker.arecord_outcome(
+            self.base_url, response=response
+        )
+        return response
+
+    async def send(
+        self, method, url, headers=None, data=None, params=None, files=None,
+    ):
+        http_client = self.get_http_client()
+        if isinstance(data, (str, bytes)):
+            content, data = data, None
+        else:
+            content = None
+        prepared_request = http_client.build_request(
+            method,
+            url,
+            headers=headers,
+            content=content,
+            data=data or None,
+            files=files,
+            params=params,
+        )
+        # multipart bodies are streams, and the signature covers the body
+        await prepared_request.aread()
+        start_time = monotonic()
+        signed_request = self.sign_request(prepared_request=prepared_request)
+        if instrumentation.listeners:
+            instrumentation.emit(
+                instrumentation.REQUEST_SIGNED,
+                method=method,
+                url=url,
+                duration=monotonic() - start_time,
+            )
+        start_time = monotonic()
+        try:
+            raw_response = await http_client.send(signed_request)
+        except httpx.RequestError as exception:
+            translated = translate_exception(exception)
+            if instrumentation.listeners:
+                instrumentation.emit(
+                    instrumentation.REQUEST_FAILED,
+                    method=method,
+                    url=url,
+                    exception=translated,
+                    duration=monotonic() - start_time,
+                )
+            raise translated from exception
+        elapsed = timedelta(seconds=monotonic() - start_time)
+        response = build_response(raw_response, elapsed=elapsed)
+        if instrumentation.listeners:
+            instrumentation.emit(
+                instrumentation.RESPONSE_RECEIVED,
+                method=method,
+                url=url,
+                status_code=response.status_code,
+                duration=elapsed.total_seconds(),
+                bytes_sent=len(signed_request.content),
+                bytes_received=len(response.content),
+                connection_reused=response.connection_reused,
+            )
+        return response
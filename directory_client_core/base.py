@@ -1,37 +1,289 @@
 import abc
-import json
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import logging
+import threading
+import time
 import urllib.parse as urlparse
 
 from monotonic import monotonic
 import requests
+from requests.exceptions import RequestException
 
 from sigauth.helpers import RequestSigner
 
+from directory_client_core import (
+    instrumentation, json_backends, sessions, transports
+)
+from directory_client_core.multipart import MultipartEncoder
+
 
 logger = logging.getLogger(__name__)
 
 
-class AbstractAPIClient(abc.ABC):
+DEFAULT_MAX_CONCURRENT_REQUESTS = 10
+
+
+def normalize_get_spec(spec):
+    """
+    Converts a `get_many` item - a dict of keyword arguments for `get`, or a
+    tuple of (url, params, authenticator) - into keyword arguments for
+    `request_many`.
+
+    """
+
+    if isinstance(spec, dict):
+        return {'method': 'GET', **spec}
+    if isinstance(spec, str):
+        spec = (spec,)
+    keys = ('url', 'params', 'authenticator')
+    return {'method': 'GET', **dict(zip(keys, spec))}
+
+
+class BaseAPIClient(abc.ABC):
+    """
+    Behaviour shared by the sync and async clients: building urls and
+    headers, and signing requests.
+
+    """
 
     @property
     @abc.abstractmethod
     def version():
         pass
 
-    def __init__(self, base_url, api_key, sender_id, timeout):
+    def __init__(
+        self, base_url, api_key, sender_id, timeout, retry_policy=None,
+        circuit_breaker=None, json_backend=None,
+    ):
         self.base_url = base_url
         self.request_signer = RequestSigner(
             secret=api_key, sender_id=sender_id
         )
         self.timeout = timeout
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        # a `json_backends` backend, or the name of one
+        if isinstance(json_backend, str):
+            json_backend = json_backends.get_backend(json_backend)
+        self.json_backend = json_backend or json_backends.get_default()
+
+    @staticmethod
+    @functools.lru_cache(maxsize=2048)
+    def build_url(base_url, partial_url):
+        """
+        Makes sure the URL is built properly.
+
+        >>> urllib.parse.urljoin('https://test.com/1/', '2/3')
+        https://test.com/1/2/3
+        >>> urllib.parse.urljoin('https://test.com/1/', '/2/3')
+        https://test.com/2/3
+        >>> urllib.parse.urljoin('https://test.com/1', '2/3')
+        https://test.com/2/3'
+        """
+        if not base_url.endswith('/'):
+            base_url += '/'
+        if partial_url.startswith('/'):
+            partial_url = partial_url[1:]
+
+        return urlparse.urljoin(base_url, partial_url)
+
+    @functools.cached_property
+    def base_headers(self):
+        return {
+            "User-agent": "EXPORT-DIRECTORY-API-CLIENT/{}".format(self.version)
+        }
+
+    def build_headers(
+        self, content_type=None, authenticator=None, cache_control=None
+    ):
+        headers = self.base_headers.copy()
+
+        if authenticator:
+            headers.update(authenticator.headers)
+
+        if cache_control:
+            headers.update(cache_control.headers)
+
+        if content_type:
+            headers["Content-type"] = content_type
+
+        return headers
+
+    def sign_request(self, prepared_request):
+        body = prepared_request.body
+        # a streamed body is read in chunks to compute the signature, then
+        # rewound to be sent
+        is_stream = hasattr(body, 'read') and hasattr(body, 'seek')
+        if is_stream:
+            body.seek(0)
+        headers = self.request_signer.get_signature_headers(
+            url=prepared_request.path_url,
+            body=body,
+            method=prepared_request.method,
+            content_type=prepared_request.headers.get('Content-Type'),
+        )
+        if is_stream:
+            body.seek(0)
+        prepared_request.headers.update(headers)
+        return prepared_request
+
+    def get_retry_delay(
+        self, method, attempt, start_time, files, response=None,
+        exception=None, url=None,
+    ):
+        # file objects have been read by the failed attempt
+        if self.retry_policy is None or files:
+            return None
+        delay = self.retry_policy.get_retry_delay(
+            method=method,
+            attempt=attempt,
+            elapsed=monotonic() - start_time,
+            timeout=self.timeout,
+            response=response,
+            exception=exception,
+        )
+        if delay is not None:
+            logger.debug(
+                "API %s request attempt %s failed, retrying in %s",
+                method, attempt, delay,
+            )
+            if instrumentation.listeners:
+                instrumentation.emit(
+                    instrumentation.REQUEST_RETRIED,
+                    method=method,
+                    url=url,
+                    attempt=attempt,
+                    delay=delay,
+                    status_code=getattr(response, 'status_code', None),
+                    exception=exception,
+                )
+        return delay
+
+    @staticmethod
+    def emit_finished(method, url, start_time, attempt, response):
+        instrumentation.emit(
+            instrumentation.REQUEST_FINISHED,
+            method=method,
+            url=url,
+            status_code=getattr(response, 'status_code', None),
+            duration=monotonic() - start_time,
+            attempts=attempt,
+        )
+
+
+class AbstractAPIClient(BaseAPIClient):
+
+    def __init__(
+        self, base_url, api_key, sender_id, timeout,
+        pool_connections=sessions.DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize=sessions.DEFAULT_POOL_MAXSIZE,
+        pool_block=sessions.DEFAULT_POOL_BLOCK,
+        thread_local_session=True,
+        max_concurrent_requests=DEFAULT_MAX_CONCURRENT_REQUESTS,
+        retry_policy=None,
+        circuit_breaker=None,
+        json_backend=None,
+        transport=None,
+    ):
+        super().__init__(
+            base_url=base_url,
+            api_key=api_key,
+            sender_id=sender_id,
+            timeout=timeout,
+            retry_policy=retry_policy,
+            circuit_breaker=circuit_breaker,
+            json_backend=json_backend,
+        )
+        # the pool arguments apply to the default transport
+        if transport is None:
+            transport = transports.RequestsTransport(
+                sessions.SessionManager(
+                    pool_connections=pool_connections,
+                    pool_maxsize=pool_maxsize,
+                    pool_block=pool_block,
+                    thread_local=thread_local_session,
+                )
+            )
+        self.transport = transport
+        self.session_manager = getattr(transport, 'session_manager', None)
+        self.max_concurrent_requests = max_concurrent_requests
+        self.executor = None
+        self.executor_generation = None
+        self.executor_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Closes the pooled connections. Later requests open new ones."""
+        self.transport.close()
+        with self.executor_lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def get_executor(self):
+        with self.executor_lock:
+            # worker threads do not survive a fork
+            if (
+                self.executor is None or
+                self.executor_generation != sessions._fork_generation
+            ):
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrent_requests,
+                    thread_name_prefix='directory-client',
+                )
+                self.executor_generation = sessions._fork_generation
+            return self.executor
+
+    def request_many(self, calls):
+        """
+        Makes the calls concurrently, at most `max_concurrent_requests` at a
+        time, sharing the client's connection pool.
+
+        Each call is a dict with a `method` (GET, POST, PUT, PATCH or DELETE)
+        and the keyword arguments for the client method of that name, so a
+        `get` decorated with `helpers.fallback` is honoured.
+
+        Returns a list in the same order as `calls`, holding the response or
+        the exception raised for each call.
+
+        """
+
+        executor = self.get_executor()
+        futures = []
+        for call in calls:
+            kwargs = dict(call)
+            method = getattr(self, kwargs.pop('method').lower())
+            futures.append(executor.submit(method, **kwargs))
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as exception:
+                results.append(exception)
+        return results
+
+    def get_many(self, specs):
+        """
+        `request_many` for GET requests. Each spec is a tuple of
+        (url, params, authenticator) - trailing items can be omitted - or a
+        dict of keyword arguments for `get`.
+
+        """
+
+        return self.request_many([normalize_get_spec(spec) for spec in specs])
 
     def put(self, url, data, authenticator=None):
         return self.request(
             url=url,
             method="PUT",
             content_type="application/json",
-            data=json.dumps(data),
+            data=self.json_backend.dumps(data),
             authenticator=authenticator,
         )
 
@@ -49,18 +301,30 @@ class AbstractAPIClient(abc.ABC):
                 url=url,
                 method="PATCH",
                 content_type="application/json",
-                data=json.dumps(data),
+                data=self.json_backend.dumps(data),
                 authenticator=authenticator,
             )
         return response
 
-    def get(self, url, params=None, authenticator=None, cache_control=None):
+    def get(
+        self, url, params=None, authenticator=None, cache_control=None,
+        stream=False,
+    ):
+        """
+        With `stream` the body is not read up front, and can be read in
+        chunks with `response.iter_content` or parsed item by item with
+        `streaming.iter_json_items`. Close the response if not reading it to
+        the end, to release its connection.
+
+        """
+
         return self.request(
             url=url,
             method="GET",
             params=params,
             authenticator=authenticator,
             cache_control=cache_control,
+            stream=stream,
         )
 
     def post(self, url, data={}, files=None, authenticator=None):
@@ -77,7 +341,7 @@ class AbstractAPIClient(abc.ABC):
                 url=url,
                 method="POST",
                 content_type="application/json",
-                data=json.dumps(data),
+                data=self.json_backend.dumps(data),
                 authenticator=authenticator,
             )
         return response
@@ -90,80 +354,151 @@ class AbstractAPIClient(abc.ABC):
             data=data,
         )
 
-    @staticmethod
-    def build_url(base_url, partial_url):
-        """
-        Makes sure the URL is built properly.
-
-        >>> urllib.parse.urljoin('https://test.com/1/', '2/3')
-        https://test.com/1/2/3
-        >>> urllib.parse.urljoin('https://test.com/1/', '/2/3')
-        https://test.com/2/3
-        >>> urllib.parse.urljoin('https://test.com/1', '2/3')
-        https://test.com/2/3'
-        """
-        if not base_url.endswith('/'):
-            base_url += '/'
-        if partial_url.startswith('/'):
-            partial_url = partial_url[1:]
-
-        return urlparse.urljoin(base_url, partial_url)
-
     def request(
         self, method, url, content_type=None, data=None, params=None,
-        files=None, authenticator=None, cache_control=None,
+        files=None, authenticator=None, cache_control=None, stream=False,
     ):
 
-        logger.debug("API request {} {}".format(method, url))
-        headers = {
-            "User-agent": "EXPORT-DIRECTORY-API-CLIENT/{}".format(self.version)
-        }
-
-        if authenticator:
-            headers.update(authenticator.headers)
-
-        if cache_control:
-            headers.update(cache_control.headers)
-
-        if content_type:
-            headers["Content-type"] = content_type
-
+        logger.debug("API request %s %s", method, url)
+        if files:
+            # streamed from the files, rather than built in memory by requests
+            data = MultipartEncoder(data, files)
+            content_type = data.content_type
+        headers = self.build_headers(
+            content_type=content_type,
+            authenticator=authenticator,
+            cache_control=cache_control,
+        )
         url = self.build_url(self.base_url, url)
 
         start_time = monotonic()
+        if instrumentation.listeners:
+            instrumentation.emit(
+                instrumentation.REQUEST_STARTED, method=method, url=url
+            )
 
+        attempt = 1
+        response = None
         try:
-            return self.send(
-                method=method,
-                url=url,
-                headers=headers,
-                data=data,
-                params=params,
-                files=files,
-            )
+            while True:
+                # each attempt is prepared and signed afresh by `send`
+                try:
+                    response = self.send_attempt(
+                        method=method,
+                        url=url,
+                        headers=headers,
+                        data=data,
+                        params=params,
+                        stream=stream,
+                    )
+                except RequestException as exception:
+                    response = None
+                    delay = self.get_retry_delay(
+                        method, attempt, start_time, files,
+                        exception=exception, url=url,
+                    )
+                    if delay is None:
+                        raise
+                else:
+                    delay = self.get_retry_delay(
+                        method, attempt, start_time, files,
+                        response=response, url=url,
+                    )
+                    if delay is None:
+                        return response
+                    response.close()
+                time.sleep(delay)
+                attempt += 1
         finally:
-            elapsed_time = monotonic() - start_time
             logger.debug(
-                "API {} request on {} finished in {}".format(
-                    method, url, elapsed_time
-                )
+                "API %s request on %s finished in %s",
+                method, url, monotonic() - start_time,
             )
+            if instrumentation.listeners:
+                self.emit_finished(method, url, start_time, attempt, response)
 
-    def sign_request(self, prepared_request):
-        headers = self.request_signer.get_signature_headers(
-            url=prepared_request.path_url,
-            body=prepared_request.body,
-            method=prepared_request.method,
-            content_type=prepared_request.headers.get('Content-Type'),
-        )
-        prepared_request.headers.update(headers)
+    def send_attempt(self, **kwargs):
+        if self.circuit_breaker is None:
+            return self.send(**kwargs)
+        self.circuit_breaker.before_request(self.base_url)
+        try:
+            response = self.send(**kwargs)
+        except Exception as exception:
+            self.circuit_breaker.record_outcome(
+                self.base_url, exception=exception
+            )
+            raise
+        self.circuit_breaker.record_outcome(self.base_url, response=response)
+        return response
+
+    @staticmethod
+    def prepare_bodyless_request(method, url, headers=None, params=None):
+        """
+        Prepares a GET or HEAD request without a body, skipping the steps of
+        `requests.Request.prepare` that have nothing to do for it (body,
+        cookies and auth).
+
+        """
+
+        prepared_request = requests.PreparedRequest()
+        prepared_request.prepare_method(method)
+        prepared_request.prepare_url(url, params)
+        prepared_request.prepare_headers(headers)
         return prepared_request
 
-    def send(self, method, url, request=None, *args, **kwargs):
+    def send(self, method, url, request=None, *args, stream=False, **kwargs):
 
-        prepared_request = requests.Request(
-            method, url, *args, **kwargs
-        ).prepare()
+        if (
+            method in ('GET', 'HEAD') and not args and
+            not kwargs.get('data') and not kwargs.get('files') and
+            kwargs.keys() <= {'headers', 'params', 'data', 'files'}
+        ):
+            prepared_request = self.prepare_bodyless_request(
+                method,
+                url,
+                headers=kwargs.get('headers'),
+                params=kwargs.get('params'),
+            )
+        else:
+            prepared_request = requests.Request(
+                method, url, *args, **kwargs
+            ).prepare()
 
+        start_time = monotonic()
         signed_request = self.sign_request(prepared_request=prepared_request)
-        return requests.Session().send(signed_request, timeout=self.timeout)
+        if instrumentation.listeners:
+            instrumentation.emit(
+                instrumentation.REQUEST_SIGNED,
+                method=method,
+                url=url,
+                duration=monotonic() - start_time,
+            )
+        start_time = monotonic()
+        try:
+            response = self.transport.send(
+                signed_request, timeout=self.timeout, stream=stream
+            )
+        except RequestException as exception:
+            if instrumentation.listeners:
+                instrumentation.emit(
+                    instrumentation.REQUEST_FAILED,
+                    method=method,
+                    url=url,
+                    exception=exception,
+                    duration=monotonic() - start_time,
+                )
+            raise
+        if instrumentation.listeners:
+            instrumentation.emit(
+                instrumentation.RESPONSE_RECEIVED,
+                method=method,
+                url=url,
+                status_code=response.status_code,
+                duration=monotonic() - start_time,
+                bytes_sent=instrumentation.get_size(signed_request.body),
+                bytes_received=instrumentation.get_received_size(response),
+                connection_reused=getattr(
+                    response, 'connection_reused', None
+                ),
+            )
+        return response
@@ -20,3 +20,7 @@ class AbstractCacheControl(abc.ABC):
 
 class ETagCacheControl(AbstractCacheControl):
     header_name = 'If-None-Match'
+
+
+class LastModifiedCacheControl(AbstractCacheControl):
+    header_name = 'If-Modified-Since'
@@ -0,0 +1,70 @@
+import functools
+import hashlib
+
+
+# `helpers.fallback` stores entries under this prefix and the canonical url
+# without a builder, as versions before entries were wrapped in an envelope
+# read the canonical url key as bytes
+ENTRY_KEY_PREFIX = 'entry:'
+
+
+def vary_by_client_version(client, authenticator):
+    return str(getattr(client, 'version', ''))
+
+
+def vary_by_authenticator(client, authenticator):
+    """
+    Gives each user their own cache entries, for content that depends on
+    who requested it. Do not read legacy keys with this, as those were
+    shared by every user.
+
+    """
+
+    if authenticator is None:
+        return ''
+    return repr(sorted(authenticator.headers.items()))
+
+
+class CacheKeyBuilder:
+    """
+    Builds `helpers.fallback` cache keys of a bounded length, which fit in
+    memcached's 250 character limit whatever the length of the url.
+
+    How this works:
+        - the key is `<namespace>:<version>:<hash>`, where the hash is of
+          the canonical url (the key `helpers.build_cache_key` returns) and
+          the values returned by the `vary` callables. Changing `version`
+          starts a new set of keys
+        - each `vary` callable is called with the client and the
+          authenticator of the request, so the key can differ by e.g.,
+          client version or user
+        - with `read_legacy_keys` entries not found under the new key are
+          read from the keys used without a builder, `entry:<canonical url>`
+          then the canonical url, so a cache filled before the builder was
+          used stays readable. Entries are stored under the new key only
+
+    """
+
+    def __init__(
+        self, namespace='directory-client-core', version=1, vary=(),
+        read_legacy_keys=True, maxsize=4096,
+    ):
+        self.prefix = f'{namespace}:{version}:'
+        self.vary = tuple(vary)
+        self.read_legacy_keys = read_legacy_keys
+        self.hash = functools.lru_cache(maxsize=maxsize)(self.hash)
+
+    def hash(self, value):
+        return self.prefix + hashlib.sha256(value.encode()).hexdigest()
+
+    def build(self, canonical_key, client=None, authenticator=None):
+        if not self.vary:
+            return self.hash(canonical_key)
+        parts = [canonical_key]
+        parts.extend(vary(client, authenticator) for vary in self.vary)
+        return self.hash('\n'.join(parts))
+
+    def get_legacy_keys(self, canonical_key):
+        if not self.read_legacy_keys:
+            return ()
+        return (ENTRY_KEY_PREFIX + canonical_key, canonical_key)
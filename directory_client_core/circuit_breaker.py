@@ -0,0 +1,209 @@
+from collections import deque
+import threading
+import time
+
+from monotonic import monotonic
+from requests.exceptions import RequestException
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreakerOpen(RequestException):
+    """
+    Raised instead of making a request while the circuit is open. It is a
+    `RequestException`, so `helpers.fallback` serves cached content for it.
+
+    """
+
+
+class CircuitState:
+    def __init__(self):
+        self.state = CLOSED
+        self.outcomes = deque()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_calls = 0
+        self.shared_checked_at = None
+
+
+class CircuitBreaker:
+    """
+    Fails requests fast while the remote server appears to be down, instead
+    of making every request wait for the timeout.
+
+    How this works:
+        - state is kept per key (the client's `base_url`), so one breaker can
+          be shared by several clients
+        - outcomes of the requests made in the past `window_seconds` are
+          recorded. Exceptions and 5xx responses are failures
+        - once at least `minimum_requests` were made in the window and the
+          proportion that failed reaches `failure_rate_threshold` the circuit
+          opens, and requests raise `CircuitBreakerOpen` without being made
+        - after `cool_off_seconds` the circuit is half open: up to
+          `half_open_max_calls` trial requests are let through. If one
+          succeeds the circuit closes, if one fails it opens again
+        - if a `cache` is given, opening the circuit is recorded there for
+          `cool_off_seconds` so other processes open their circuit too. It
+          is checked at most every `shared_check_seconds` per key, to keep
+          cache round trips off most requests
+
+    """
+
+    shared_key_prefix = 'circuit-breaker-open-'
+
+    def __init__(
+        self, failure_rate_threshold=0.5, minimum_requests=10,
+        window_seconds=30, cool_off_seconds=30, half_open_max_calls=1,
+        cache=None, shared_check_seconds=1,
+    ):
+        self.failure_rate_threshold = failure_rate_threshold
+        self.minimum_requests = minimum_requests
+        self.window_seconds = window_seconds
+        self.cool_off_seconds = cool_off_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.cache = cache
+        self.shared_check_seconds = shared_check_seconds
+        self.lock = threading.Lock()
+        self.states = {}
+
+    def get_state(self, key):
+        state = self.states.get(key)
+        if state is None:
+            with self.lock:
+                state = self.states.setdefault(key, CircuitState())
+        return state
+
+    def create_shared_key(self, key):
+        return self.shared_key_prefix + key
+
+    def get_state_name(self, key):
+        """Returns the current state of the circuit, for monitoring."""
+
+        state = self.get_state(key)
+        with self.lock:
+            self.update_state(state, monotonic())
+            return state.state
+
+    def update_state(self, state, now):
+        if state.state == OPEN and now - state.opened_at >= self.cool_off_seconds:
+            state.state = HALF_OPEN
+            state.trial_calls = 0
+
+    def is_shared_check_due(self, state, now):
+        if self.cache is None or state.state != CLOSED:
+            return False
+        if (
+            state.shared_checked_at is not None and
+            now - state.shared_checked_at < self.shared_check_seconds
+        ):
+            return False
+        state.shared_checked_at = now
+        return True
+
+    def open_from_shared(self, state, opened_at, now):
+        # the time left of the cool off in the other process
+        elapsed = max(0, time.time() - opened_at)
+        with self.lock:
+            if state.state == CLOSED:
+                self.open(state, now - elapsed)
+
+    def admit(self, key, state, now):
+        with self.lock:
+            self.update_state(state, now)
+            if state.state == OPEN:
+                raise CircuitBreakerOpen(f'Circuit open for {key}')
+            if state.state == HALF_OPEN:
+                if state.trial_calls >= self.half_open_max_calls:
+                    raise CircuitBreakerOpen(f'Circuit half open for {key}')
+                state.trial_calls += 1
+
+    def before_request(self, key):
+        """Raises `CircuitBreakerOpen` if the request must not be made."""
+
+        state = self.get_state(key)
+        now = monotonic()
+        with self.lock:
+            is_check_due = self.is_shared_check_due(state, now)
+        if is_check_due:
+            opened_at = self.cache.get(self.create_shared_key(key))
+            if opened_at is not None:
+                self.open_from_shared(state, opened_at, now)
+        self.admit(key, state, now)
+
+    async def abefore_request(self, key):
+        state = self.get_state(key)
+        now = monotonic()
+        with self.lock:
+            is_check_due = self.is_shared_check_due(state, now)
+        if is_check_due:
+            opened_at = await self.cache.aget(self.create_shared_key(key))
+            if opened_at is not None:
+                self.open_from_shared(state, opened_at, now)
+        self.admit(key, state, now)
+
+    def open(self, state, now):
+        state.state = OPEN
+        state.opened_at = now
+        state.outcomes.clear()
+        state.failures = 0
+
+    def record(self, key, success):
+        """
+        Records the outcome of a request. Returns True if it opened the
+        circuit, in which case the caller shares that through the cache.
+
+        """
+
+        state = self.get_state(key)
+        now = monotonic()
+        with self.lock:
+            if state.state == HALF_OPEN:
+                if success:
+                    state.state = CLOSED
+                    state.outcomes.clear()
+                    state.failures = 0
+                    return False
+                self.open(state, now)
+                return True
+            if state.state == OPEN:
+                return False
+            state.outcomes.append((now, success))
+            state.failures += not success
+            while state.outcomes and (
+                now - state.outcomes[0][0] > self.window_seconds
+            ):
+                _, outcome = state.outcomes.popleft()
+                state.failures -= not outcome
+            total = len(state.outcomes)
+            if (
+                total >= self.minimum_requests and
+                state.failures / total >= self.failure_rate_threshold
+            ):
+                self.open(state, now)
+                return True
+        return False
+
+    @staticmethod
+    def is_success(response=None, exception=None):
+        return exception is None and response.status_code < 500
+
+    def record_outcome(self, key, response=None, exception=None):
+        opened = self.record(key, self.is_success(response, exception))
+        if opened and self.cache is not None:
+            self.cache.set(
+                self.create_shared_key(key),
+                time.time(),
+                timeout=self.cool_off_seconds,
+            )
+
+    async def arecord_outcome(self, key, response=None, exception=None):
+        opened = self.record(key, self.is_success(response, exception))
+        if opened and self.cache is not None:
+            await self.cache.aset(
+                self.create_shared_key(key),
+                time.time(),
+                timeout=self.cool_off_seconds,
+            )
@@ -0,0 +1,121 @@
+import io
+import zlib
+
+
+class Codec:
+    """
+    Compresses cached bodies. `codec_id` is the header byte stored in front
+    of the compressed body, which tells which codec decompresses it.
+
+    """
+
+    codec_id = None
+
+    def compress(self, data):
+        raise NotImplementedError
+
+    def decompress(self, data):
+        raise NotImplementedError
+
+
+class IdentityCodec(Codec):
+    codec_id = 0
+
+    def compress(self, data):
+        return bytes(data)
+
+    def decompress(self, data):
+        return bytes(data)
+
+
+class ZlibCodec(Codec):
+    codec_id = 1
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+codecs = {}
+
+
+def register_codec(codec):
+    """
+    Makes the codec available for decompressing, by its `codec_id`. It must
+    be registered in every process reading the cache, before it is read.
+
+    """
+
+    if not 0 <= codec.codec_id <= 255:
+        raise ValueError('codec_id must fit in a byte')
+    codecs[codec.codec_id] = codec
+
+
+register_codec(IdentityCodec())
+register_codec(ZlibCodec())
+
+identity = codecs[IdentityCodec.codec_id]
+
+
+def decode(data):
+    return codecs[data[0]].decompress(memoryview(data)[1:])
+
+
+class Compressor:
+    """
+    Compresses the bodies of `helpers.fallback` cache entries.
+
+    How this works:
+        - bodies smaller than `min_size` bytes, or that `codec` does not make
+          smaller, are stored as they are
+        - either way a header byte identifying the codec is put in front of
+          the body, and the entry is marked as `encoded`, so entries stored
+          without a compressor stay readable and vice versa
+        - the body is decompressed only when it is read, so e.g., a 304
+          response whose body is not used does not pay for it
+
+    """
+
+    def __init__(self, codec=None, min_size=1024):
+        self.codec = codec or ZlibCodec()
+        self.min_size = min_size
+
+    def encode(self, body):
+        codec = identity
+        payload = body
+        if len(body) >= self.min_size:
+            compressed = self.codec.compress(body)
+            if len(compressed) < len(body):
+                codec, payload = self.codec, compressed
+        return bytes([codec.codec_id]) + payload
+
+    def encode_entry(self, cache_entry):
+        if cache_entry.get('encoded') or cache_entry.get('body') is None:
+            return cache_entry
+        return {
+            **cache_entry,
+            'body': self.encode(cache_entry['body']),
+            'encoded': True,
+        }
+
+
+class LazyDecodedBody(io.RawIOBase):
+    """A readable body that is decompressed when first read."""
+
+    def __init__(self, data):
+        self.data = data
+        self.buffer = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        if self.buffer is None:
+            self.buffer = io.BytesIO(decode(self.data))
+            self.data = None
+        return self.buffer.readinto(target)
@@ -1,23 +1,46 @@
-from functools import wraps
-import json
+from collections import Counter, OrderedDict
+from functools import lru_cache, partial, wraps
+import hashlib
 import logging
+import sys
+import threading
+import time
 from urllib.parse import urlencode
 
 import requests
-from requests.exceptions import RequestException
+from requests.exceptions import JSONDecodeError, RequestException
+from requests.utils import guess_json_utf
 from w3lib.url import canonicalize_url
 
 from django.conf import settings
 
-from directory_client_core.cache_control import ETagCacheControl
+from directory_client_core import (
+    cache_keys, compression, instrumentation, json_backends, streaming
+)
+from directory_client_core.cache_control import (
+    ETagCacheControl, LastModifiedCacheControl
+)
+from directory_client_core.revalidation import BackgroundRevalidator
 
 
 logger = logging.getLogger(__name__)
+install_lock = threading.Lock()
 
 
 MESSAGE_CACHE_HIT = 'Fallback cache hit. Using cached content.'
 MESSAGE_CACHE_MISS = 'Fallback cache miss. Cannot use any content.'
 MESSAGE_NOT_FOUND = 'Resource not found.'
+MESSAGE_REVALIDATION_FAILED = 'Fallback cache revalidation failed.'
+MESSAGE_SUPPRESSED = 'Repeated log records suppressed.'
+
+ENTRY_KEY_PREFIX = cache_keys.ENTRY_KEY_PREFIX
+
+# response headers kept alongside the body in the cache entry
+ENTRY_HEADERS = (
+    ('ETag', 'etag'),
+    ('Last-Modified', 'last_modified'),
+    ('Content-Type', 'content_type'),
+)
 
 
 class ThrottlingFilter(logging.Filter):
@@ -26,10 +49,14 @@ class ThrottlingFilter(logging.Filter):
     thereby reducing noise.
 
     How this works:
-        - with `cache.add` the entry is stored only if the key is not yet
-          present in the cache
+        - keys seen by this process are kept in memory for <period of time>,
+          so a repeated record is filtered out without a cache round trip
+        - otherwise with `cache.add` the entry is stored only if the key is
+          not yet present in the cache, so other processes see it too
         - cache.add returns True if the entry is stored, otherwise False
         - these cache entries expire after <period of time>.
+        - the number of records filtered out is logged every
+          <summary period>, as one record per period
 
     Therefore `filter` returns True if the key hasn't been seen in the past
     <period of time>, and False if it has. The logger takes this to mean
@@ -37,40 +64,197 @@ class ThrottlingFilter(logging.Filter):
 
     """
 
-    def __init__(self, cache):
+    def __init__(self, cache, max_local_keys=1024):
         self.cache = cache
         self.timeout_in_seconds = getattr(
             settings,
             'DIRECTORY_CLIENT_CORE_CACHE_LOG_THROTTLING_SECONDS',
             None
         ) or 60*60*24  # default 24 hours
+        self.summary_seconds = getattr(
+            settings,
+            'DIRECTORY_CLIENT_CORE_CACHE_LOG_SUMMARY_SECONDS',
+            None
+        ) or 60*5  # default 5 minutes
+        self.max_local_keys = max_local_keys
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            # key: time it expires, oldest first
+            self.seen = OrderedDict()
+            self.suppressed = Counter()
+            self.summarized_at = time.monotonic()
 
     def create_cache_key(sef, record):
         return f'noise-{record.getMessage()}-{record.url}'
 
+    def check_locally(self, key, now):
+        """Returns True if the key was seen by this process, else None."""
+
+        with self.lock:
+            expires_at = self.seen.get(key)
+            if expires_at is not None and expires_at > now:
+                return True
+        return None
+
+    def record_seen(self, key, now):
+        with self.lock:
+            self.seen[key] = now + self.timeout_in_seconds
+            self.seen.move_to_end(key)
+            while len(self.seen) > self.max_local_keys:
+                self.seen.popitem(last=False)
+
+    def record_result(self, record, is_new, now):
+        if not is_new:
+            with self.lock:
+                self.suppressed[record.msg] += 1
+        self.summarize(now)
+        return is_new
+
+    def summarize(self, now):
+        with self.lock:
+            if now - self.summarized_at < self.summary_seconds:
+                return
+            self.summarized_at = now
+            counts, self.suppressed = dict(self.suppressed), Counter()
+        if counts:
+            logger.info(
+                MESSAGE_SUPPRESSED,
+                extra={'suppressed': counts, 'throttle_summary': True},
+            )
+
     def filter(self, record):
+        if getattr(record, 'throttle_checked', False) or getattr(
+            record, 'throttle_summary', False
+        ):
+            # already passed through `afilter`, or is a summary
+            return True
+        key = self.create_cache_key(record)
+        now = time.monotonic()
+        if self.check_locally(key, now):
+            return self.record_result(record, False, now)
+        is_new = self.cache.add(key, '', timeout=self.timeout_in_seconds)
+        self.record_seen(key, now)
+        return self.record_result(record, is_new, now)
+
+    async def afilter(self, record):
         key = self.create_cache_key(record)
-        return self.cache.add(key, '', timeout=self.timeout_in_seconds)
+        now = time.monotonic()
+        if self.check_locally(key, now):
+            return self.record_result(record, False, now)
+        is_new = await self.cache.aadd(
+            key, '', timeout=self.timeout_in_seconds
+        )
+        self.record_seen(key, now)
+        return self.record_result(record, is_new, now)
+
+
+# encodings `json_backends` backends decode from bytes
+UTF8_ENCODINGS = ('utf-8', 'utf8')
+
+UNDECODED = object()
+
+
+def decode_json(response, json_backend):
+    content = response.content
+    encoding = response.encoding or guess_json_utf(content)
+    try:
+        if encoding and encoding.lower() not in UTF8_ENCODINGS:
+            content = content.decode(encoding)
+        return json_backend.loads(content)
+    except ValueError as error:
+        raise JSONDecodeError(
+            getattr(error, 'msg', str(error)),
+            getattr(error, 'doc', ''),
+            getattr(error, 'pos', 0),
+        )
+
+
+class JSONResponseMixin:
+    """
+    Decodes the body with `json_backend` - the backend of the client that
+    made the request, or the default - once, and returns the same object on
+    later calls e.g., from templates. Copy it before changing it.
+
+    """
+
+    json_backend = None
+    _json = UNDECODED
+
+    def json(self, **kwargs):
+        if kwargs:
+            # arguments of `json.loads` e.g., `object_hook`
+            return super().json(**kwargs)
+        if self._json is UNDECODED:
+            self._json = decode_json(
+                self, self.json_backend or json_backends.get_default()
+            )
+        return self._json
+
+
+def use_json_backend(response, client):
+    if isinstance(response, JSONResponseMixin):
+        response.json_backend = getattr(client, 'json_backend', None)
+    return response
+
+
+def copy_response(response):
+    """
+    Returns a response of its own for a caller that waited on a coalesced
+    request. The body is read once, and its bytes shared, the headers and
+    the decoded JSON are not.
+
+    """
+
+    response.content
+    copied = type(response).__new__(type(response))
+    copied.__dict__ = {
+        **response.__dict__,
+        'headers': response.headers.copy(),
+        'cookies': response.cookies.copy(),
+        'history': list(response.history),
+    }
+    copied.__dict__.pop('_json', None)
+    return copied
 
 
 class PopulateResponseMixin:
 
     @classmethod
     def from_response(cls, raw_response):
-        response = cls()
-        response.__setstate__(raw_response.__getstate__())
+        """
+        Marks `raw_response` as a `cls`. A plain `requests.Response` has its
+        class changed in place rather than being copied, so this costs the
+        same whatever the size of the body, and a streamed body is left
+        unread. The response passed in is the one returned.
+
+        """
+
+        if type(raw_response) is requests.Response:
+            raw_response.__class__ = cls
+            return raw_response
+        # a subclass keeps its own class, so its attributes are shared with
+        # a new `cls` instead
+        response = cls.__new__(cls)
+        response.__dict__ = raw_response.__dict__
         return response
 
 
-class LiveResponse(PopulateResponseMixin, requests.Response):
+class LiveResponse(
+    JSONResponseMixin, PopulateResponseMixin, requests.Response
+):
     pass
 
 
-class FailureResponse(PopulateResponseMixin, requests.Response):
+class FailureResponse(
+    JSONResponseMixin, PopulateResponseMixin, requests.Response
+):
     pass
 
 
-class CacheResponse(requests.Response):
+class CacheResponse(JSONResponseMixin, requests.Response):
 
     @classmethod
     def from_cached_content(cls, cached_content):
@@ -79,70 +263,885 @@ class CacheResponse(requests.Response):
         response._content = cached_content
         return response
 
+    @classmethod
+    def from_cache_entry(cls, cache_entry, body_store=None):
+        if cache_entry.get('body_ref'):
+            # read in chunks from the store as the caller reads the body
+            raw = body_store.open(cache_entry['body_ref'])
+        elif cache_entry.get('encoded'):
+            # decompressed only if the caller reads the body
+            raw = compression.LazyDecodedBody(cache_entry['body'])
+        else:
+            raw = None
+        if raw is None:
+            response = cls.from_cached_content(cache_entry['body'])
+        else:
+            response = cls.from_cached_content(False)
+            response._content_consumed = False
+            response.raw = raw
+        # negative entries are stored with their error status
+        response.status_code = cache_entry.get('status_code', 200)
+        for name, key in ENTRY_HEADERS:
+            if cache_entry.get(key):
+                response.headers[name] = cache_entry[key]
+        return response
+
+
+@lru_cache(maxsize=4096)
+def canonicalize(url, params):
+    return canonicalize_url(url + '?' + urlencode(params))
+
+
+def build_cache_key(url, params):
+    """
+    Returns the canonical url as the cache key. It is memoized, as
+    canonicalizing is slow and the same urls are requested again and again.
+    `params` of None e.g., from a `get_many` spec of (url, None,
+    authenticator), is no params.
+
+    """
+
+    if params is None:
+        params = {}
+    try:
+        return canonicalize(
+            url, tuple(params.items()) if isinstance(params, dict) else params
+        )
+    except TypeError:
+        # not hashable e.g., a list of values
+        return canonicalize_url(url + '?' + urlencode(params))
+
+
+def build_entry_key(url, params):
+    """
+    Returns the key `fallback` stores the entry for `url` and `params` under,
+    without a `cache_keys.CacheKeyBuilder`.
+
+    """
+
+    return ENTRY_KEY_PREFIX + build_cache_key(url, params)
+
+
+def build_keys(key_builder, client, url, params, kwargs):
+    """
+    Returns a tuple of (cache key, legacy keys to also read) for a call of
+    a method decorated by `fallback`.
+
+    """
+
+    canonical_key = build_cache_key(url, params)
+    if key_builder is None:
+        # the canonical url key holds the bytes stored before entries were
+        # wrapped in an envelope, and is still read by those versions
+        return ENTRY_KEY_PREFIX + canonical_key, (canonical_key,)
+    cache_key = key_builder.build(
+        canonical_key, client, kwargs.get('authenticator')
+    )
+    return cache_key, key_builder.get_legacy_keys(canonical_key)
+
+
+def split_values(values, keys, counter_keys):
+    """
+    Returns the value of the first of `keys` in `values` that is set, and
+    the values of `counter_keys`, as read together by one `get_many`.
+
+    """
+
+    counters = {key: values.get(key) for key in counter_keys}
+    for key in keys:
+        if values.get(key):
+            return values[key], counters
+    return None, counters
+
+
+def build_flight_key(cache_key, authenticator):
+    """
+    Returns the key coalesced requests share, so a response requested with
+    one user's credentials is never given to another.
+
+    """
+
+    if authenticator is None:
+        return cache_key
+    credentials = cache_keys.vary_by_authenticator(None, authenticator)
+    return cache_key + '-' + hashlib.sha256(credentials.encode()).hexdigest()
+
+
+def build_entry_metadata(response):
+    metadata = {'stored_at': time.time()}
+    for name, key in ENTRY_HEADERS:
+        metadata[key] = response.headers.get(name)
+    return metadata
+
+
+def build_cache_entry(response):
+    """
+    Wraps the response body in an envelope holding the metadata needed to
+    make conditional requests, so the body never has to be parsed for it.
+
+    """
+
+    return {'body': response.content, **build_entry_metadata(response)}
+
+
+def build_negative_cache_entry(response):
+    return {**build_cache_entry(response), 'status_code': response.status_code}
+
+
+def is_negative(cache_entry):
+    return bool(cache_entry) and cache_entry.get('status_code', 200) >= 400
+
+
+def is_negative_hit(cache_entry, negative_seconds):
+    """Returns whether a negative entry was stored within its TTL."""
+
+    return bool(
+        negative_seconds and
+        time.time() - cache_entry['stored_at'] < negative_seconds
+    )
+
+
+def load_cache_entry(cached_value, body_store=None):
+    if not cached_value:
+        return None
+    if isinstance(cached_value, bytes):
+        # stored before entries were wrapped in an envelope
+        return {'body': cached_value, 'stored_at': None, 'legacy': True}
+    if cached_value.get('body_ref') and (
+        body_store is None or not body_store.exists(cached_value['body_ref'])
+    ):
+        # the body was stored elsewhere e.g., in a file on another host
+        return None
+    return cached_value
+
+
+def retire_body(body_store, previous, cache_entry):
+    """Lets the body store drop the body of the `previous` entry replaced."""
+
+    reference = isinstance(previous, dict) and previous.get('body_ref')
+    if reference and reference != cache_entry.get('body_ref'):
+        body_store.retire(reference)
+
+
+def is_streamed(response):
+    return not response._content_consumed
+
+
+def is_cacheable_stream(response):
+    """Returns whether `response` is cached as the caller reads its body."""
+
+    return is_streamed(response) and response.ok and response.status_code != 304
+
+
+def close_unread(response):
+    """Releases the connection of a streamed response whose body is unused."""
+
+    if is_streamed(response):
+        response.close()
+
+
+def cache_while_streaming(response, writer, on_complete):
+    """
+    Returns the streamed `response` as a `LiveResponse` whose body is written
+    to `writer` as the caller reads it. Once it has been read to the end
+    `on_complete` is called with the cache entry.
+
+    """
+
+    metadata = build_entry_metadata(response)
+    response.raw = streaming.TeeStream(
+        response.raw,
+        writer,
+        on_complete=lambda fields: on_complete({**metadata, **fields}),
+    )
+    return LiveResponse.from_response(response)
+
+
+def get_legacy_etag(body, json_backend=None):
+    try:
+        parsed = (json_backend or json_backends.get_default()).loads(body)
+    except ValueError:
+        return None
+    if isinstance(parsed, dict) and 'etag' in parsed:
+        return f'"{parsed["etag"]}"'
+
+
+def get_cache_control(cache_entry, json_backend=None):
+    if not cache_entry:
+        return None
+    if cache_entry.get('legacy'):
+        etag = get_legacy_etag(cache_entry['body'], json_backend)
+    else:
+        etag = cache_entry.get('etag')
+    if etag:
+        return ETagCacheControl(etag)
+    if cache_entry.get('last_modified'):
+        return LastModifiedCacheControl(cache_entry['last_modified'])
+
+
+def install_log_filter(cache):
+    """
+    Adds a `ThrottlingFilter` to the logger, unless one was added by an
+    earlier `fallback`, in which case that one is returned.
 
-def fallback(cache):
+    """
+
+    with install_lock:
+        for log_filter in logger.filters:
+            if isinstance(log_filter, ThrottlingFilter):
+                return log_filter
+        log_filter = ThrottlingFilter(cache=cache)
+        logger.addFilter(log_filter)
+        return log_filter
+
+
+def resolve_response(
+    response, cache_entry, url, body_store=None, negative_status_codes=(),
+    stale_seconds=None,
+):
+    """
+    Decides what to return for a response retrieved from the remote server.
+
+    Returns a tuple of (response, entry to cache or None, log entry or
+    None), where the log entry is (level, message, context, exc_info). This
+    lets the sync and async wrappers share the decision but perform the
+    cache write and logging in their own way.
+
+    Responses with `negative_status_codes` are cached as negative entries,
+    unless they are streamed. With `stale_seconds` a 304 restarts the stale
+    window of the cached entry.
+
+    """
+
+    log_context = {'status_code': response.status_code, 'url': url}
+    status_code = response.status_code
+    if status_code == 404 or status_code in negative_status_codes:
+        log = (logging.ERROR, MESSAGE_NOT_FOUND, log_context, None)
+        cache_entry = None
+        if status_code in negative_status_codes and not is_streamed(response):
+            cache_entry = build_negative_cache_entry(response)
+        return LiveResponse.from_response(response), cache_entry, log
+    elif response.status_code == 304:
+        close_unread(response)
+        cache_response = CacheResponse.from_cache_entry(cache_entry, body_store)
+        if stale_seconds:
+            return cache_response, refresh_cache_entry(cache_entry), None
+        return cache_response, None, None
+    elif not response.ok:
+        # Successfully requested the content, but the response is
+        # not OK (e.g., 500, 403, etc)
+        if cache_entry:
+            # cached content is returned instead of the live body
+            close_unread(response)
+            log = (logging.ERROR, MESSAGE_CACHE_HIT, log_context, None)
+            cache_response = CacheResponse.from_cache_entry(cache_entry, body_store)
+            return cache_response, None, log
+        else:
+            log = (logging.ERROR, MESSAGE_CACHE_MISS, log_context, True)
+            return FailureResponse.from_response(response), None, log
+    else:
+        cache_entry = build_cache_entry(response)
+        return LiveResponse.from_response(response), cache_entry, None
+
+
+def resolve_request_error(cache_entry, url):
+    """
+    Decides what to do when the request could not be made. Returns a tuple
+    of (outcome, log entry or None): on a HIT `cache_entry` is returned, and
+    on a MISS the exception is raised.
+
+    """
+
+    if cache_entry:
+        return instrumentation.HIT, (
+            logging.ERROR, MESSAGE_CACHE_HIT, {'url': url}, None
+        )
+    return instrumentation.MISS, None
+
+
+def read_locally(local_cache, cache_key):
+    """
+    Returns the entry `local_cache` holds for `cache_key`, and whether it is
+    fresh enough to be returned without reading the shared cache.
+
+    """
+
+    if local_cache is None:
+        return None, False
+    cache_entry, is_fresh = local_cache.get(cache_key)
+    return cache_entry, is_fresh and not is_negative(cache_entry)
+
+
+def resolve_cache_entry(cache_entry, is_current, negative_seconds, stale_seconds):
+    """
+    Decides whether the cached entry is returned without waiting on the
+    request. Returns a tuple of (outcome or None, entry to fall back on):
+    NEGATIVE_HIT and STALE entries are returned straight away, and STALE
+    ones revalidated in the background. With no outcome the request is made.
+
+    Negative entries past their TTL are not fallen back on, and neither
+    negative nor stale entries are returned once invalidated.
+
+    """
+
+    if is_negative(cache_entry):
+        if is_current and is_negative_hit(cache_entry, negative_seconds):
+            return instrumentation.NEGATIVE_HIT, cache_entry
+        cache_entry = None
+    if is_current and is_within_stale_window(cache_entry, stale_seconds):
+        return instrumentation.STALE, cache_entry
+    return None, cache_entry
+
+
+def get_outcome(status_code, cache_entry, negative_status_codes=()):
+    """Returns the `instrumentation` outcome of a live response."""
+
+    if status_code == 304:
+        return instrumentation.NOT_MODIFIED
+    if (
+        status_code == 404 or
+        status_code < 400 or
+        status_code in negative_status_codes
+    ):
+        return instrumentation.LIVE
+    return instrumentation.HIT if cache_entry else instrumentation.MISS
+
+
+def get_error(status_code, outcome):
+    """Returns why the live response was not used, for its outcome."""
+
+    if outcome in (instrumentation.HIT, instrumentation.MISS):
+        return f'status {status_code}'
+    return None
+
+
+def emit_outcome(outcome, url, cache_key, error=None):
+    if instrumentation.listeners:
+        instrumentation.emit(
+            instrumentation.FALLBACK,
+            outcome=outcome,
+            url=url,
+            cache_key=cache_key,
+            error=error,
+        )
+
+
+def write_log(entry):
+    """Logs the log entry of e.g., `resolve_response`, if there is one."""
+
+    if entry:
+        level, message, context, exc_info = entry
+        logger.log(level, message, extra=context, exc_info=exc_info)
+
+
+async def alog(log_filter, level, message, context, exc_info=None):
+    """
+    Logs like `logger.log`, but checks the throttling filter with the async
+    cache API so the event loop is not blocked by the cache round trip.
+
+    """
+
+    if not logger.isEnabledFor(level):
+        return
+    if exc_info is True:
+        exc_info = sys.exc_info()
+    record = logger.makeRecord(
+        logger.name, level, __file__, 0, message, (), exc_info,
+        extra={**context, 'throttle_checked': True},
+    )
+    if await log_filter.afilter(record):
+        logger.handle(record)
+
+
+def store_locally(local_cache, cache_key, cache_entry, fresh=False):
+    if local_cache is not None:
+        size = len(cache_entry['body'] or b'')
+        local_cache.set(cache_key, cache_entry, size=size, fresh=fresh)
+
+
+def get_timeout(cache_entry, negative_seconds):
+    if is_negative(cache_entry):
+        return negative_seconds
+    return settings.DIRECTORY_CLIENT_CORE_CACHE_EXPIRE_SECONDS
+
+
+def is_within_stale_window(cache_entry, stale_seconds):
+    return bool(
+        stale_seconds and
+        cache_entry and
+        cache_entry.get('stored_at') is not None and
+        time.time() - cache_entry['stored_at'] < stale_seconds
+    )
+
+
+def is_stored_since(cache_entry, since):
+    return bool(
+        cache_entry and (cache_entry.get('stored_at') or 0) >= since
+    )
+
+
+def refresh_cache_entry(cache_entry):
+    """Restarts the stale window of an entry the server said is current."""
+
+    return {**cache_entry, 'stored_at': time.time()}
+
+
+def resolve_revalidation(response, cache_entry, url):
+    """
+    Returns a tuple of (entry to cache or None, log entry or None) for the
+    response to a background revalidation request.
+
+    """
+
+    if response.status_code == 304:
+        close_unread(response)
+        return refresh_cache_entry(cache_entry), None
+    elif response.ok:
+        return build_cache_entry(response), None
+    close_unread(response)
+    log_context = {'status_code': response.status_code, 'url': url}
+    return None, (logging.WARNING, MESSAGE_REVALIDATION_FAILED, log_context, None)
+
+
+_revalidator = None
+
+
+def get_revalidator():
+    global _revalidator
+    if _revalidator is None:
+        _revalidator = BackgroundRevalidator(
+            max_workers=getattr(
+                settings, 'DIRECTORY_CLIENT_CORE_REVALIDATION_WORKERS', None
+            ) or 4
+        )
+    return _revalidator
+
+
+def fallback(
+    cache, local_cache=None, stale_seconds=None, revalidator=None,
+    single_flight=None, body_store=None, compressor=None,
+    negative_seconds=None, negative_status_codes=(404,), key_builder=None,
+    invalidator=None,
+):
     """
     Caches content retrieved by the client, thus allowing the cached
     content to be used later if the live content cannot be retrieved.
 
+    If a `local_cache.LocalCache` is given it is checked before `cache`, and
+    entries it considers fresh are returned without making the request.
+
+    If `stale_seconds` is given, cached content stored (or revalidated) less
+    than `stale_seconds` ago is returned straight away, and the request to
+    revalidate it is made in the background by `revalidator`.
+
+    If a `single_flight.SingleFlight` is given, concurrent requests for the
+    same cache key and authenticator share one request to the remote
+    server. Streamed requests are never shared.
+
+    Responses requested with `stream=True` are cached as the caller reads
+    them to the end. If a `body_store` is given e.g.,
+    `streaming.FileBodyStore`, their bodies are written to it in chunks
+    rather than held in memory and stored in `cache`, and cached bodies are
+    read from it in chunks.
+
+    If a `compression.Compressor` is given, bodies are stored compressed.
+
+    If `negative_seconds` is given, responses with `negative_status_codes`
+    e.g., 404 and 410, are cached under the same key for that many seconds,
+    and returned as a `CacheResponse` with their status without making the
+    request. These replace the content cached for the key.
+
+    By default the cache key is the canonical url. A
+    `cache_keys.CacheKeyBuilder` builds hashed keys of a bounded length
+    instead.
+
+    If an `invalidation.TagInvalidator` is given, entries are stored with
+    tags e.g., the prefixes of their path, and `invalidator.invalidate(tag)`
+    invalidates every entry with the tag. Invalidated entries are requested
+    again, and returned only if that request fails.
+
+    The outcome of each call is emitted as an `instrumentation.FALLBACK`
+    event, except for calls that waited on a coalesced request.
+
     """
 
-    log_filter = ThrottlingFilter(cache=cache)
-    logger.filters = []
-    logger.addFilter(log_filter)
+    install_log_filter(cache)
+    from_cache = partial(CacheResponse.from_cache_entry, body_store=body_store)
+    if not negative_seconds:
+        negative_status_codes = ()
+
+    def create_writer(cache_key):
+        if body_store is None:
+            return streaming.MemoryWriter()
+        return body_store.open_writer(cache_key)
+
+    def stream_to_cache(response, cache_key, url, counters=None):
+        return cache_while_streaming(
+            response,
+            create_writer(cache_key),
+            lambda cache_entry: store(
+                cache_key, tag(cache_entry, url, response.headers, counters)
+            ),
+        )
+
+    def store(cache_key, cache_entry):
+        if compressor is not None:
+            cache_entry = compressor.encode_entry(cache_entry)
+        previous = cache.get(cache_key) if body_store is not None else None
+        cache.set(
+            cache_key,
+            cache_entry,
+            get_timeout(cache_entry, negative_seconds),
+        )
+        store_locally(local_cache, cache_key, cache_entry, fresh=True)
+        retire_body(body_store, previous, cache_entry)
+
+    def save(cache_key, response, cache_entry, url, counters):
+        """Stores the entry resolved for `response`, tagged unless a 304."""
+        if cache_entry is None:
+            if response.status_code == 304 and local_cache is not None:
+                local_cache.touch(cache_key)
+        elif response.status_code == 304:
+            store(cache_key, cache_entry)
+        else:
+            store(cache_key, tag(cache_entry, url, response.headers, counters))
+
+    def read(cache_key, legacy_keys=(), counter_keys=()):
+        """Returns the cached entry, and the tag counters of `counter_keys`."""
+        if not legacy_keys and not counter_keys:
+            cached_value, counters = cache.get(cache_key), {}
+        else:
+            cached_value, counters = split_values(
+                cache.get_many([cache_key, *legacy_keys, *counter_keys]),
+                [cache_key, *legacy_keys],
+                counter_keys,
+            )
+        cache_entry = load_cache_entry(cached_value, body_store)
+        if cache_entry:
+            store_locally(local_cache, cache_key, cache_entry)
+        return cache_entry, counters
+
+    def validate(cache_entry, counters, counter_keys):
+        """Returns whether no tag of `cache_entry` was invalidated."""
+        if invalidator is None:
+            return True
+        return invalidator.validate(cache_entry, counters, counter_keys)
+
+    def tag(cache_entry, url, headers, counters=None):
+        if invalidator is None:
+            return cache_entry
+        return invalidator.tag_entry(cache_entry, url, headers, counters)
 
-    def get_cache_control(cached_content):
-        if cached_content:
-            parsed = json.loads(cached_content.decode())
-            if 'etag' in parsed:
-                return ETagCacheControl(f'"{parsed["etag"]}"')
+    def read_stored_since(cache_key, since):
+        cache_entry = load_cache_entry(cache.get(cache_key), body_store)
+        if is_stored_since(cache_entry, since):
+            store_locally(local_cache, cache_key, cache_entry, fresh=True)
+            return from_cache(cache_entry)
 
     def closure(func):
-        @wraps(func)
-        def wrapper(client, url, params={}, *args, **kwargs):
-            cache_key = canonicalize_url(url + '?' + urlencode(params))
-            cached_content = cache.get(cache_key, {})
+
+        def request(client, url, params, cache_entry, *args, **kwargs):
+            return func(
+                client,
+                url=url,
+                params=params,
+                cache_control=get_cache_control(
+                    cache_entry, getattr(client, 'json_backend', None)
+                ),
+                *args,
+                **kwargs,
+            )
+
+        def revalidate(client, url, params, cache_key, cache_entry, counters, *args, **kwargs):
             try:
-                response = func(
-                    client,
-                    url=url,
-                    params=params,
-                    cache_control=get_cache_control(cached_content),
-                    *args,
-                    **kwargs,
-                )
+                response = request(client, url, params, cache_entry, *args, **kwargs)
             except RequestException:
+                logger.warning(MESSAGE_REVALIDATION_FAILED, extra={'url': url})
+                return
+            if is_cacheable_stream(response):
+                response = stream_to_cache(response, cache_key, url, counters)
+                for _ in response.iter_content(streaming.DEFAULT_CHUNK_SIZE):
+                    pass
+                return
+            new_cache_entry, log = resolve_revalidation(
+                response=response, cache_entry=cache_entry, url=url,
+            )
+            write_log(log)
+            save(cache_key, response, new_cache_entry, url, counters)
+
+        def fetch(client, url, params, cache_key, cache_entry, counters, is_current, *args, **kwargs):
+            try:
+                # an invalidated entry is not sent as a conditional request
+                response = request(
+                    client, url, params, cache_entry if is_current else None,
+                    *args, **kwargs
+                )
+            except RequestException as exception:
                 # Failed to create the request e.g., the remote server is down,
                 # perhaps a timeout occurred, or even connection closed by
                 # remote, etc.
-                if cached_content:
-                    logger.error(MESSAGE_CACHE_HIT, extra={'url': url})
-                    return CacheResponse.from_cached_content(cached_content)
-                else:
+                outcome, log = resolve_request_error(cache_entry, url)
+                write_log(log)
+                emit_outcome(outcome, url, cache_key, repr(exception))
+                if outcome == instrumentation.MISS:
                     raise
-            else:
-                log_context = {'status_code': response.status_code, 'url': url}
-                if response.status_code == 404:
-                    logger.error(MESSAGE_NOT_FOUND, extra=log_context)
-                    return LiveResponse.from_response(response)
-                elif response.status_code == 304:
-                    return CacheResponse.from_cached_content(cached_content)
-                elif not response.ok:
-                    # Successfully requested the content, but the response is
-                    # not OK (e.g., 500, 403, etc)
-                    if cached_content:
-                        logger.error(MESSAGE_CACHE_HIT, extra=log_context)
-                        return CacheResponse.from_cached_content(cached_content) # noqa
-                    else:
-                        logger.exception(MESSAGE_CACHE_MISS, extra=log_context)
-                        return FailureResponse.from_response(response)
-                else:
-                    cache.set(
-                        cache_key,
-                        response.content,
-                        settings.DIRECTORY_CLIENT_CORE_CACHE_EXPIRE_SECONDS
-                    )
-                    return LiveResponse.from_response(response)
-            raise NotImplementedError('unreachable')
+                return from_cache(cache_entry)
+            outcome = get_outcome(
+                response.status_code, cache_entry, negative_status_codes
+            )
+            emit_outcome(
+                outcome, url, cache_key, get_error(response.status_code, outcome)
+            )
+            if is_cacheable_stream(response):
+                return stream_to_cache(response, cache_key, url, counters)
+            live_response = response
+            response, new_cache_entry, log = resolve_response(
+                response=response,
+                cache_entry=cache_entry,
+                url=url,
+                body_store=body_store,
+                negative_status_codes=negative_status_codes,
+                stale_seconds=stale_seconds,
+            )
+            write_log(log)
+            save(cache_key, live_response, new_cache_entry, url, counters)
+            return response
+
+        def get_response(client, url, params={}, *args, **kwargs):
+            cache_key, legacy_keys = build_keys(
+                key_builder, client, url, params, kwargs
+            )
+            counter_keys = invalidator.get_path_keys(url) if invalidator else ()
+            counters = {}
+            cache_entry, is_fresh = read_locally(local_cache, cache_key)
+            if is_fresh:
+                emit_outcome(instrumentation.HIT, url, cache_key)
+                return from_cache(cache_entry)
+            if cache_entry is None:
+                cache_entry, counters = read(cache_key, legacy_keys, counter_keys)
+            # an invalidated entry is only returned if the request fails
+            is_current = validate(cache_entry, counters, counter_keys)
+            outcome, cache_entry = resolve_cache_entry(
+                cache_entry, is_current, negative_seconds, stale_seconds
+            )
+            if outcome == instrumentation.STALE:
+                (revalidator or get_revalidator()).submit(
+                    cache_key,
+                    partial(
+                        revalidate, client, url, params, cache_key,
+                        cache_entry, counters, *args, **kwargs
+                    ),
+                )
+            if outcome:
+                emit_outcome(outcome, url, cache_key)
+                return from_cache(cache_entry)
+            fetch_live = partial(
+                fetch, client, url, params, cache_key, cache_entry, counters,
+                is_current, *args, **kwargs
+            )
+            if single_flight is None or kwargs.get('stream'):
+                return fetch_live()
+            return single_flight.do(
+                build_flight_key(cache_key, kwargs.get('authenticator')),
+                fetch_live,
+                after_wait=partial(read_stored_since, cache_key, time.time()),
+                copy=copy_response,
+            )
+
+        @wraps(func)
+        def wrapper(client, *args, **kwargs):
+            return use_json_backend(get_response(client, *args, **kwargs), client)
+        return wrapper
+    return closure
+
+
+def async_fallback(
+    cache, local_cache=None, stale_seconds=None, revalidator=None,
+    single_flight=None, compressor=None,
+    negative_seconds=None, negative_status_codes=(404,), key_builder=None,
+    invalidator=None,
+):
+    """
+    `fallback` for coroutine methods e.g., `AsyncAbstractAPIClient.get`,
+    using the async cache API so the event loop is never blocked. Background
+    revalidation runs as a task on the event loop.
+
+    The decisions are made by the same functions as in `fallback`, only the
+    cache reads and writes and the logging differ. There is no `body_store`:
+    the async client reads bodies in full, and body stores are read with
+    blocking I/O, so entries whose bodies were streamed to a body store are
+    requested again.
+
+    """
+
+    log_filter = install_log_filter(cache)
+    from_cache = CacheResponse.from_cache_entry
+    if not negative_seconds:
+        negative_status_codes = ()
+
+    async def store(cache_key, cache_entry):
+        if compressor is not None:
+            cache_entry = compressor.encode_entry(cache_entry)
+        await cache.aset(
+            cache_key,
+            cache_entry,
+            get_timeout(cache_entry, negative_seconds),
+        )
+        store_locally(local_cache, cache_key, cache_entry, fresh=True)
+
+    async def save(cache_key, response, cache_entry, url, counters):
+        if cache_entry is None:
+            if response.status_code == 304 and local_cache is not None:
+                local_cache.touch(cache_key)
+        elif response.status_code == 304:
+            await store(cache_key, cache_entry)
+        else:
+            await store(cache_key, await tag(
+                cache_entry, url, response.headers, counters
+            ))
+
+    async def read(cache_key, legacy_keys=(), counter_keys=()):
+        if not legacy_keys and not counter_keys:
+            cached_value, counters = await cache.aget(cache_key), {}
+        else:
+            cached_value, counters = split_values(
+                await cache.aget_many([cache_key, *legacy_keys, *counter_keys]),
+                [cache_key, *legacy_keys],
+                counter_keys,
+            )
+        cache_entry = load_cache_entry(cached_value)
+        if cache_entry:
+            store_locally(local_cache, cache_key, cache_entry)
+        return cache_entry, counters
+
+    async def validate(cache_entry, counters, counter_keys):
+        if invalidator is None:
+            return True
+        return await invalidator.avalidate(cache_entry, counters, counter_keys)
+
+    async def tag(cache_entry, url, headers, counters=None):
+        if invalidator is None:
+            return cache_entry
+        return await invalidator.atag_entry(cache_entry, url, headers, counters)
+
+    async def write_log(log):
+        if log:
+            await alog(log_filter, *log)
+
+    async def read_stored_since(cache_key, since):
+        cache_entry = load_cache_entry(await cache.aget(cache_key))
+        if is_stored_since(cache_entry, since):
+            store_locally(local_cache, cache_key, cache_entry, fresh=True)
+            return from_cache(cache_entry)
+
+    def closure(func):
+
+        async def request(client, url, params, cache_entry, *args, **kwargs):
+            return await func(
+                client,
+                url=url,
+                params=params,
+                cache_control=get_cache_control(
+                    cache_entry, getattr(client, 'json_backend', None)
+                ),
+                *args,
+                **kwargs,
+            )
+
+        async def revalidate(client, url, params, cache_key, cache_entry, counters, *args, **kwargs):
+            try:
+                response = await request(
+                    client, url, params, cache_entry, *args, **kwargs
+                )
+            except RequestException:
+                await alog(
+                    log_filter, logging.WARNING, MESSAGE_REVALIDATION_FAILED,
+                    {'url': url},
+                )
+                return
+            new_cache_entry, log = resolve_revalidation(
+                response=response, cache_entry=cache_entry, url=url,
+            )
+            await write_log(log)
+            await save(cache_key, response, new_cache_entry, url, counters)
+
+        async def fetch(client, url, params, cache_key, cache_entry, counters, is_current, *args, **kwargs):
+            try:
+                # an invalidated entry is not sent as a conditional request
+                response = await request(
+                    client, url, params, cache_entry if is_current else None,
+                    *args, **kwargs
+                )
+            except RequestException as exception:
+                outcome, log = resolve_request_error(cache_entry, url)
+                await write_log(log)
+                emit_outcome(outcome, url, cache_key, repr(exception))
+                if outcome == instrumentation.MISS:
+                    raise
+                return from_cache(cache_entry)
+            outcome = get_outcome(
+                response.status_code, cache_entry, negative_status_codes
+            )
+            emit_outcome(
+                outcome, url, cache_key, get_error(response.status_code, outcome)
+            )
+            live_response = response
+            response, new_cache_entry, log = resolve_response(
+                response=response,
+                cache_entry=cache_entry,
+                url=url,
+                negative_status_codes=negative_status_codes,
+                stale_seconds=stale_seconds,
+            )
+            await write_log(log)
+            await save(cache_key, live_response, new_cache_entry, url, counters)
+            return response
+
+        async def get_response(client, url, params={}, *args, **kwargs):
+            cache_key, legacy_keys = build_keys(
+                key_builder, client, url, params, kwargs
+            )
+            counter_keys = invalidator.get_path_keys(url) if invalidator else ()
+            counters = {}
+            cache_entry, is_fresh = read_locally(local_cache, cache_key)
+            if is_fresh:
+                emit_outcome(instrumentation.HIT, url, cache_key)
+                return from_cache(cache_entry)
+            if cache_entry is None:
+                cache_entry, counters = await read(
+                    cache_key, legacy_keys, counter_keys
+                )
+            is_current = await validate(cache_entry, counters, counter_keys)
+            outcome, cache_entry = resolve_cache_entry(
+                cache_entry, is_current, negative_seconds, stale_seconds
+            )
+            if outcome == instrumentation.STALE:
+                (revalidator or get_revalidator()).submit_async(
+                    cache_key,
+                    partial(
+                        revalidate, client, url, params, cache_key,
+                        cache_entry, counters, *args, **kwargs
+                    ),
+                )
+            if outcome:
+                emit_outcome(outcome, url, cache_key)
+                return from_cache(cache_entry)
+            fetch_live = partial(
+                fetch, client, url, params, cache_key, cache_entry, counters,
+                is_current, *args, **kwargs
+            )
+            if single_flight is None or kwargs.get('stream'):
+                return await fetch_live()
+            return await single_flight.ado(
+                build_flight_key(cache_key, kwargs.get('authenticator')),
+                fetch_live,
+                after_wait=partial(read_stored_since, cache_key, time.time()),
+                copy=copy_response,
+            )
+
+        @wraps(func)
+        async def wrapper(client, *args, **kwargs):
+            response = await get_response(client, *args, **kwargs)
+            return use_json_backend(response, client)
         return wrapper
     return closure
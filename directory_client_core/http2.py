@@ -0,0 +1,110 @@
+"""
+An HTTP/2 transport for `AbstractAPIClient`, which needs httpx and h2:
+
+    pip install directory-client-core[http2]
+
+The asyncio client takes `http2=True` instead.
+
+"""
+from datetime import timedelta
+import threading
+
+from monotonic import monotonic
+import httpx
+
+from directory_client_core import async_base, sessions
+
+
+class HTTP2Transport:
+    """
+    Sends requests over HTTP/2 with a `httpx.Client`, so concurrent requests
+    to a host e.g., from `request_many`, are multiplexed over one connection
+    rather than each needing their own.
+
+    How this works:
+        - the signed `requests.PreparedRequest` is sent as it is, and a
+          `requests.Response` is returned, so signing, retries and
+          `helpers.fallback` work as with the default transport
+        - HTTP/2 is negotiated with https servers, and HTTP/1.1 is used with
+          those that do not offer it. `prior_knowledge` speaks HTTP/2 to plain
+          http:// servers without negotiating it
+        - failures raise the same `requests` exceptions
+        - as with `sessions.SessionManager`, the connections inherited by a
+          forked process are dropped and new ones are opened
+
+    """
+
+    def __init__(
+        self, max_connections=async_base.DEFAULT_MAX_CONNECTIONS,
+        max_keepalive_connections=async_base.DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+        prior_knowledge=False,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self.prior_knowledge = prior_knowledge
+        self.lock = threading.Lock()
+        self.generation = sessions._fork_generation
+        # raises ImportError now, rather than on the first request, if h2 is
+        # not installed
+        self.http_client = self.create_http_client()
+
+    def create_http_client(self):
+        return httpx.Client(
+            limits=self.limits,
+            follow_redirects=True,
+            http1=not self.prior_knowledge,
+            http2=True,
+        )
+
+    def get_http_client(self):
+        # connections inherited from the parent process are abandoned
+        if (
+            self.http_client is None or
+            self.generation != sessions._fork_generation
+        ):
+            with self.lock:
+                if (
+                    self.http_client is None or
+                    self.generation != sessions._fork_generation
+                ):
+                    self.http_client = self.create_http_client()
+                    self.generation = sessions._fork_generation
+        return self.http_client
+
+    @staticmethod
+    def get_timeout(timeout):
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return httpx.Timeout(read, connect=connect)
+        return httpx.Timeout(timeout)
+
+    def send(self, prepared_request, timeout, stream=False):
+        http_client = self.get_http_client()
+        request = http_client.build_request(
+            prepared_request.method,
+            prepared_request.url,
+            headers=prepared_request.headers,
+            content=prepared_request.body,
+            timeout=self.get_timeout(timeout),
+        )
+        start_time = monotonic()
+        try:
+            raw_response = http_client.send(request, stream=stream)
+        except httpx.RequestError as exception:
+            raise async_base.translate_exception(exception) from exception
+        response = async_base.build_response(
+            raw_response,
+            elapsed=timedelta(seconds=monotonic() - start_time),
+            stream=stream,
+        )
+        response.request = prepared_request
+        return response
+
+    def close(self):
+        with self.lock:
+            http_client = self.http_client
+            self.http_client = None
+            if http_client and self.generation == sessions._fork_generation:
+                http_client.close()
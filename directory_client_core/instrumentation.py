@@ -0,0 +1,102 @@
+"""
+Timing and outcome events of the clients and `helpers.fallback`, for
+exporting metrics e.g., to Prometheus, StatsD or OpenTelemetry.
+
+A listener is called with the name of the event and a dict of its data:
+
+    def listener(name, data):
+        if name == instrumentation.RESPONSE_RECEIVED:
+            histogram.labels(data['method']).observe(data['duration'])
+
+    instrumentation.add_listener(listener)
+
+Listeners are called synchronously on the thread (or event loop) making the
+request, so they should be quick. When none are registered no event data is
+built, so the cost is a truthiness check per event.
+
+"""
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# method, url
+REQUEST_STARTED = 'request_started'
+# method, url, duration
+REQUEST_SIGNED = 'request_signed'
+# method, url, status_code, duration, bytes_sent, bytes_received,
+# connection_reused. Emitted per attempt. The sizes are None if unknown e.g.,
+# for a streamed body.
+RESPONSE_RECEIVED = 'response_received'
+# method, url, exception, duration. Emitted per attempt.
+REQUEST_FAILED = 'request_failed'
+# method, url, attempt, delay, status_code, exception
+REQUEST_RETRIED = 'request_retried'
+# method, url, status_code (None if it raised), duration, attempts
+REQUEST_FINISHED = 'request_finished'
+# outcome, url, cache_key, error (why the live response was not used, for
+# HIT and MISS)
+FALLBACK = 'fallback'
+
+# outcomes of `helpers.fallback`
+LIVE = 'LIVE'  # the live response is returned
+HIT = 'HIT'  # cached content is returned in place of the live response
+MISS = 'MISS'  # the live response failed and nothing is cached
+NOT_MODIFIED = '304'  # cached content is returned, as it is up to date
+STALE = 'STALE'  # cached content is returned, and revalidated in background
+NEGATIVE_HIT = 'NEGATIVE_HIT'  # a cached 404 (or other error) is returned
+
+# replaced rather than mutated, so `emit` never sees a list being changed
+listeners = ()
+
+
+def add_listener(listener):
+    global listeners
+    listeners = listeners + (listener,)
+
+
+def remove_listener(listener):
+    global listeners
+    listeners = tuple(item for item in listeners if item is not listener)
+
+
+def emit(name, **data):
+    """
+    Calls the listeners. Callers check `listeners` first, to skip building
+    the event data when there are none.
+
+    """
+
+    for listener in listeners:
+        try:
+            listener(name, data)
+        except Exception:
+            logger.exception('Instrumentation listener failed.')
+
+
+def get_size(body):
+    """Returns the size in bytes of a request body, or None if unknown."""
+
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode())
+    if isinstance(body, (bytes, bytearray)) or hasattr(body, '__len__'):
+        return len(body)
+    return None
+
+
+def get_received_size(response):
+    """
+    Returns the size in bytes of a response body, without reading a body
+    that is streamed. That is taken from Content-Length, or None.
+
+    """
+
+    if response._content_consumed:
+        return len(response.content or b'')
+    try:
+        return int(response.headers['Content-Length'])
+    except (KeyError, ValueError):
+        return None
@@ -0,0 +1,196 @@
+import re
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+
+TAG_SEPARATOR = re.compile(r'[\s,]+')
+
+
+def get_timeout():
+    return settings.DIRECTORY_CLIENT_CORE_CACHE_EXPIRE_SECONDS
+
+
+def create_generation():
+    # a counter created again after it was evicted never returns to a value
+    # an entry was stored with
+    return time.time_ns() // 1000
+
+
+class TagInvalidator:
+    """
+    Invalidates `helpers.fallback` entries by tag, e.g., all the entries
+    under a path when the CMS publishes it.
+
+    How this works:
+        - each tag has a generation counter in `cache`, and an entry is
+          stored with the generations of its tags. `invalidate` increments
+          the counter, so it is one cache operation however many entries
+          have the tag, and no keys are scanned
+        - an entry whose generations are not current is not fresh: it is
+          not returned in place of the request, which is made without
+          conditional headers, but it is still returned if the request
+          fails. Entries stored without tags, e.g., before the invalidator
+          was used, are always current
+        - the tags of an entry are each prefix of its url path e.g.,
+          "/a/", "/a/b/" and "/a/b/c/" for "a/b/c/" (up to `path_depth` of
+          them), and the values in the `header` of its response e.g.,
+          "Cache-Tag: page-1, page-2"
+        - the counters of the path tags are read with the entry, in the same
+          round trip, and those read before the request are stored with its
+          response, so an invalidation during the request is not lost.
+          Counters are created the first time they are read, and expire as
+          entries do. An entry whose counter expired is not current
+        - generations are not read for entries a `local_cache.LocalCache`
+          holds fresh, so those are returned until their fresh window ends
+          however they are invalidated
+
+    """
+
+    def __init__(
+        self, cache, namespace='directory-client-core', path_depth=None,
+        header='Cache-Tag',
+    ):
+        self.cache = cache
+        self.prefix = f'{namespace}:tag:'
+        self.path_depth = path_depth
+        self.header = header
+
+    def get_key(self, tag):
+        return self.prefix + tag
+
+    def get_path_tags(self, url):
+        path = '/' + urlsplit(url).path.lstrip('/')
+        tags = [
+            path[:index + 1] for index, character in enumerate(path)
+            if character == '/' and index
+        ]
+        if not path.endswith('/'):
+            tags.append(path)
+        if self.path_depth is not None:
+            tags = tags[:self.path_depth]
+        return tags
+
+    def get_header_tags(self, headers):
+        value = self.header and headers.get(self.header)
+        if not value:
+            return []
+        return [tag for tag in TAG_SEPARATOR.split(value) if tag]
+
+    def get_path_keys(self, url):
+        return [self.get_key(tag) for tag in self.get_path_tags(url)]
+
+    def get_entry_keys(self, url, headers):
+        tags = self.get_path_tags(url) + self.get_header_tags(headers)
+        return list(dict.fromkeys(self.get_key(tag) for tag in tags))
+
+    @staticmethod
+    def get_unread(keys, counters):
+        return [key for key in dict.fromkeys(keys) if key not in counters]
+
+    @staticmethod
+    def is_current(cache_entry, counters):
+        return all(
+            counters.get(key) == generation
+            for key, generation in cache_entry['tags'].items()
+        )
+
+    def read_counters(self, keys, counters):
+        """
+        Adds the counters of `keys` to `counters`, None for those that do not
+        exist.
+
+        """
+
+        values = self.cache.get_many(keys) if keys else {}
+        counters.update({key: values.get(key) for key in keys})
+        return counters
+
+    def validate(self, cache_entry, counters, keys=()):
+        """
+        Returns whether `cache_entry` is current, i.e., none of its tags were
+        invalidated. `counters` holds the counters already read, and is added
+        to, with those of `keys` too e.g., the path tags of the request.
+
+        Counters that do not exist are created, so an invalidation while the
+        request is made changes the generation the response is stored with.
+
+        """
+
+        tags = (cache_entry or {}).get('tags') or {}
+        self.read_counters(self.get_unread([*keys, *tags], counters), counters)
+        is_current = self.is_current(cache_entry, counters) if tags else True
+        self.create_counters(counters, counters)
+        return is_current
+
+    def create_counters(self, keys, counters):
+        for key in list(keys):
+            if counters.get(key) is None:
+                generation = create_generation()
+                if not self.cache.add(key, generation, get_timeout()):
+                    generation = self.cache.get(key)
+                counters[key] = generation
+
+    def tag_entry(self, cache_entry, url, headers, counters=None):
+        """
+        Returns `cache_entry` with the generations of its tags, using those
+        in `counters` that were read before the request was made.
+
+        """
+
+        counters = dict(counters or {})
+        keys = self.get_entry_keys(url, headers)
+        self.read_counters(self.get_unread(keys, counters), counters)
+        self.create_counters(keys, counters)
+        return {**cache_entry, 'tags': {key: counters[key] for key in keys}}
+
+    def invalidate(self, tag):
+        """Invalidates the entries with `tag`, e.g., "/a/b/" or "page-1"."""
+
+        key = self.get_key(tag)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # no entry was stored with the tag since the counter was evicted
+            if not self.cache.add(key, create_generation(), get_timeout()):
+                self.cache.incr(key)
+
+    async def aread_counters(self, keys, counters):
+        values = await self.cache.aget_many(keys) if keys else {}
+        counters.update({key: values.get(key) for key in keys})
+        return counters
+
+    async def avalidate(self, cache_entry, counters, keys=()):
+        tags = (cache_entry or {}).get('tags') or {}
+        await self.aread_counters(
+            self.get_unread([*keys, *tags], counters), counters
+        )
+        is_current = self.is_current(cache_entry, counters) if tags else True
+        await self.acreate_counters(counters, counters)
+        return is_current
+
+    async def acreate_counters(self, keys, counters):
+        for key in list(keys):
+            if counters.get(key) is None:
+                generation = create_generation()
+                if not await self.cache.aadd(key, generation, get_timeout()):
+                    generation = await self.cache.aget(key)
+                counters[key] = generation
+
+    async def atag_entry(self, cache_entry, url, headers, counters=None):
+        counters = dict(counters or {})
+        keys = self.get_entry_keys(url, headers)
+        await self.aread_counters(self.get_unread(keys, counters), counters)
+        await self.acreate_counters(keys, counters)
+        return {**cache_entry, 'tags': {key: counters[key] for key in keys}}
+
+    async def ainvalidate(self, tag):
+        key = self.get_key(tag)
+        try:
+            await self.cache.aincr(key)
+        except ValueError:
+            if not await self.cache.aadd(
+                key, create_generation(), get_timeout()
+            ):
+                await self.cache.aincr(key)
@@ -0,0 +1,87 @@
+"""
+Encoders and decoders of JSON, used by the clients to encode request bodies
+and by the responses of `helpers.fallback` to decode theirs.
+
+The backend is chosen by name with `DIRECTORY_CLIENT_CORE_JSON_BACKEND`:
+
+    - "stdlib" (the default) the `json` module
+    - "orjson" orjson, which must be installed
+    - "auto" orjson if it is installed, otherwise the `json` module
+
+or per client with its `json_backend` argument.
+
+"""
+import json
+
+from django.conf import settings
+
+
+class StdlibJSONBackend:
+    name = 'stdlib'
+
+    def dumps(self, data):
+        return json.dumps(data)
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonJSONBackend:
+    """
+    orjson encodes and decodes several times faster than the `json` module.
+    It encodes without whitespace, and to bytes. Data it cannot encode e.g.,
+    integers wider than 64 bits, is encoded by the `json` module instead.
+
+    """
+
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+        self.options = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, data):
+        try:
+            return self.orjson.dumps(data, option=self.options)
+        except TypeError:
+            return json.dumps(data)
+
+    def loads(self, data):
+        return self.orjson.loads(data)
+
+
+backend_classes = {
+    StdlibJSONBackend.name: StdlibJSONBackend,
+    OrjsonJSONBackend.name: OrjsonJSONBackend,
+}
+
+_backends = {}
+
+
+def get_backend(name):
+    """Returns the backend called `name`, which is created once."""
+
+    if name not in _backends:
+        if name == 'auto':
+            try:
+                backend = OrjsonJSONBackend()
+            except ImportError:
+                backend = get_backend(StdlibJSONBackend.name)
+        else:
+            backend = backend_classes[name]()
+        _backends[name] = backend
+    return _backends[name]
+
+
+def get_default():
+    """
+    Returns the backend named in settings, or the `json` module if Django
+    settings are not configured e.g., in a script.
+
+    """
+
+    name = None
+    if settings.configured:
+        name = getattr(settings, 'DIRECTORY_CLIENT_CORE_JSON_BACKEND', None)
+    return get_backend(name or StdlibJSONBackend.name)
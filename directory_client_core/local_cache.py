@@ -0,0 +1,106 @@
+from collections import OrderedDict
+import threading
+
+from monotonic import monotonic
+
+
+class LocalCache:
+    """
+    Bounded in-process LRU cache with expiry, used in front of the shared
+    fallback cache to save a network round trip per request.
+
+    How this works:
+        - entries expire `timeout` seconds after being stored
+        - entries stored as `fresh` are considered up to date for
+          `fresh_seconds`, during which the live request can be skipped
+        - the least recently used entries are evicted when more than
+          `max_entries` entries or `max_bytes` bytes are held
+
+    """
+
+    def __init__(
+        self, max_entries=1000, max_bytes=50 * 1024 * 1024, timeout=300,
+        fresh_seconds=0,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.fresh_seconds = fresh_seconds
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self):
+        with self.lock:
+            self.reset()
+
+    def get(self, key):
+        """Returns a tuple of (value, is_fresh), or (None, False)."""
+
+        now = monotonic()
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None or item[1] <= now:
+                if item is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None, False
+            self.entries.move_to_end(key)
+            self.hits += 1
+            value, _, fresh_until, _ = item
+            return value, fresh_until > now
+
+    def set(self, key, value, size, fresh=False):
+        if size > self.max_bytes:
+            return
+        now = monotonic()
+        fresh_until = now + self.fresh_seconds if fresh else now
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, now + self.timeout, fresh_until, size)
+            self.total_bytes += size
+            while (
+                len(self.entries) > self.max_entries or
+                self.total_bytes > self.max_bytes
+            ):
+                oldest_key = next(iter(self.entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def touch(self, key):
+        """Marks the entry as fresh again e.g., after a 304 response."""
+
+        now = monotonic()
+        with self.lock:
+            item = self.entries.get(key)
+            if item is not None:
+                value, expires_at, _, size = item
+                self.entries[key] = (
+                    value, expires_at, now + self.fresh_seconds, size
+                )
+
+    def delete(self, key):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def _remove(self, key):
+        item = self.entries.pop(key)
+        self.total_bytes -= item[3]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+            }
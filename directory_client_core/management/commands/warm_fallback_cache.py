@@ -0,0 +1,79 @@
+from xml.etree import ElementTree
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from directory_client_core import warm_up
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills the fallback cache by making the calls listed in a file '
+        'through a client whose get is decorated with helpers.fallback.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'client',
+            help=(
+                'Dotted path of the client, or of a callable returning it '
+                'e.g., myproject.clients.api_client'
+            ),
+        )
+        parser.add_argument(
+            'path',
+            help=(
+                'A JSON list of get_many specs, a sitemap, or a text file of '
+                'urls one per line. Urls under the client\'s base_url are '
+                'made relative to it'
+            ),
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=None,
+            help='Calls made at a time. Defaults to max_concurrent_requests.',
+        )
+        parser.add_argument(
+            '--progress-every', type=int, default=100,
+            help='Report progress every so many calls.',
+        )
+
+    def get_client(self, path):
+        try:
+            client = import_string(path)
+        except ImportError as exception:
+            raise CommandError(str(exception))
+        if not hasattr(client, 'get') and callable(client):
+            client = client()
+        return client
+
+    def handle(self, *args, **options):
+        client = self.get_client(options['client'])
+        try:
+            calls = warm_up.load_calls(
+                options['path'], base_url=client.base_url
+            )
+        except (OSError, ValueError, ElementTree.ParseError) as exception:
+            raise CommandError(f'Cannot read {options["path"]}: {exception}')
+
+        def progress(report, call, outcome):
+            url = warm_up.describe_call(call)
+            if outcome == warm_up.FAILED:
+                self.stderr.write(f'Failed {url}: {report.failures[-1][1]}')
+            elif options['verbosity'] > 1:
+                self.stdout.write(f'{outcome} {url}')
+            if report.done % options['progress_every'] == 0:
+                self.stdout.write(f'{report.done}/{report.total} calls made')
+
+        report = warm_up.warm_cache(
+            client,
+            calls,
+            concurrency=options['concurrency'],
+            progress=progress,
+        )
+        self.stdout.write(
+            f'{report.total} calls: {report.written} written '
+            f'({report.bytes_written} bytes), {report.unchanged} unchanged, '
+            f'{len(report.failures)} failed.'
+        )
+        if report.failures:
+            raise CommandError(f'{len(report.failures)} calls failed.')
@@ -0,0 +1,175 @@
+import io
+
+from requests.compat import basestring
+from requests.utils import guess_filename, to_key_val_list
+from urllib3.fields import RequestField
+from urllib3.filepost import choose_boundary
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class FilePart:
+
+    def __init__(self, file, start, size):
+        self.file = file
+        self.start = start
+        self.size = size
+
+    def iter_chunks(self, chunk_size):
+        self.file.seek(self.start)
+        remaining = self.size
+        while remaining > 0:
+            chunk = self.file.read(min(chunk_size, remaining))
+            if not chunk:
+                raise IOError('File is shorter than when the body was built')
+            remaining -= len(chunk)
+            yield chunk
+
+
+def get_file_part(file):
+    """
+    Returns the file as a `FilePart` read when the body is, or as bytes if it
+    cannot be read again from the start e.g., text or non seekable files.
+
+    """
+
+    if (
+        isinstance(file, io.TextIOBase) or
+        not getattr(file, 'seekable', lambda: False)()
+    ):
+        data = file.read()
+        return data.encode('utf-8') if isinstance(data, str) else data
+    start = file.tell()
+    size = file.seek(0, io.SEEK_END) - start
+    file.seek(start)
+    return FilePart(file, start, size)
+
+
+class MultipartEncoder:
+    """
+    A multipart/form-data body, built from the `data` and `files` arguments
+    `requests` takes, that is read from the files in chunks as it is sent
+    rather than held in memory.
+
+    How this works:
+        - the headers of each part are encoded up front, the same as
+          `requests` would encode them. Files are read in chunks when the
+          body is read
+        - the length is known up front, so it is sent with a Content-Length
+        - `seek(0)` rewinds the body, so it can be read once to compute the
+          signature and again to send it
+        - files that cannot be read twice (text and non seekable files) are
+          read into memory
+
+    """
+
+    def __init__(self, data, files, boundary=None):
+        self.boundary = boundary or choose_boundary()
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        self.parts = []
+        for field in self.build_fields(data, files):
+            self.add_part(f'--{self.boundary}\r\n'.encode('latin-1'))
+            self.add_part(field.render_headers().encode('utf-8'))
+            self.add_part(field.data)
+            self.add_part(b'\r\n')
+        self.add_part(f'--{self.boundary}--\r\n'.encode('latin-1'))
+        self.length = sum(
+            part.size if isinstance(part, FilePart) else len(part)
+            for part in self.parts
+        )
+        self.seek(0)
+
+    @staticmethod
+    def build_fields(data, files):
+        # mirrors `requests.models.RequestEncodingMixin._encode_files`
+        for field, value in to_key_val_list(data or {}):
+            if isinstance(value, basestring) or not hasattr(value, '__iter__'):
+                value = [value]
+            for item in value:
+                if item is None:
+                    continue
+                if not isinstance(item, bytes):
+                    item = str(item)
+                yield RequestField.from_tuples(
+                    field.decode('utf-8') if isinstance(field, bytes) else field,
+                    item.encode('utf-8') if isinstance(item, str) else item,
+                )
+        for name, value in to_key_val_list(files or {}):
+            file_type = None
+            file_headers = None
+            if isinstance(value, (tuple, list)):
+                if len(value) == 2:
+                    filename, file = value
+                elif len(value) == 3:
+                    filename, file, file_type = value
+                else:
+                    filename, file, file_type, file_headers = value
+            else:
+                filename = guess_filename(value) or name
+                file = value
+            if file is None:
+                continue
+            if isinstance(file, str):
+                data = file.encode('utf-8')
+            elif hasattr(file, 'read'):
+                data = get_file_part(file)
+            else:
+                data = bytes(file)
+            field = RequestField(
+                name=name, data=data, filename=filename, headers=file_headers
+            )
+            field.make_multipart(content_type=file_type)
+            yield field
+
+    def add_part(self, part):
+        if isinstance(part, FilePart) or not self.parts or (
+            isinstance(self.parts[-1], FilePart)
+        ):
+            self.parts.append(part)
+        else:
+            self.parts[-1] += part
+
+    def __len__(self):
+        return self.length
+
+    def iter_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        for part in self.parts:
+            if isinstance(part, FilePart):
+                yield from part.iter_chunks(chunk_size)
+            elif part:
+                yield part
+
+    def __iter__(self):
+        self.seek(0)
+        return self.iter_chunks()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if (offset, whence) != (0, io.SEEK_SET):
+            raise io.UnsupportedOperation('Can only seek to the start')
+        self.position = 0
+        self.chunks = self.iter_chunks()
+        self.buffer = memoryview(b'')
+        return 0
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length - self.position
+        result = []
+        remaining = size
+        while remaining > 0:
+            if not self.buffer:
+                chunk = next(self.chunks, None)
+                if chunk is None:
+                    break
+                self.buffer = memoryview(chunk)
+            piece = self.buffer[:remaining]
+            self.buffer = self.buffer[len(piece):]
+            remaining -= len(piece)
+            result.append(piece)
+        data = b''.join(result)
+        self.position += len(data)
+        return data
@@ -0,0 +1,119 @@
+import random
+import threading
+
+import requests
+
+
+IDEMPOTENT_METHODS = frozenset(
+    ['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE']
+)
+RETRY_STATUS_CODES = frozenset([429, 502, 503, 504])
+RETRY_EXCEPTIONS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+
+def get_total_timeout(timeout):
+    # requests accepts a (connect, read) tuple
+    if isinstance(timeout, (tuple, list)):
+        return sum(item or 0 for item in timeout)
+    return timeout or 0
+
+
+class RetryPolicy:
+    """
+    Decides whether a failed attempt of a request is retried, and how long
+    to wait before doing so.
+
+    How this works:
+        - only requests using `methods` are retried, by default the
+          idempotent ones, as retrying e.g., a POST may repeat its effect
+        - an attempt failed if it raised one of `retry_exceptions` or
+          responded with one of `retry_status_codes`
+        - before attempt n+1 the client waits a random time between 0 and
+          `backoff_factor * 2 ** (n - 1)` seconds ("full jitter"), capped at
+          `max_backoff`, or longer if the server sent `Retry-After`. A
+          `Retry-After` longer than `max_backoff` is not retried, rather
+          than retried sooner than the server asked
+        - no more attempts are made after `max_attempts`, or if waiting and
+          then making another attempt (which can take the client's timeout)
+          would end after `deadline` seconds since the first attempt started
+
+    `retries` and `retries_exhausted` count what happened, for metrics.
+
+    """
+
+    def __init__(
+        self, max_attempts=3, backoff_factor=0.1, max_backoff=2, jitter=True,
+        retry_status_codes=RETRY_STATUS_CODES,
+        retry_exceptions=RETRY_EXCEPTIONS, methods=IDEMPOTENT_METHODS,
+        deadline=None,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_status_codes = frozenset(retry_status_codes)
+        self.retry_exceptions = tuple(retry_exceptions)
+        self.methods = frozenset(method.upper() for method in methods)
+        self.deadline = deadline
+        self.lock = threading.Lock()
+        self.retries = 0
+        self.retries_exhausted = 0
+
+    def is_retryable(self, method, response=None, exception=None):
+        if method.upper() not in self.methods:
+            return False
+        if exception is not None:
+            return isinstance(exception, self.retry_exceptions)
+        return response.status_code in self.retry_status_codes
+
+    def get_backoff(self, attempt, response=None):
+        """Returns the seconds to wait, or None if that is too long."""
+
+        backoff = min(
+            self.max_backoff, self.backoff_factor * 2 ** (attempt - 1)
+        )
+        if self.jitter:
+            backoff = random.uniform(0, backoff)
+        retry_after = self.get_retry_after(response)
+        if retry_after is not None:
+            if retry_after > self.max_backoff:
+                return None
+            backoff = max(backoff, retry_after)
+        return backoff
+
+    @staticmethod
+    def get_retry_after(response):
+        if response is None:
+            return None
+        try:
+            return float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            # absent, or a HTTP date which is not worth parsing here
+            return None
+
+    def get_retry_delay(
+        self, method, attempt, elapsed, timeout, response=None,
+        exception=None,
+    ):
+        """
+        Returns how many seconds to wait before the next attempt, or None if
+        the request should not be attempted again.
+
+        """
+
+        if not self.is_retryable(method, response, exception):
+            return None
+        backoff = self.get_backoff(attempt, response)
+        if backoff is None or attempt >= self.max_attempts or (
+            self.deadline is not None and
+            elapsed + backoff + get_total_timeout(timeout) > self.deadline
+        ):
+            with self.lock:
+                self.retries_exhausted += 1
+            return None
+        with self.lock:
+            self.retries += 1
+        return backoff
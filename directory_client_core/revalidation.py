@@ -0,0 +1,97 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+
+from directory_client_core import sessions
+
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundRevalidator:
+    """
+    Runs revalidation requests off the request path, at most one at a time
+    per cache key.
+
+    Sync callables run on a thread pool, which is rebuilt after a fork as
+    the worker threads do not survive it. Coroutines run as tasks on the
+    running event loop.
+
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.executor = None
+        self.generation = None
+        self.in_flight = set()
+        self.tasks = set()
+
+    def get_executor(self):
+        with self.lock:
+            if (
+                self.executor is None or
+                self.generation != sessions._fork_generation
+            ):
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='directory-client-revalidation',
+                )
+                self.generation = sessions._fork_generation
+                self.in_flight = set()
+            return self.executor
+
+    def claim(self, key):
+        with self.lock:
+            if key in self.in_flight:
+                return False
+            self.in_flight.add(key)
+            return True
+
+    def release(self, key):
+        with self.lock:
+            self.in_flight.discard(key)
+
+    def submit(self, key, func):
+        """Returns the future, or None if `key` is already in flight."""
+
+        executor = self.get_executor()
+        if not self.claim(key):
+            return None
+
+        def run():
+            try:
+                func()
+            except Exception:
+                logger.exception('Background revalidation failed.')
+            finally:
+                self.release(key)
+
+        return executor.submit(run)
+
+    def submit_async(self, key, coroutine_function):
+        """Returns the task, or None if `key` is already in flight."""
+
+        if not self.claim(key):
+            return None
+
+        async def run():
+            try:
+                await coroutine_function()
+            except Exception:
+                logger.exception('Background revalidation failed.')
+            finally:
+                self.release(key)
+
+        task = asyncio.ensure_future(run())
+        # the event loop only keeps weak references to tasks
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,170 @@
+from http.cookiejar import DefaultCookiePolicy
+import os
+import threading
+from urllib.parse import urlsplit
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.utils import resolve_proxies
+
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_POOL_BLOCK = False
+MAX_CACHED_PROXY_ORIGINS = 256
+
+# incremented in the child process after a fork, so that managers created
+# before the fork know to discard the sockets they inherited from the parent
+_fork_generation = 0
+
+
+def _after_fork_in_child():
+    global _fork_generation
+    _fork_generation += 1
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def is_connection_reused(raw_response, used_sockets):
+    """
+    Returns whether the urllib3 response came over a socket in
+    `used_sockets`, which it is then added to, or None if unknown.
+
+    """
+
+    connection = getattr(raw_response, 'connection', None)
+    sock = getattr(connection, 'sock', None)
+    if sock is None:
+        return None
+    reused = sock in used_sockets
+    used_sockets.add(sock)
+    return reused
+
+
+def get_proxies(cache, url):
+    """
+    Returns the proxies for `url` taken from the environment, resolved once
+    per scheme and host and kept in the dict `cache`.
+
+    """
+
+    parts = urlsplit(url)
+    origin = (parts.scheme, parts.netloc)
+    proxies = cache.get(origin)
+    if proxies is None:
+        if len(cache) >= MAX_CACHED_PROXY_ORIGINS:
+            cache.clear()
+        proxies = cache[origin] = resolve_proxies(
+            requests.Request(url=url), {}, trust_env=True
+        )
+    return proxies
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    Records on each response whether its request was sent on a connection
+    that was used before, as `response.connection_reused`.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # sockets are tracked rather than connections, as urllib3 reconnects
+        # a dropped connection in place
+        self.used_sockets = weakref.WeakSet()
+
+    def build_response(self, req, resp):
+        response = super().build_response(req, resp)
+        response.connection_reused = is_connection_reused(
+            resp, self.used_sockets
+        )
+        return response
+
+
+class SessionManager:
+    """
+    Provides keep-alive `requests.Session` instances backed by one
+    connection pool, so consecutive requests reuse TCP/TLS connections.
+
+    How this works:
+        - all sessions mount the same `HTTPAdapter`, which is thread safe and
+          holds the connection pool (one pool per host)
+        - with `thread_local` each thread gets its own session (sessions are
+          not thread safe), otherwise one session is shared
+        - after a fork the inherited pool is dropped without being closed -
+          the sockets belong to the parent process - and a new one is built
+        - sessions never persist cookies, so cookies set for one user's
+          request are not sent with the next request
+        - the proxies taken from the environment are resolved once per
+          scheme and host, rather than by scanning `os.environ` on every
+          request as `Session.send` does when not given `proxies`
+
+    """
+
+    def __init__(
+        self, pool_connections=DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_block=DEFAULT_POOL_BLOCK,
+        thread_local=True,
+    ):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.thread_local = thread_local
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        self.generation = _fork_generation
+        self.adapter = None
+        self.shared_session = None
+        self.local = threading.local()
+        self.proxies = {}
+
+    def create_adapter(self):
+        return PooledHTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+        )
+
+    def create_session(self):
+        session = requests.Session()
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+        return session
+
+    def get_session(self):
+        if self.generation != _fork_generation:
+            with self.lock:
+                if self.generation != _fork_generation:
+                    self.reset()
+        if self.thread_local:
+            session = getattr(self.local, 'session', None)
+            if session is None:
+                session = self.local.session = self._build_session()
+            return session
+        if self.shared_session is None:
+            with self.lock:
+                if self.shared_session is None:
+                    self.shared_session = self._build_session()
+        return self.shared_session
+
+    def _build_session(self):
+        if self.adapter is None:
+            with self.lock:
+                if self.adapter is None:
+                    self.adapter = self.create_adapter()
+        return self.create_session()
+
+    def get_proxies(self, url):
+        return get_proxies(self.proxies, url)
+
+    def close(self):
+        with self.lock:
+            if self.adapter is not None and self.generation == _fork_generation:
+                self.adapter.close()
+            self.reset()
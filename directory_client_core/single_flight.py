@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import time
+
+from monotonic import monotonic
+
+
+class Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exception = None
+        self.waiters = 0
+        self.copies = []
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key, so only one of them does
+    the work and the others receive its result (or its exception).
+
+    How this works:
+        - within a process the first caller for a key is the leader, and
+          callers arriving before it finishes wait for its outcome. Threads
+          wait on an event, coroutines await a future
+        - if a `cache` is given the leader also takes a lock in the cache
+          with `cache.add`, so leaders in other processes wait for it to be
+          released (or `lock_timeout` to pass) instead of doing the work too.
+          After waiting they call `after_wait`, which can return the result
+          the other process produced, otherwise they do the work themselves
+        - if `copy` is given each caller that waited receives `copy(result)`
+          instead of the result itself, e.g., a response of its own. Threads
+          receive copies the leader made before it returned the result
+
+    """
+
+    lock_key_prefix = 'single-flight-'
+
+    def __init__(self, cache=None, lock_timeout=10, poll_interval=0.05):
+        self.cache = cache
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.async_calls = {}
+        self.coalesced = 0
+
+    def create_lock_key(self, key):
+        return self.lock_key_prefix + key
+
+    def do(self, key, func, after_wait=None, copy=None):
+        with self.lock:
+            call = self.calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self.calls[key] = Call()
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+        if not is_leader:
+            call.event.wait()
+            if call.exception is not None:
+                raise call.exception
+            return call.copies.pop() if copy else call.result
+        try:
+            call.result = self.run_exclusively(key, func, after_wait)
+        except BaseException as exception:
+            call.exception = exception
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            self.release(call, copy)
+        return call.result
+
+    @staticmethod
+    def release(call, copy):
+        # no caller starts waiting on the call once it is removed
+        try:
+            if copy and call.exception is None:
+                call.copies = [copy(call.result) for _ in range(call.waiters)]
+        except BaseException as exception:
+            call.exception = exception
+            raise
+        finally:
+            call.event.set()
+
+    def run_exclusively(self, key, func, after_wait):
+        if self.cache is None:
+            return func()
+        lock_key = self.create_lock_key(key)
+        if not self.cache.add(lock_key, 1, timeout=self.lock_timeout):
+            deadline = monotonic() + self.lock_timeout
+            while monotonic() < deadline and self.cache.get(lock_key):
+                time.sleep(self.poll_interval)
+            result = after_wait() if after_wait else None
+            if result is not None:
+                return result
+            return func()
+        try:
+            return func()
+        finally:
+            self.cache.delete(lock_key)
+
+    async def ado(self, key, coroutine_function, after_wait=None, copy=None):
+        loop = asyncio.get_running_loop()
+        future = self.async_calls.get(key)
+        if future is not None and future.get_loop() is loop:
+            self.coalesced += 1
+            result = await asyncio.shield(future)
+            return copy(result) if copy else result
+        future = self.async_calls[key] = loop.create_future()
+        try:
+            result = await self.arun_exclusively(
+                key, coroutine_function, after_wait
+            )
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exception:
+            future.set_exception(exception)
+            # mark as retrieved, as there may be no one waiting for it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self.async_calls.get(key) is future:
+                del self.async_calls[key]
+
+    async def arun_exclusively(self, key, coroutine_function, after_wait):
+        if self.cache is None:
+            return await coroutine_function()
+        lock_key = self.create_lock_key(key)
+        if not await self.cache.aadd(lock_key, 1, timeout=self.lock_timeout):
+            deadline = monotonic() + self.lock_timeout
+            while monotonic() < deadline and await self.cache.aget(lock_key):
+                await asyncio.sleep(self.poll_interval)
+            result = await after_wait() if after_wait else None
+            if result is not None:
+                return result
+            return await coroutine_function()
+        try:
+            return await coroutine_function()
+        finally:
+            await self.cache.adelete(lock_key)
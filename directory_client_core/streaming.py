@@ -0,0 +1,358 @@
+import codecs
+import io
+import json
+import os
+import tempfile
+import uuid
+
+from django.conf import settings
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+WHITESPACE = ' \t\n\r'
+NUMBER_CHARACTERS = '0123456789.eE+-'
+
+
+class IncompleteJSON(ValueError):
+    pass
+
+
+def iter_json_items(chunks, key=None):
+    """
+    Yields the items of a JSON array as its chunks arrive, so a long list
+    is never held in memory at once.
+
+    The array is the whole document, or if `key` is given the value of that
+    key in the top level object e.g., "results" of a paginated response:
+
+        response = client.get('/api/export/', stream=True)
+        for item in iter_json_items(response.iter_content(), key='results'):
+            ...
+
+    """
+
+    parser = IncrementalParser(chunks)
+    if key is not None:
+        parser.expect('{')
+        while True:
+            if parser.peek() == '}':
+                return
+            name = parser.decode()
+            parser.expect(':')
+            if name == key:
+                break
+            parser.decode()
+            if parser.peek() == ',':
+                parser.expect(',')
+    parser.expect('[')
+    if parser.peek() == ']':
+        return
+    while True:
+        yield parser.decode()
+        if parser.peek() == ']':
+            return
+        parser.expect(',')
+
+
+class IncrementalParser:
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+        self.finished = False
+
+    def read_more(self):
+        if self.finished:
+            return False
+        # drop what was consumed, so the buffer holds one item at a time
+        self.buffer = self.buffer[self.position:]
+        self.position = 0
+        for chunk in self.chunks:
+            text = self.decoder.decode(chunk)
+            if text:
+                self.buffer += text
+                return True
+        self.buffer += self.decoder.decode(b'', final=True)
+        self.finished = True
+        return True
+
+    def peek(self):
+        while True:
+            while (
+                self.position < len(self.buffer) and
+                self.buffer[self.position] in WHITESPACE
+            ):
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.read_more():
+                raise IncompleteJSON('Unexpected end of JSON')
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise ValueError(
+                f'Expected {character!r} at {self.buffer[self.position:][:20]!r}'
+            )
+        self.position += 1
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(
+                    self.buffer, self.position
+                )
+            except json.JSONDecodeError:
+                if not self.read_more():
+                    raise
+                continue
+            # a number at the end of the buffer may continue in the next
+            # chunk, e.g., "3" then ".25"
+            if (
+                not self.finished and
+                isinstance(value, (int, float)) and
+                not self.buffer[end:].lstrip(NUMBER_CHARACTERS)
+            ):
+                self.read_more()
+                continue
+            self.position = end
+            return value
+
+
+class TeeStream:
+    """
+    Wraps the `raw` stream of a response, copying what the caller reads to
+    `writer`. Once the stream has been read to the end `on_complete` is
+    called with what `writer.commit` returned. A stream closed before its end
+    is discarded.
+
+    """
+
+    def __init__(self, raw, writer, on_complete):
+        self.raw = raw
+        self.writer = writer
+        self.on_complete = on_complete
+        self.done = False
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    def stream(self, amt=DEFAULT_CHUNK_SIZE, decode_content=None):
+        try:
+            for chunk in self.raw.stream(amt, decode_content=decode_content):
+                self.writer.write(chunk)
+                yield chunk
+        except BaseException:
+            self.abort()
+            raise
+        self.complete()
+
+    def read(self, amt=None, *args, **kwargs):
+        try:
+            chunk = self.raw.read(amt, *args, **kwargs)
+        except BaseException:
+            self.abort()
+            raise
+        if chunk:
+            self.writer.write(chunk)
+        if not chunk or amt is None:
+            self.complete()
+        return chunk
+
+    def close(self):
+        self.abort()
+        self.raw.close()
+
+    def complete(self):
+        if not self.done:
+            self.done = True
+            self.on_complete(self.writer.commit())
+
+    def abort(self):
+        if not self.done:
+            self.done = True
+            self.writer.abort()
+
+
+class MemoryWriter:
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def write(self, chunk):
+        self.buffer.write(chunk)
+
+    def commit(self):
+        return {'body': self.buffer.getvalue()}
+
+    def abort(self):
+        self.buffer = io.BytesIO()
+
+
+class FileBodyStore:
+    """
+    Stores cached bodies as files in `directory`, so they are written and
+    read in chunks rather than held in memory. The cache entry refers to
+    the file by name, which is new for each body.
+
+    Files are shared by the processes on a host. An entry in a shared cache
+    whose file is not on this host is treated as not cached. The file of a
+    body that was replaced is removed, on the host that replaced it.
+
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, reference):
+        return os.path.join(self.directory, reference['name'])
+
+    def open_writer(self, key):
+        # a body written by another host is never mistaken for this one
+        return FileWriter(self, uuid.uuid4().hex)
+
+    def exists(self, reference):
+        return os.path.exists(self.get_path(reference))
+
+    def open(self, reference):
+        try:
+            return open(self.get_path(reference), 'rb')
+        except FileNotFoundError:
+            return None
+
+    def retire(self, reference):
+        # readers with the file open keep reading it
+        try:
+            os.unlink(self.get_path(reference))
+        except FileNotFoundError:
+            pass
+
+
+class FileWriter:
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+        self.size = 0
+        self.file = tempfile.NamedTemporaryFile(
+            dir=store.directory, prefix='.partial-', delete=False
+        )
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        self.file.close()
+        reference = {'name': self.name}
+        os.replace(self.file.name, self.store.get_path(reference))
+        return {'body': None, 'body_ref': reference, 'size': self.size}
+
+    def abort(self):
+        self.file.close()
+        os.unlink(self.file.name)
+
+
+class CacheBodyStore:
+    """
+    Stores cached bodies in `cache` split into chunks of `chunk_size`, so no
+    single cache value is large and bodies are written and read a chunk at
+    a time.
+
+    The chunks of a body that was replaced expire `retired_seconds` later,
+    so readers part way through them can finish.
+
+    """
+
+    key_prefix = 'body-chunk-'
+
+    def __init__(self, cache, chunk_size=512 * 1024, retired_seconds=60):
+        self.cache = cache
+        self.chunk_size = chunk_size
+        self.retired_seconds = retired_seconds
+
+    def create_chunk_key(self, reference, index):
+        return f'{self.key_prefix}{reference["id"]}-{index}'
+
+    def open_writer(self, key):
+        return CacheChunkWriter(self)
+
+    def exists(self, reference):
+        return self.create_chunk_key(reference, 0) in self.cache
+
+    def open(self, reference):
+        if not self.exists(reference):
+            return None
+        return CacheChunkReader(self, reference)
+
+    def retire(self, reference):
+        for index in range(reference['chunks']):
+            self.cache.touch(
+                self.create_chunk_key(reference, index), self.retired_seconds
+            )
+
+
+class CacheChunkWriter:
+
+    def __init__(self, store):
+        self.store = store
+        # each body gets new keys, so a reader never mixes two versions
+        self.reference = {'id': uuid.uuid4().hex, 'chunks': 0}
+        self.buffer = bytearray()
+        self.size = 0
+
+    def write(self, chunk):
+        self.buffer += chunk
+        self.size += len(chunk)
+        while len(self.buffer) >= self.store.chunk_size:
+            self.flush(self.store.chunk_size)
+
+    def flush(self, size):
+        self.store.cache.set(
+            self.store.create_chunk_key(self.reference, self.reference['chunks']),
+            bytes(self.buffer[:size]),
+            settings.DIRECTORY_CLIENT_CORE_CACHE_EXPIRE_SECONDS,
+        )
+        del self.buffer[:size]
+        self.reference['chunks'] += 1
+
+    def commit(self):
+        if self.buffer or not self.reference['chunks']:
+            self.flush(len(self.buffer))
+        return {'body': None, 'body_ref': self.reference, 'size': self.size}
+
+    def abort(self):
+        self.store.cache.delete_many([
+            self.store.create_chunk_key(self.reference, index)
+            for index in range(self.reference['chunks'])
+        ])
+
+
+class CacheChunkReader(io.RawIOBase):
+
+    def __init__(self, store, reference):
+        self.store = store
+        self.reference = reference
+        self.index = 0
+        self.buffer = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while not self.buffer and self.index < self.reference['chunks']:
+            chunk = self.store.cache.get(
+                self.store.create_chunk_key(self.reference, self.index)
+            )
+            if chunk is None:
+                raise IOError('Cached body chunk expired')
+            self.buffer = memoryview(chunk)
+            self.index += 1
+        size = min(len(target), len(self.buffer))
+        target[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
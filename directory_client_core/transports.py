@@ -0,0 +1,254 @@
+"""
+Transports send the prepared, signed requests of `AbstractAPIClient` and
+return `requests.Response` objects. A transport has:
+
+    send(prepared_request, timeout, stream=False) -> requests.Response
+    close()
+
+and raises `requests.RequestException` subclasses when a request fails.
+
+"""
+from datetime import timedelta
+import threading
+from urllib.parse import urlsplit
+import weakref
+
+from monotonic import monotonic
+import requests
+from requests.cookies import extract_cookies_to_jar
+from requests.exceptions import (
+    ConnectionError, ConnectTimeout, InvalidHeader, InvalidURL, ProxyError,
+    ReadTimeout, RetryError, SSLError
+)
+from requests.structures import CaseInsensitiveDict
+from requests.utils import (
+    DEFAULT_CA_BUNDLE_PATH, get_auth_from_url, get_encoding_from_headers,
+    select_proxy
+)
+import urllib3
+from urllib3.exceptions import (
+    ClosedPoolError, ConnectTimeoutError, HTTPError, InvalidHeader as
+    _InvalidHeader, LocationValueError, MaxRetryError, NewConnectionError,
+    ProtocolError, ProxyError as _ProxyError, ReadTimeoutError, ResponseError,
+    SSLError as _SSLError
+)
+from urllib3.util import Retry, Timeout
+
+from directory_client_core import sessions
+
+
+class RequestsTransport:
+    """
+    Sends requests with the keep-alive sessions of a
+    `sessions.SessionManager`. The default transport.
+
+    """
+
+    def __init__(self, session_manager):
+        self.session_manager = session_manager
+
+    def send(self, prepared_request, timeout, stream=False):
+        session = self.session_manager.get_session()
+        return session.send(
+            prepared_request,
+            timeout=timeout,
+            proxies=self.session_manager.get_proxies(prepared_request.url),
+            stream=stream,
+        )
+
+    def close(self):
+        self.session_manager.close()
+
+
+def translate_exception(exception, request):
+    """
+    Maps urllib3 errors onto the `requests` exceptions `HTTPAdapter.send`
+    raises for them, so callers and retry policies handle both transports
+    alike.
+
+    """
+
+    if isinstance(exception, MaxRetryError):
+        reason = exception.reason
+        if isinstance(reason, ConnectTimeoutError) and not isinstance(
+            reason, NewConnectionError
+        ):
+            return ConnectTimeout(exception, request=request)
+        if isinstance(reason, ResponseError):
+            return RetryError(exception, request=request)
+        if isinstance(reason, _ProxyError):
+            return ProxyError(exception, request=request)
+        if isinstance(reason, _SSLError):
+            return SSLError(exception, request=request)
+        return ConnectionError(exception, request=request)
+    if isinstance(exception, _ProxyError):
+        return ProxyError(exception, request=request)
+    if isinstance(exception, _SSLError):
+        return SSLError(exception, request=request)
+    if isinstance(exception, ReadTimeoutError):
+        return ReadTimeout(exception, request=request)
+    if isinstance(exception, _InvalidHeader):
+        return InvalidHeader(exception, request=request)
+    if isinstance(exception, (ProtocolError, ClosedPoolError, OSError)):
+        return ConnectionError(exception, request=request)
+    return exception
+
+
+class Urllib3Transport:
+    """
+    Sends requests straight through a `urllib3.PoolManager`, skipping the
+    per request work of `requests.Session.send` this client does not use:
+    merging settings and hooks, looking up the adapter, copying cookies into
+    jars and checking for redirects. Responses are built the same way
+    `requests` builds them.
+
+    How this works:
+        - certificates are verified against the same CA bundle `requests`
+          uses, and the proxies in the environment are honoured (resolved
+          once per scheme and host)
+        - failures raise the same `requests` exceptions
+        - redirects are returned rather than followed
+        - as with `sessions.SessionManager`, the pool inherited by a forked
+          process is dropped and a new one is built
+
+    """
+
+    def __init__(
+        self, pool_connections=sessions.DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize=sessions.DEFAULT_POOL_MAXSIZE,
+        pool_block=sessions.DEFAULT_POOL_BLOCK,
+    ):
+        self.pool_kwargs = {
+            'num_pools': pool_connections,
+            'maxsize': pool_maxsize,
+            'block': pool_block,
+            'cert_reqs': 'CERT_REQUIRED',
+            'ca_certs': DEFAULT_CA_BUNDLE_PATH,
+        }
+        self.retries = Retry(0, read=False)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.generation = sessions._fork_generation
+        self.managers = {}
+        self.proxies = {}
+        # (scheme, host): (connection pool, whether to send the whole url)
+        self.connections = {}
+        self.used_sockets = weakref.WeakSet()
+
+    def get_connection(self, url):
+        """
+        Returns the connection pool for the scheme and host of `url`, and
+        whether the whole url is sent. Both are kept per scheme and host,
+        rather than looked up through the pool manager on every request.
+
+        """
+
+        if self.generation != sessions._fork_generation:
+            with self.lock:
+                if self.generation != sessions._fork_generation:
+                    self.reset()
+        parts = urlsplit(url)
+        origin = (parts.scheme, parts.netloc)
+        connection = self.connections.get(origin)
+        # a pool is closed when the manager drops it to make room
+        if connection is None or connection[0].pool is None:
+            proxy = select_proxy(url, sessions.get_proxies(self.proxies, url))
+            try:
+                pool = self.get_manager(proxy).connection_from_url(url)
+            except LocationValueError as exception:
+                raise InvalidURL(exception)
+            if len(self.connections) >= sessions.MAX_CACHED_PROXY_ORIGINS:
+                self.connections.clear()
+            # a plain http proxy is sent the whole url
+            connection = self.connections[origin] = (
+                pool, bool(proxy) and parts.scheme == 'http'
+            )
+        return connection
+
+    def get_manager(self, proxy):
+        manager = self.managers.get(proxy)
+        if manager is None:
+            with self.lock:
+                manager = self.managers.get(proxy)
+                if manager is None:
+                    manager = self.managers[proxy] = self.create_manager(proxy)
+        return manager
+
+    def create_manager(self, proxy):
+        if proxy is None:
+            return urllib3.PoolManager(**self.pool_kwargs)
+        username, password = get_auth_from_url(proxy)
+        proxy_headers = None
+        if username:
+            proxy_headers = urllib3.make_headers(
+                proxy_basic_auth=f'{username}:{password}'
+            )
+        return urllib3.ProxyManager(
+            proxy, proxy_headers=proxy_headers, **self.pool_kwargs
+        )
+
+    @staticmethod
+    def get_timeout(timeout):
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return Timeout(connect=connect, read=read)
+        return Timeout(connect=timeout, read=timeout)
+
+    def send(self, prepared_request, timeout, stream=False):
+        start_time = monotonic()
+        connection, send_whole_url = self.get_connection(prepared_request.url)
+        try:
+            raw_response = connection.urlopen(
+                method=prepared_request.method,
+                url=(
+                    prepared_request.url if send_whole_url
+                    else prepared_request.path_url
+                ),
+                body=prepared_request.body,
+                headers=prepared_request.headers,
+                redirect=False,
+                assert_same_host=False,
+                preload_content=False,
+                decode_content=False,
+                retries=self.retries,
+                timeout=self.get_timeout(timeout),
+                chunked=not (
+                    prepared_request.body is None or
+                    'Content-Length' in prepared_request.headers
+                ),
+            )
+        except (HTTPError, OSError) as exception:
+            raise translate_exception(exception, prepared_request)
+        response = self.build_response(prepared_request, raw_response)
+        response.elapsed = timedelta(seconds=monotonic() - start_time)
+        if not stream:
+            response.content
+        return response
+
+    def build_response(self, prepared_request, raw_response):
+        response = requests.Response()
+        response.status_code = raw_response.status
+        response.headers = CaseInsensitiveDict(raw_response.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = raw_response
+        response.reason = raw_response.reason
+        response.url = prepared_request.url
+        if 'Set-Cookie' in response.headers:
+            extract_cookies_to_jar(
+                response.cookies, prepared_request, raw_response
+            )
+        response.request = prepared_request
+        response.connection = self
+        response.connection_reused = sessions.is_connection_reused(
+            raw_response, self.used_sockets
+        )
+        return response
+
+    def close(self):
+        with self.lock:
+            if self.generation == sessions._fork_generation:
+                for manager in self.managers.values():
+                    manager.clear()
+            self.reset()
@@ -0,0 +1,196 @@
+"""
+Fills the `helpers.fallback` cache ahead of traffic e.g., after the cache
+was flushed or on a deploy, by making the calls through the client's
+`fallback` decorated `get`, so the entries are stored under the keys later
+calls read.
+
+    report = warm_up.warm_cache(client, ['some/path/', ('search/', {'q': 'a'})])
+
+or with the management command, once `directory_client_core` is in
+`INSTALLED_APPS`:
+
+    ./manage.py warm_fallback_cache myproject.clients.api_client calls.json
+
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from xml.etree import ElementTree
+
+from directory_client_core import helpers, instrumentation
+from directory_client_core.base import normalize_get_spec
+
+
+# outcomes of a call
+WRITTEN = 'WRITTEN'  # the live response was stored
+UNCHANGED = 'UNCHANGED'  # the cached entry is up to date
+FAILED = 'FAILED'  # nothing was stored
+
+UNCHANGED_OUTCOMES = (
+    instrumentation.NOT_MODIFIED,
+    instrumentation.STALE,
+    instrumentation.NEGATIVE_HIT,
+)
+
+
+class WarmUpReport:
+    """The counts of a `warm_cache` run, updated as the calls complete."""
+
+    def __init__(self, total):
+        self.total = total
+        self.written = 0
+        self.unchanged = 0
+        # (call, reason)
+        self.failures = []
+        # of the bodies stored, before any compression
+        self.bytes_written = 0
+
+    @property
+    def done(self):
+        return self.written + self.unchanged + len(self.failures)
+
+    def record(self, call, outcome, size=0, reason=None):
+        if outcome == WRITTEN:
+            self.written += 1
+            self.bytes_written += size
+        elif outcome == UNCHANGED:
+            self.unchanged += 1
+        else:
+            self.failures.append((call, reason))
+
+
+def load_calls(path, base_url=None):
+    """
+    Reads the calls to make from a file, which is one of:
+
+        - a JSON list of `get_many` specs: urls, [url, params] pairs or
+          objects of keyword arguments for `get`
+        - a sitemap. Each <loc> under `base_url` is made relative to it, and
+          its query string is passed as `params`
+        - a text file of urls, one per line. As for a sitemap, each url
+          under `base_url` is made relative to it, and its query string is
+          passed as `params`
+
+    The urls must be written as the application passes them to `get`, as
+    they are part of the cache key.
+
+    """
+
+    with open(path, encoding='utf-8') as file:
+        content = file.read()
+    stripped = content.lstrip()
+    if stripped.startswith('['):
+        return json.loads(content)
+    if stripped.startswith('<'):
+        return [
+            split_url(element.text.strip(), base_url)
+            for element in ElementTree.fromstring(content).iter()
+            if element.tag.rpartition('}')[2] == 'loc' and element.text
+        ]
+    return [
+        split_url(line.strip(), base_url)
+        for line in content.splitlines() if line.strip()
+    ]
+
+
+def split_url(url, base_url=None):
+    """Returns a (url, params) spec for the absolute `url`."""
+
+    if base_url and url.startswith(base_url):
+        url = url[len(base_url):]
+    parts = urlsplit(url)
+    if parts.query:
+        url = url[:url.index('?')]
+    return (url, dict(parse_qsl(parts.query, keep_blank_values=True)))
+
+
+def describe_call(call):
+    """Returns the url of a `get_many` style call, for reports."""
+
+    kwargs = normalize_get_spec(call)
+    if kwargs.get('params'):
+        return f"{kwargs['url']}?{urlencode(kwargs['params'], doseq=True)}"
+    return kwargs['url']
+
+
+def classify(response, fallback_outcome, error=None):
+    """
+    Returns the outcome of a call, and why it failed. The outcome of
+    `fallback` is None for a call that waited on a coalesced request, or if
+    `get` is not decorated by it. `error` is that of the `FALLBACK` event.
+
+    """
+
+    if fallback_outcome == instrumentation.LIVE:
+        if response.ok:
+            return WRITTEN, None
+        return FAILED, f'status {response.status_code}'
+    if fallback_outcome in UNCHANGED_OUTCOMES:
+        return UNCHANGED, None
+    if fallback_outcome == instrumentation.HIT:
+        if error is None:
+            # held fresh by the local cache, so no request was made
+            return UNCHANGED, None
+        return FAILED, error
+    if fallback_outcome is None:
+        if isinstance(response, (helpers.LiveResponse, helpers.CacheResponse)):
+            return UNCHANGED, None
+        if not isinstance(response, helpers.FailureResponse):
+            return FAILED, 'get is not decorated with helpers.fallback'
+    return FAILED, f'status {response.status_code}'
+
+
+def warm_cache(client, calls, concurrency=None, progress=None):
+    """
+    Makes the `get_many` style `calls` through `client.get`, at most
+    `concurrency` (by default the client's `max_concurrent_requests`) at a
+    time.
+
+    `progress` is called with the report, the call and its outcome as each
+    call completes. Returns the `WarmUpReport`.
+
+    """
+
+    calls = list(calls)
+    report = WarmUpReport(total=len(calls))
+    state = threading.local()
+
+    def listener(name, data):
+        if name == instrumentation.FALLBACK:
+            state.outcome = data['outcome']
+            state.error = data['error']
+
+    def run(call):
+        kwargs = normalize_get_spec(call)
+        kwargs.pop('method')
+        state.outcome = state.error = None
+        response = client.get(**kwargs)
+        return response, state.outcome, state.error
+
+    instrumentation.add_listener(listener)
+    try:
+        with ThreadPoolExecutor(
+            max_workers=concurrency or client.max_concurrent_requests,
+            thread_name_prefix='directory-client-warm-up',
+        ) as executor:
+            futures = {executor.submit(run, call): call for call in calls}
+            for future in as_completed(futures):
+                call = futures[future]
+                size = 0
+                try:
+                    response, fallback_outcome, error = future.result()
+                except Exception as exception:
+                    outcome, reason = FAILED, repr(exception)
+                else:
+                    outcome, reason = classify(
+                        response, fallback_outcome, error
+                    )
+                    if outcome == WRITTEN:
+                        size = len(response.content)
+                report.record(call, outcome, size=size, reason=reason)
+                if progress:
+                    progress(report, call, outcome)
+    finally:
+        instrumentation.remove_listener(listener)
+    return report
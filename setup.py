@@ -10,18 +10,29 @@ setup(
     license='MIT',
     author='Department for International Trade',
     description='Python common code for Directory API clients.',
-    packages=find_packages(exclude=["tests.*", "tests"]),
+    packages=find_packages(
+        exclude=["tests.*", "tests", "benchmarks.*", "benchmarks"]
+    ),
     long_description=open('README.md').read(),
     long_description_content_type='text/markdown',
     include_package_data=True,
     install_requires=[
-        'requests>=2.21.0,<3.0.0',
+        'requests>=2.27.0,<3.0.0',
         'monotonic>=1.2,<3.0',
         'sigauth>=5.2.5,<6.0.0',
         'django>=4.2.10,<5.0',
         'w3lib>=1.19.0,<2.0.0',
     ],
     extras_require={
+        'async': [
+            'httpx>=0.23.0,<1.0.0',
+        ],
+        'http2': [
+            'httpx[http2]>=0.23.0,<1.0.0',
+        ],
+        'orjson': [
+            'orjson>=3.6.0,<4.0.0',
+        ],
         'test': [
             'flake8==5.0.4',
             'freezegun==1.0.0',
@@ -31,6 +42,8 @@ setup(
             'pytest-cov',
             'pytest-codecov',
             'GitPython',
+            'httpx[http2]>=0.23.0,<1.0.0',
+            'orjson>=3.6.0,<4.0.0',
             'requests_mock==1.8.0',
             'setuptools>=38.6.0,<39.0.0',
             'twine',
@@ -1,3 +1,6 @@
+import pytest
+
+
 def pytest_configure():
     from django.conf import settings
     settings.configure(
@@ -9,3 +12,19 @@ def pytest_configure():
             }
         }
     )
+
+
+@pytest.fixture
+def events():
+    """Records the `instrumentation` events emitted during the test."""
+
+    from directory_client_core import instrumentation
+
+    recorded = []
+
+    def listener(name, data):
+        recorded.append((name, data))
+
+    instrumentation.add_listener(listener)
+    yield recorded
+    instrumentation.remove_listener(listener)
@@ -0,0 +1,260 @@
+import asyncio
+import io
+import json
+
+import httpx
+from mohawk import Receiver
+import pytest
+import requests
+
+from directory_client_core import (
+    authentication, cache_control, instrumentation, json_backends
+)
+from directory_client_core.async_base import AsyncAbstractAPIClient
+from directory_client_core.retry import RetryPolicy
+
+
+class AsyncAPIClient(AsyncAbstractAPIClient):
+    version = 1
+
+
+def create_client(handler):
+    client = AsyncAPIClient(
+        base_url='https://example.com/',
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+    )
+    client.create_http_client = lambda: httpx.AsyncClient(
+        transport=httpx.MockTransport(handler)
+    )
+    return client
+
+
+def create_recording_client(status_code=200, content=b'{}', headers=None):
+    requests_seen = []
+
+    def handler(request):
+        requests_seen.append(request)
+        return httpx.Response(
+            status_code, content=content, headers=headers or {}
+        )
+
+    return create_client(handler), requests_seen
+
+
+def assert_signature_valid(request):
+    Receiver(
+        lambda sender_id: {
+            'id': sender_id, 'key': 'test', 'algorithm': 'sha256'
+        },
+        request.headers['X-Signature'],
+        request.url.raw_path.decode(),
+        request.method,
+        content=request.content,
+        content_type=request.headers.get('Content-Type', 'text/plain'),
+        seen_nonce=lambda *args: False,
+    )
+
+
+def test_async_get():
+    client, seen = create_recording_client(content=b'{"key": "value"}')
+
+    response = asyncio.run(
+        client.get(
+            'test/',
+            params={'a': 'b'},
+            authenticator=authentication.BearerAuthenticator('123'),
+            cache_control=cache_control.ETagCacheControl('"1"'),
+        )
+    )
+
+    request = seen[0]
+    assert isinstance(response, requests.Response)
+    assert response.status_code == 200
+    assert response.json() == {'key': 'value'}
+    assert str(request.url) == 'https://example.com/test/?a=b'
+    assert request.headers['Authorization'] == 'Bearer 123'
+    assert request.headers['If-None-Match'] == '"1"'
+    assert request.headers['User-agent'] == 'EXPORT-DIRECTORY-API-CLIENT/1'
+    assert_signature_valid(request)
+
+
+@pytest.mark.parametrize('method', ['post', 'put', 'patch'])
+def test_async_encodes_json(method):
+    client, seen = create_recording_client()
+
+    asyncio.run(getattr(client, method)('test', data={'key': 'value'}))
+
+    request = seen[0]
+    assert request.method == method.upper()
+    assert request.headers['Content-type'] == 'application/json'
+    assert json.loads(request.content) == {'key': 'value'}
+    assert_signature_valid(request)
+
+
+@pytest.mark.parametrize('method', ['post', 'put', 'patch'])
+def test_async_encodes_json_with_backend(method):
+    client, seen = create_recording_client()
+    client.json_backend = json_backends.get_backend('orjson')
+
+    asyncio.run(getattr(client, method)('test', data={'key': 'value'}))
+
+    assert seen[0].content == b'{"key":"value"}'
+    assert_signature_valid(seen[0])
+
+
+def test_async_post_encodes_form_with_file():
+    client, seen = create_recording_client()
+
+    asyncio.run(
+        client.post(
+            'test', data={'key': 'value'}, files={'logo': io.BytesIO(b'hi')}
+        )
+    )
+
+    request = seen[0]
+    header = request.headers['Content-type']
+    assert header.startswith('multipart/form-data; boundary=')
+    assert_signature_valid(request)
+
+
+def test_async_delete_encodes_form():
+    client, seen = create_recording_client()
+
+    asyncio.run(client.delete('test', data={'key': 'value'}))
+
+    request = seen[0]
+    assert request.method == 'DELETE'
+    assert request.content == b'key=value'
+    assert_signature_valid(request)
+
+
+def test_async_response_not_ok():
+    client, _ = create_recording_client(status_code=400)
+
+    response = asyncio.run(client.get('test'))
+
+    assert response.status_code == 400
+    assert response.ok is False
+
+
+def test_async_connection_error_translated():
+    def handler(request):
+        raise httpx.ConnectError('down', request=request)
+
+    client = create_client(handler)
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        asyncio.run(client.get('test'))
+
+
+def test_async_timeout_translated():
+    def handler(request):
+        raise httpx.ReadTimeout('slow', request=request)
+
+    client = create_client(handler)
+
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        asyncio.run(client.get('test'))
+
+
+def test_async_client_reused_and_closed():
+    client, _ = create_recording_client()
+
+    async def run():
+        async with client:
+            await client.get('test')
+            http_client = client.http_client
+            await client.get('test')
+            assert client.http_client is http_client
+        return http_client
+
+    http_client = asyncio.run(run())
+
+    assert http_client.is_closed
+    assert client.http_client is None
+
+
+def test_async_get_many():
+    def handler(request):
+        if request.url.path == '/c/':
+            raise httpx.ConnectError('down', request=request)
+        return httpx.Response(200, content=request.url.path.encode())
+
+    client = create_client(handler)
+
+    results = asyncio.run(
+        client.get_many([('a/', {'x': 'y'}), {'url': 'b/'}, 'c/'])
+    )
+
+    assert results[0].content == b'/a/'
+    assert results[1].content == b'/b/'
+    assert isinstance(results[2], requests.exceptions.ConnectionError)
+
+
+def test_async_request_many_bounded():
+    in_flight = []
+    peak = []
+
+    async def handler(request):
+        in_flight.append(1)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.pop()
+        return httpx.Response(200)
+
+    client = create_client(handler)
+    client.max_concurrent_requests = 2
+
+    results = asyncio.run(
+        client.request_many([{'method': 'GET', 'url': 'a/'}] * 5)
+    )
+
+    assert [result.status_code for result in results] == [200] * 5
+    assert max(peak) == 2
+
+
+def test_async_retry():
+    responses = iter([httpx.Response(503), httpx.Response(200)])
+    client = create_client(lambda request: next(responses))
+    client.retry_policy = RetryPolicy(backoff_factor=0)
+
+    response = asyncio.run(client.get('test'))
+
+    assert response.status_code == 200
+    assert client.retry_policy.retries == 1
+
+
+def test_async_instrumentation_events(events):
+    client, _ = create_recording_client(content=b'{"a": 1}')
+
+    asyncio.run(client.post('test', data={'key': 'value'}))
+
+    names = [name for name, _ in events]
+    received = dict(events)[instrumentation.RESPONSE_RECEIVED]
+
+    assert names == [
+        instrumentation.REQUEST_STARTED,
+        instrumentation.REQUEST_SIGNED,
+        instrumentation.RESPONSE_RECEIVED,
+        instrumentation.REQUEST_FINISHED,
+    ]
+    assert received['status_code'] == 200
+    assert received['bytes_sent'] == len('{"key": "value"}')
+    assert received['bytes_received'] == len('{"a": 1}')
+    assert received['connection_reused'] is None
+
+
+def test_async_instrumentation_request_failed(events):
+    def handler(request):
+        raise httpx.ConnectError('down')
+
+    client = create_client(handler)
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        asyncio.run(client.get('test'))
+
+    failed = dict(events)[instrumentation.REQUEST_FAILED]
+    assert isinstance(failed['exception'], requests.exceptions.ConnectionError)
+    assert dict(events)[instrumentation.REQUEST_FINISHED]['status_code'] is None
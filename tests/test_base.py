@@ -1,13 +1,24 @@
-from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
 import http
+import threading
 from unittest import TestCase
+from unittest.mock import patch
 
+from mohawk import Receiver
 import pytest
 import requests
+import requests_mock
 
 from tests import stub_request
 from directory_client_core.base import AbstractAPIClient
-from directory_client_core import authentication, cache_control
+from directory_client_core import (
+    authentication, cache_control, instrumentation, json_backends, streaming
+)
+from directory_client_core.circuit_breaker import (
+    CircuitBreaker, CircuitBreakerOpen
+)
+from directory_client_core.retry import RetryPolicy
 
 
 class TestAPIClient(AbstractAPIClient):
@@ -55,6 +66,37 @@ class AbstractAPIClientTest(TestCase):
         assert request.headers['Content-type'] == 'application/json'
         assert request.text == '{"key": "value"}'
 
+    def test_json_backend(self):
+        assert isinstance(
+            self.client.json_backend, json_backends.StdlibJSONBackend
+        )
+        backend = json_backends.OrjsonJSONBackend()
+        for json_backend in ('orjson', backend):
+            client = TestAPIClient(
+                base_url='https://example.com/',
+                api_key='test',
+                sender_id='test-sender-id',
+                timeout=2,
+                json_backend=json_backend,
+            )
+            assert isinstance(
+                client.json_backend, json_backends.OrjsonJSONBackend
+            )
+
+    def test_encodes_json_with_backend(self):
+        self.client.json_backend = json_backends.get_backend('orjson')
+        data = {'key': 'value'}
+
+        with requests_mock.mock() as mock:
+            mock.register_uri(requests_mock.ANY, 'https://example.com/test')
+            self.client.post('test', data=data)
+            self.client.put('test', data=data)
+            self.client.patch('test', data=data)
+
+        for request in mock.request_history:
+            assert request.headers['Content-type'] == 'application/json'
+            assert request.body == b'{"key":"value"}'
+
     @stub_request('https://example.com/test', 'delete')
     def test_delete_encodes_json(self, stub):
         data = {'key': 'value'}
@@ -122,6 +164,43 @@ class AbstractAPIClientTest(TestCase):
 
         assert request.headers['If-None-Match'] == '123'
 
+    @stub_request('https://example.com/test', 'get')
+    def test_session_reused_between_requests(self, stub):
+        self.client.get('test')
+        session = self.client.session_manager.get_session()
+        self.client.get('test')
+
+        assert self.client.session_manager.get_session() is session
+        assert stub.call_count == 2
+
+    @stub_request('https://example.com/test', 'get')
+    def test_get_without_body_signed(self, stub):
+        self.client.get(
+            'test',
+            params={'lang': 'en'},
+            authenticator=authentication.BearerAuthenticator('123'),
+        )
+
+        request = stub.request_history[0]
+
+        assert request.url == 'https://example.com/test?lang=en'
+        assert request.body is None
+        assert request.headers['Authorization'] == 'Bearer 123'
+        assert request.headers['User-agent'] == (
+            'EXPORT-DIRECTORY-API-CLIENT/1'
+        )
+        assert 'X-Signature' in request.headers
+
+    @stub_request('https://example.com/test', 'get')
+    def test_build_headers_not_shared_between_requests(self, stub):
+        self.client.get(
+            'test', authenticator=authentication.BearerAuthenticator('123'),
+        )
+        self.client.get('test')
+
+        assert 'Authorization' not in stub.request_history[1].headers
+        assert 'Authorization' not in self.client.base_headers
+
 
 @pytest.mark.parametrize(
     'base_url,partial_url,expected_result',
@@ -150,3 +229,419 @@ class AbstractAPIClientTest(TestCase):
 )
 def test_build_url(base_url, partial_url, expected_result):
     assert TestAPIClient.build_url(base_url, partial_url) == expected_result
+
+
+def test_client_context_manager_closes_sessions():
+    with TestAPIClient(
+        base_url='https://example.com/',
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+        pool_maxsize=20,
+    ) as client:
+        client.session_manager.get_session()
+        assert client.session_manager.adapter._pool_maxsize == 20
+
+    assert client.session_manager.adapter is None
+
+
+def test_get_many():
+    client = TestAPIClient(
+        base_url='https://example.com/',
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+        max_concurrent_requests=2,
+    )
+
+    with requests_mock.mock() as mock:
+        mock.get('https://example.com/a/', content=b'a')
+        mock.get('https://example.com/b/', content=b'b')
+        mock.get('https://example.com/c/', exc=requests.exceptions.ConnectTimeout)
+        results = client.get_many([
+            ('a/', {'x': 'y'}, authentication.BearerAuthenticator('123')),
+            {'url': 'b/'},
+            ('c/',),
+        ])
+
+    assert results[0].content == b'a'
+    assert results[1].content == b'b'
+    assert isinstance(results[2], requests.exceptions.ConnectTimeout)
+    request = next(item for item in mock.request_history if item.path == '/a/')
+    assert request.qs == {'x': ['y']}
+    assert request.headers['Authorization'] == 'Bearer 123'
+    assert client.executor._max_workers == 2
+
+
+def test_get_many_runs_concurrently():
+    client = TestAPIClient(
+        base_url='https://example.com/',
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+    )
+    barrier = threading.Barrier(3, timeout=2)
+
+    def callback(request, context):
+        barrier.wait()
+        return b''
+
+    with requests_mock.mock() as mock:
+        mock.get('https://example.com/a/', content=callback)
+        results = client.get_many(['a/', 'a/', 'a/'])
+
+    assert [result.status_code for result in results] == [200, 200, 200]
+
+
+def test_request_many():
+    client = TestAPIClient(
+        base_url='https://example.com/',
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+    )
+
+    with requests_mock.mock() as mock:
+        mock.get('https://example.com/a/', content=b'a')
+        mock.post('https://example.com/b/', content=b'b')
+        results = client.request_many([
+            {'method': 'GET', 'url': 'a/'},
+            {'method': 'POST', 'url': 'b/', 'data': {'key': 'value'}},
+        ])
+
+    assert [result.content for result in results] == [b'a', b'b']
+    request = next(item for item in mock.request_history if item.path == '/b/')
+    assert request.json() == {'key': 'value'}
+
+
+def test_request_many_honours_decorated_get():
+    calls = []
+
+    class DecoratedAPIClient(TestAPIClient):
+        def get(self, *args, **kwargs):
+            calls.append(kwargs['url'])
+            return super().get(*args, **kwargs)
+
+    client = DecoratedAPIClient(
+        base_url='https://example.com/',
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+    )
+
+    with requests_mock.mock() as mock:
+        mock.get('https://example.com/a/')
+        client.get_many(['a/'])
+
+    assert calls == ['a/']
+
+
+def test_close_shuts_down_executor():
+    client = TestAPIClient(
+        base_url='https://example.com/',
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+    )
+    executor = client.get_executor()
+
+    client.close()
+
+    assert client.executor is None
+    assert executor._shutdown is True
+
+
+def create_retrying_client(**kwargs):
+    return TestAPIClient(
+        base_url='https://example.com/',
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+        retry_policy=RetryPolicy(jitter=False, **kwargs),
+    )
+
+
+@patch('time.sleep')
+def test_retry_status_code(mock_sleep):
+    client = create_retrying_client()
+
+    with requests_mock.mock() as mock:
+        mock.get('https://example.com/test', [
+            {'status_code': 503}, {'status_code': 502}, {'status_code': 200},
+        ])
+        response = client.get('test')
+
+    assert response.status_code == 200
+    assert mock.call_count == 3
+    assert [item[0][0] for item in mock_sleep.call_args_list] == [0.1, 0.2]
+    assert client.retry_policy.retries == 2
+    # each attempt is signed afresh
+    signatures = {item.headers['X-Signature'] for item in mock.request_history}
+    assert len(signatures) == 3
+
+
+@patch('time.sleep')
+def test_retry_exception(mock_sleep):
+    client = create_retrying_client()
+
+    with requests_mock.mock() as mock:
+        mock.get('https://example.com/test', [
+            {'exc': requests.exceptions.ConnectionError}, {'status_code': 200},
+        ])
+        response = client.get('test')
+
+    assert response.status_code == 200
+    assert mock.call_count == 2
+
+
+@patch('time.sleep')
+def test_retry_exhausted(mock_sleep):
+    client = create_retrying_client(max_attempts=2)
+
+    with requests_mock.mock() as mock:
+        mock.get(
+            'https://example.com/test', exc=requests.exceptions.ConnectTimeout
+        )
+        with pytest.raises(requests.exceptions.ConnectTimeout):
+            client.get('test')
+
+    assert mock.call_count == 2
+    assert client.retry_policy.retries_exhausted == 1
+
+
+@patch('time.sleep')
+def test_retry_not_for_post(mock_sleep):
+    client = create_retrying_client()
+
+    with requests_mock.mock() as mock:
+        mock.post('https://example.com/test', status_code=503)
+        response = client.post('test')
+
+    assert response.status_code == 503
+    assert mock.call_count == 1
+
+
+@patch('time.sleep')
+def test_retry_not_with_files(mock_sleep):
+    client = create_retrying_client(methods=['PATCH'])
+
+    with requests_mock.mock() as mock:
+        mock.patch('https://example.com/test', status_code=503)
+        client.patch('test', data={}, files={'logo': StringIO('hello')})
+
+    assert mock.call_count == 1
+
+
+def test_no_retry_policy():
+    client = TestAPIClient(
+        base_url='https://example.com/',
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+    )
+
+    with requests_mock.mock() as mock:
+        mock.get('https://example.com/test', status_code=503)
+        response = client.get('test')
+
+    assert response.status_code == 503
+    assert mock.call_count == 1
+
+
+def test_circuit_breaker_fails_fast():
+    client = TestAPIClient(
+        base_url='https://example.com/',
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+        circuit_breaker=CircuitBreaker(minimum_requests=2),
+    )
+
+    with requests_mock.mock() as mock:
+        mock.get('https://example.com/test', exc=requests.exceptions.ConnectTimeout)
+        for _ in range(2):
+            with pytest.raises(requests.exceptions.ConnectTimeout):
+                client.get('test')
+        with pytest.raises(CircuitBreakerOpen):
+            client.get('test')
+
+    assert mock.call_count == 2
+
+
+@patch('time.sleep')
+def test_circuit_breaker_open_not_retried(mock_sleep):
+    client = TestAPIClient(
+        base_url='https://example.com/',
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+        circuit_breaker=CircuitBreaker(minimum_requests=1),
+        retry_policy=RetryPolicy(),
+    )
+
+    with requests_mock.mock() as mock:
+        mock.get('https://example.com/test', status_code=503)
+        with pytest.raises(CircuitBreakerOpen):
+            client.get('test')
+
+    assert mock.call_count == 1
+
+
+def test_instrumentation_events(events):
+    client = TestAPIClient(
+        base_url='https://example.com/',
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+    )
+
+    with requests_mock.mock() as mock:
+        mock.post('https://example.com/test', content=b'{"a": 1}')
+        client.post('test', data={'key': 'value'})
+
+    names = [name for name, _ in events]
+    received = dict(events)[instrumentation.RESPONSE_RECEIVED]
+    finished = dict(events)[instrumentation.REQUEST_FINISHED]
+
+    assert names == [
+        instrumentation.REQUEST_STARTED,
+        instrumentation.REQUEST_SIGNED,
+        instrumentation.RESPONSE_RECEIVED,
+        instrumentation.REQUEST_FINISHED,
+    ]
+    assert received['url'] == 'https://example.com/test'
+    assert received['status_code'] == 200
+    assert received['bytes_sent'] == len('{"key": "value"}')
+    assert received['bytes_received'] == len('{"a": 1}')
+    assert finished['status_code'] == 200
+    assert finished['attempts'] == 1
+    assert finished['duration'] >= received['duration']
+
+
+@patch('time.sleep')
+def test_instrumentation_retry_events(mock_sleep, events):
+    client = create_retrying_client()
+
+    with requests_mock.mock() as mock:
+        mock.get('https://example.com/test', [
+            {'exc': requests.exceptions.ConnectionError}, {'status_code': 200},
+        ])
+        client.get('test')
+
+    names = [name for name, _ in events]
+    failed = dict(events)[instrumentation.REQUEST_FAILED]
+    retried = dict(events)[instrumentation.REQUEST_RETRIED]
+
+    assert names.count(instrumentation.REQUEST_SIGNED) == 2
+    assert isinstance(failed['exception'], requests.exceptions.ConnectionError)
+    assert retried['attempt'] == 1
+    assert retried['delay'] == 0.1
+    assert retried['url'] == 'https://example.com/test'
+    assert dict(events)[instrumentation.REQUEST_FINISHED]['attempts'] == 2
+
+
+def test_instrumentation_request_raised(events):
+    client = create_retrying_client(max_attempts=1)
+
+    with requests_mock.mock() as mock:
+        mock.get('https://example.com/test', exc=requests.exceptions.Timeout)
+        with pytest.raises(requests.exceptions.Timeout):
+            client.get('test')
+
+    finished = dict(events)[instrumentation.REQUEST_FINISHED]
+    assert finished['status_code'] is None
+
+
+def test_get_stream():
+    client = TestAPIClient(
+        base_url='https://example.com/',
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+    )
+
+    with requests_mock.mock() as mock:
+        mock.get('https://example.com/test', content=b'[1, 2, 3]')
+        response = client.get('test', stream=True)
+
+        assert response._content_consumed is False
+        assert list(
+            streaming.iter_json_items(response.iter_content(chunk_size=2))
+        ) == [1, 2, 3]
+
+
+def test_get_stream_size_not_read(events):
+    client = TestAPIClient(
+        base_url='https://example.com/',
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+    )
+
+    with requests_mock.mock() as mock:
+        mock.get('https://example.com/test', content=b'[1, 2, 3]')
+        response = client.get('test', stream=True)
+
+    received = dict(events)[instrumentation.RESPONSE_RECEIVED]
+    assert received['bytes_received'] is None
+    assert response._content_consumed is False
+
+
+def test_post_with_files_streamed_and_signed():
+    received = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            received['headers'] = self.headers
+            received['path'] = self.path
+            received['body'] = self.rfile.read(
+                int(self.headers['Content-Length'])
+            )
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = TestAPIClient(
+        base_url='http://127.0.0.1:{}/'.format(server.server_address[1]),
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+    )
+    upload = BytesIO(b'\x00\x01' * 100000)
+    try:
+        response = client.post(
+            'upload/', data={'key': 'value'}, files={'upload': upload}
+        )
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+    content_type = received['headers']['Content-Type']
+    boundary = content_type.split('boundary=')[1]
+    with patch('urllib3.filepost.choose_boundary', return_value=boundary):
+        expected_body = requests.Request(
+            'POST', 'http://example.com', data={'key': 'value'},
+            files={'upload': BytesIO(b'\x00\x01' * 100000)},
+        ).prepare().body
+
+    assert response.status_code == 200
+    assert received['body'] == expected_body
+    Receiver(
+        lambda sender_id: {
+            'id': sender_id, 'key': 'test', 'algorithm': 'sha256'
+        },
+        received['headers']['X-Signature'],
+        received['path'],
+        'POST',
+        content=received['body'],
+        content_type=content_type,
+        seen_nonce=lambda *args: False,
+    )
@@ -7,3 +7,11 @@ def test_sso_authenticator():
     assert instance.headers == {
         'If-None-Match': '123'
     }
+
+
+def test_last_modified_cache_control():
+    instance = cache_control.LastModifiedCacheControl('123')
+
+    assert instance.headers == {
+        'If-Modified-Since': '123'
+    }
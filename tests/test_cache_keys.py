@@ -0,0 +1,77 @@
+from directory_client_core import authentication, cache_keys
+
+
+class Client:
+    version = 2
+
+
+def test_build():
+    builder = cache_keys.CacheKeyBuilder(namespace='api', version=3)
+
+    key = builder.build('/some/path/?' + 'a=b&' * 1000)
+
+    assert key.startswith('api:3:')
+    assert len(key) == len('api:3:') + 64
+    assert builder.build('/some/path/?a=b') == builder.build('/some/path/?a=b')
+    assert builder.build('/some/path/?a=b') != builder.build('/some/path/?a=c')
+
+
+def test_build_version():
+    canonical_key = '/some/path/?a=b'
+
+    assert (
+        cache_keys.CacheKeyBuilder(version=1).build(canonical_key) !=
+        cache_keys.CacheKeyBuilder(version=2).build(canonical_key)
+    )
+
+
+def test_build_memoized():
+    builder = cache_keys.CacheKeyBuilder()
+
+    builder.build('/some/path/')
+    builder.build('/some/path/')
+
+    assert builder.hash.cache_info().hits == 1
+
+
+def test_vary_by_client_version():
+    builder = cache_keys.CacheKeyBuilder(
+        vary=[cache_keys.vary_by_client_version]
+    )
+
+    class OtherClient:
+        version = 3
+
+    assert (
+        builder.build('/some/path/', Client()) !=
+        builder.build('/some/path/', OtherClient())
+    )
+
+
+def test_vary_by_authenticator():
+    builder = cache_keys.CacheKeyBuilder(
+        vary=[cache_keys.vary_by_authenticator]
+    )
+    keys = {
+        builder.build('/some/path/', Client(), authenticator)
+        for authenticator in (
+            None,
+            authentication.SessionSSOAuthenticator('1'),
+            authentication.SessionSSOAuthenticator('2'),
+            authentication.BearerAuthenticator('1'),
+        )
+    }
+
+    assert len(keys) == 4
+    assert builder.build(
+        '/some/path/', Client(), authentication.SessionSSOAuthenticator('1')
+    ) in keys
+
+
+def test_get_legacy_keys():
+    assert cache_keys.CacheKeyBuilder().get_legacy_keys('/a/') == (
+        'entry:/a/', '/a/'
+    )
+    assert cache_keys.CacheKeyBuilder(
+        read_legacy_keys=False
+    ).get_legacy_keys('/a/') == ()
@@ -0,0 +1,149 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+import requests
+
+from django.core.cache import caches
+
+from directory_client_core import circuit_breaker
+from directory_client_core.circuit_breaker import (
+    CircuitBreaker, CircuitBreakerOpen
+)
+
+
+@pytest.fixture
+def fallback_cache():
+    cache = caches['fallback']
+    cache.clear()
+    return cache
+
+
+@pytest.fixture
+def clock():
+    with patch.object(circuit_breaker, 'monotonic', return_value=0) as mock:
+        yield mock
+
+
+def create_response(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return response
+
+
+def fail(breaker, times, key='a'):
+    for _ in range(times):
+        breaker.before_request(key)
+        breaker.record_outcome(key, response=create_response(500))
+
+
+def test_circuit_breaker_opens_on_failure_rate(clock):
+    breaker = CircuitBreaker(failure_rate_threshold=0.5, minimum_requests=4)
+
+    breaker.record_outcome('a', response=create_response(200))
+    breaker.record_outcome('a', response=create_response(404))
+    fail(breaker, 1)
+
+    assert breaker.get_state_name('a') == circuit_breaker.CLOSED
+
+    breaker.record_outcome('a', exception=requests.exceptions.Timeout())
+
+    assert breaker.get_state_name('a') == circuit_breaker.OPEN
+    with pytest.raises(CircuitBreakerOpen):
+        breaker.before_request('a')
+    # other keys are not affected
+    breaker.before_request('b')
+
+
+def test_circuit_breaker_not_open_below_minimum_requests(clock):
+    breaker = CircuitBreaker(minimum_requests=4)
+
+    fail(breaker, 3)
+
+    assert breaker.get_state_name('a') == circuit_breaker.CLOSED
+
+
+def test_circuit_breaker_window(clock):
+    breaker = CircuitBreaker(minimum_requests=2, window_seconds=10)
+
+    fail(breaker, 1)
+    clock.return_value = 11
+    breaker.record_outcome('a', response=create_response(200))
+    breaker.record_outcome('a', response=create_response(200))
+    fail(breaker, 1)
+
+    assert breaker.get_state_name('a') == circuit_breaker.CLOSED
+
+
+def test_circuit_breaker_half_open_success_closes(clock):
+    breaker = CircuitBreaker(minimum_requests=1, cool_off_seconds=30)
+    fail(breaker, 1)
+
+    clock.return_value = 30
+    assert breaker.get_state_name('a') == circuit_breaker.HALF_OPEN
+    breaker.before_request('a')
+    with pytest.raises(CircuitBreakerOpen):
+        # only one trial request at a time
+        breaker.before_request('a')
+    breaker.record_outcome('a', response=create_response(200))
+
+    assert breaker.get_state_name('a') == circuit_breaker.CLOSED
+    breaker.before_request('a')
+
+
+def test_circuit_breaker_half_open_failure_opens(clock):
+    breaker = CircuitBreaker(minimum_requests=1, cool_off_seconds=30)
+    fail(breaker, 1)
+
+    clock.return_value = 30
+    fail(breaker, 1)
+
+    assert breaker.get_state_name('a') == circuit_breaker.OPEN
+    clock.return_value = 59
+    assert breaker.get_state_name('a') == circuit_breaker.OPEN
+    clock.return_value = 60
+    assert breaker.get_state_name('a') == circuit_breaker.HALF_OPEN
+
+
+def test_circuit_breaker_shared(clock, fallback_cache):
+    breaker_one = CircuitBreaker(minimum_requests=1, cache=fallback_cache)
+    breaker_two = CircuitBreaker(minimum_requests=1, cache=fallback_cache)
+
+    fail(breaker_one, 1)
+
+    assert fallback_cache.get('circuit-breaker-open-a') is not None
+    with pytest.raises(CircuitBreakerOpen):
+        breaker_two.before_request('a')
+
+
+def test_circuit_breaker_shared_check_throttled(clock, fallback_cache):
+    breaker = CircuitBreaker(
+        cache=fallback_cache, shared_check_seconds=1
+    )
+
+    with patch.object(fallback_cache, 'get', return_value=None) as mock_get:
+        breaker.before_request('a')
+        breaker.before_request('a')
+        clock.return_value = 1
+        breaker.before_request('a')
+
+    assert mock_get.call_count == 2
+
+
+def test_circuit_breaker_shared_async(clock, fallback_cache):
+    breaker_one = CircuitBreaker(minimum_requests=1, cache=fallback_cache)
+    breaker_two = CircuitBreaker(minimum_requests=1, cache=fallback_cache)
+
+    async def run():
+        await breaker_one.abefore_request('a')
+        await breaker_one.arecord_outcome(
+            'a', exception=requests.exceptions.ConnectionError()
+        )
+        await breaker_two.abefore_request('a')
+
+    with pytest.raises(CircuitBreakerOpen):
+        asyncio.run(run())
+
+
+def test_circuit_breaker_open_is_request_exception():
+    assert issubclass(CircuitBreakerOpen, requests.exceptions.RequestException)
@@ -0,0 +1,92 @@
+import os
+import zlib
+from unittest.mock import patch
+
+import pytest
+
+from directory_client_core import compression
+
+
+BODY = b'{"key": "value"}' * 200
+
+
+def test_encode_compresses():
+    compressor = compression.Compressor()
+
+    encoded = compressor.encode(BODY)
+
+    assert encoded[0] == compression.ZlibCodec.codec_id
+    assert zlib.decompress(encoded[1:]) == BODY
+    assert compression.decode(encoded) == BODY
+
+
+@pytest.mark.parametrize('body', (b'{}', os.urandom(2000)))
+def test_encode_stores_as_is(body):
+    # smaller than min_size, or not made smaller by compressing
+    encoded = compression.Compressor(min_size=100).encode(body)
+
+    assert encoded[0] == compression.IdentityCodec.codec_id
+    assert compression.decode(encoded) == body
+
+
+def test_encode_entry():
+    compressor = compression.Compressor()
+    cache_entry = {'body': BODY, 'etag': '"1"'}
+
+    encoded_entry = compressor.encode_entry(cache_entry)
+
+    assert encoded_entry['encoded'] is True
+    assert encoded_entry['etag'] == '"1"'
+    assert compression.decode(encoded_entry['body']) == BODY
+    assert compressor.encode_entry(encoded_entry) is encoded_entry
+    assert cache_entry['body'] == BODY
+
+
+def test_encode_entry_without_body():
+    cache_entry = {'body': None, 'body_ref': {'name': 'a'}}
+
+    assert compression.Compressor().encode_entry(cache_entry) is cache_entry
+
+
+def test_custom_codec():
+    class TrailingCodec(compression.Codec):
+        # drops the "!" every body ends with
+        codec_id = 200
+
+        def compress(self, data):
+            return data[:-1]
+
+        def decompress(self, data):
+            return bytes(data) + b'!'
+
+    compression.register_codec(TrailingCodec())
+    try:
+        encoded = compression.Compressor(
+            codec=TrailingCodec(), min_size=0
+        ).encode(b'abc!')
+        assert encoded == b'\xc8abc'
+        assert compression.decode(encoded) == b'abc!'
+    finally:
+        del compression.codecs[200]
+
+
+def test_register_codec_id_must_fit_in_byte():
+    class Codec(compression.Codec):
+        codec_id = 256
+
+    with pytest.raises(ValueError):
+        compression.register_codec(Codec())
+
+
+def test_lazy_decoded_body():
+    encoded = compression.Compressor().encode(BODY)
+
+    with patch.object(
+        compression, 'decode', wraps=compression.decode
+    ) as mock_decode:
+        body = compression.LazyDecodedBody(encoded)
+        assert mock_decode.call_count == 0
+        assert body.read(10) == BODY[:10]
+        assert body.read() == BODY[10:]
+
+    assert mock_decode.call_count == 1
@@ -1,16 +1,32 @@
+import asyncio
+import io
 import json
 import logging
+import threading
+import time
 from unittest.mock import patch
 
 from freezegun import freeze_time
+import httpx
 import pytest
 import requests_mock
 import requests
 
 from django.core.cache import caches
 
+from directory_client_core.async_base import AsyncAbstractAPIClient
 from directory_client_core.base import AbstractAPIClient
-from directory_client_core import helpers
+from directory_client_core import (
+    authentication, cache_keys, compression, helpers, instrumentation,
+    invalidation, json_backends, streaming
+)
+from directory_client_core.circuit_breaker import CircuitBreaker
+from directory_client_core.local_cache import LocalCache
+from directory_client_core.revalidation import BackgroundRevalidator
+from directory_client_core.single_flight import SingleFlight
+
+
+ENTRY_KEY = helpers.build_entry_key('/some/path/', {})
 
 
 @pytest.fixture
@@ -21,15 +37,18 @@ def fallback_cache():
 @pytest.fixture(autouse=True)
 def clear_fallback_cache(fallback_cache):
     fallback_cache.clear()
+    # records seen by earlier tests would otherwise be filtered out
+    for log_filter in helpers.logger.filters:
+        if isinstance(log_filter, helpers.ThrottlingFilter):
+            log_filter.clear()
 
 
-@pytest.fixture
-def cached_client(fallback_cache):
+def create_cached_client(fallback_cache, **fallback_kwargs):
 
     class APIClient(AbstractAPIClient):
         version = 1
 
-        @helpers.fallback(cache=fallback_cache)
+        @helpers.fallback(cache=fallback_cache, **fallback_kwargs)
         def get(self, *args, **kwargs):
             return super().get(*args, **kwargs)
 
@@ -47,6 +66,40 @@ def cached_client(fallback_cache):
     )
 
 
+def create_async_cached_client(fallback_cache, **fallback_kwargs):
+
+    class AsyncAPIClient(AsyncAbstractAPIClient):
+        version = 1
+
+        @helpers.async_fallback(cache=fallback_cache, **fallback_kwargs)
+        async def get(self, *args, **kwargs):
+            return await super().get(*args, **kwargs)
+
+        async def retrieve(self, slug):
+            return await self.get(
+                url='/some/path/{slug}/'.format(slug=slug),
+                params={'x': 'y', 'a': 'b'},
+            )
+
+    client = AsyncAPIClient(
+        base_url='http://example.com',
+        api_key='debug',
+        sender_id='test-sender',
+        timeout=5,
+    )
+    # requests are answered by the handler set on the client
+    client.handler = None
+    client.create_http_client = lambda: httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: client.handler(request))
+    )
+    return client
+
+
+@pytest.fixture
+def cached_client(fallback_cache):
+    return create_cached_client(fallback_cache)
+
+
 def test_good_response_cached(cached_client, fallback_cache):
     expected_data = bytes(json.dumps({'key': 'value'}), 'utf8')
     path = '/some/path/thing/'
@@ -55,8 +108,8 @@ def test_good_response_cached(cached_client, fallback_cache):
         mock.get('http://example.com' + path, content=expected_data)
         cached_client.retrieve('thing')
 
-    cache_key = path + '?a=b&x=y'
-    assert fallback_cache.get(cache_key) == expected_data
+    cache_key = helpers.build_entry_key(path, {'a': 'b', 'x': 'y'})
+    assert fallback_cache.get(cache_key)['body'] == expected_data
 
 
 def test_good_response_etag(cached_client, fallback_cache):
@@ -73,8 +126,8 @@ def test_good_response_etag(cached_client, fallback_cache):
         mock.get(url, content=expected_data, headers=headers)
         cached_client.retrieve('thing')
 
-    cache_key = path + '?a=b&x=y'
-    assert fallback_cache.get(cache_key) == expected_data
+    cache_key = helpers.build_entry_key(path, {'a': 'b', 'x': 'y'})
+    assert fallback_cache.get(cache_key)['body'] == expected_data
 
     # when the same page is requested and the remote server returns 304
     with requests_mock.mock() as mock:
@@ -99,7 +152,7 @@ def test_good_response_cache_timeout(cached_client, fallback_cache, settings):
         mock.get('http://example.com' + path, content=expected_data)
         cached_client.retrieve('thing')
 
-    cache_key = path + '?a=b&x=y'
+    cache_key = helpers.build_entry_key(path, {'a': 'b', 'x': 'y'})
 
     key = fallback_cache.make_key(cache_key)
     fallback_cache.validate_key(key)
@@ -107,6 +160,82 @@ def test_good_response_cache_timeout(cached_client, fallback_cache, settings):
     assert fallback_cache._expire_info.get(key) == 1326499300.0
 
 
+@freeze_time('2012-01-14')
+def test_good_response_cache_entry(cached_client, fallback_cache):
+    path = '/some/path/thing/'
+    headers = {
+        'ETag': '"123"',
+        'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT',
+        'Content-Type': 'application/json',
+    }
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com' + path, content=b'{}', headers=headers)
+        cached_client.retrieve('thing')
+
+    assert fallback_cache.get(
+        helpers.build_entry_key(path, {'a': 'b', 'x': 'y'})
+    ) == {
+        'body': b'{}',
+        'etag': '"123"',
+        'last_modified': 'Wed, 21 Oct 2015 07:28:00 GMT',
+        'content_type': 'application/json',
+        'stored_at': 1326499200.0,
+    }
+
+
+def test_good_response_last_modified(cached_client):
+    path = '/some/path/thing/'
+    url = 'http://example.com' + path
+    headers = {'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+
+    with requests_mock.mock() as mock:
+        mock.get(url, content=b'{"key": "value"}', headers=headers)
+        cached_client.retrieve('thing')
+
+    with requests_mock.mock() as mock:
+        mock.get(url, status_code=304)
+        response = cached_client.retrieve('thing')
+        request = mock.request_history[0]
+
+    assert request.headers['If-Modified-Since'] == headers['Last-Modified']
+    assert 'If-None-Match' not in request.headers
+    assert isinstance(response, helpers.CacheResponse)
+    assert response.content == b'{"key": "value"}'
+    assert response.headers['Last-Modified'] == headers['Last-Modified']
+
+
+def test_legacy_cache_entry(cached_client, fallback_cache):
+    path = '/some/path/thing/'
+    url = 'http://example.com' + path
+    legacy_content = b'{"key": "value", "etag": "123"}'
+    fallback_cache.set(path + '?a=b&x=y', legacy_content)
+
+    with requests_mock.mock() as mock:
+        mock.get(url, status_code=304)
+        response = cached_client.retrieve('thing')
+        request = mock.request_history[0]
+
+    assert request.headers['If-None-Match'] == '"123"'
+    assert isinstance(response, helpers.CacheResponse)
+    assert response.content == legacy_content
+
+
+def test_legacy_cache_entry_not_json(cached_client, fallback_cache):
+    path = '/some/path/thing/'
+    url = 'http://example.com' + path
+    fallback_cache.set(path + '?a=b&x=y', b'<html></html>')
+
+    with requests_mock.mock() as mock:
+        mock.get(url, status_code=500)
+        response = cached_client.retrieve('thing')
+        request = mock.request_history[0]
+
+    assert 'If-None-Match' not in request.headers
+    assert isinstance(response, helpers.CacheResponse)
+    assert response.content == b'<html></html>'
+
+
 def test_bad_resonse_cache_hit(cached_client, caplog):
     path = '/some/path/thing/'
     expected_data = bytes(json.dumps({'key': 'value'}), 'utf8')
@@ -215,8 +344,8 @@ def test_cache_querystrings(cached_client, fallback_cache):
         mock.get('http://example.com' + path, content=expected_data)
         cached_client.retrieve('thing',)
 
-    cache_key = path + '?a=b&x=y'
-    assert fallback_cache.get(cache_key) == expected_data
+    cache_key = helpers.build_entry_key(path, {'a': 'b', 'x': 'y'})
+    assert fallback_cache.get(cache_key)['body'] == expected_data
 
 
 def test_logging_noise_filtering(cached_client, caplog):
@@ -275,3 +404,1572 @@ def test_throttling_filter(fallback_cache):
 
     assert log_filter.filter(record) is True
     assert log_filter.filter(record) is False
+
+
+@pytest.fixture
+def async_cached_client(fallback_cache):
+    return create_async_cached_client(fallback_cache)
+
+
+def test_async_good_response_cached(async_cached_client, fallback_cache):
+    expected_data = bytes(json.dumps({'key': 'value'}), 'utf8')
+    async_cached_client.handler = lambda request: httpx.Response(
+        200, content=expected_data
+    )
+
+    response = asyncio.run(async_cached_client.retrieve('thing'))
+
+    assert isinstance(response, helpers.LiveResponse)
+    assert response.content == expected_data
+    assert fallback_cache.get(
+        helpers.build_entry_key('/some/path/thing/', {'a': 'b', 'x': 'y'})
+    )['body'] == (
+        expected_data
+    )
+
+
+def test_async_good_response_etag(async_cached_client):
+    expected_data = bytes(
+        json.dumps({'key': 'value', 'etag': '123'}), 'utf8'
+    )
+    requests_seen = []
+
+    def handler(request):
+        requests_seen.append(request)
+        if len(requests_seen) == 1:
+            return httpx.Response(
+                200, content=expected_data, headers={'ETag': '"123"'}
+            )
+        return httpx.Response(304)
+
+    async_cached_client.handler = handler
+
+    asyncio.run(async_cached_client.retrieve('thing'))
+    response = asyncio.run(async_cached_client.retrieve('thing'))
+
+    assert requests_seen[1].headers['If-None-Match'] == '"123"'
+    assert isinstance(response, helpers.CacheResponse)
+    assert response.content == expected_data
+
+
+def test_async_bad_response_cache_hit(async_cached_client, caplog):
+    expected_data = bytes(json.dumps({'key': 'value'}), 'utf8')
+    async_cached_client.handler = lambda request: httpx.Response(
+        200, content=expected_data
+    )
+    asyncio.run(async_cached_client.retrieve('thing'))
+
+    async_cached_client.handler = lambda request: httpx.Response(400)
+    response = asyncio.run(async_cached_client.retrieve('thing'))
+
+    assert response.status_code == 200
+    assert response.content == expected_data
+    assert isinstance(response, helpers.CacheResponse)
+
+    log = caplog.records[-1]
+    assert log.levelname == 'ERROR'
+    assert log.msg == helpers.MESSAGE_CACHE_HIT
+    assert log.status_code == 400
+    assert log.url == '/some/path/thing/'
+
+
+def test_async_bad_response_cache_miss(async_cached_client, caplog):
+    async_cached_client.handler = lambda request: httpx.Response(400)
+
+    response = asyncio.run(async_cached_client.retrieve('thing'))
+
+    assert response.status_code == 400
+    assert isinstance(response, helpers.FailureResponse)
+
+    log = caplog.records[-1]
+    assert log.levelname == 'ERROR'
+    assert log.msg == helpers.MESSAGE_CACHE_MISS
+    assert log.status_code == 400
+
+
+def test_async_bad_response_404(async_cached_client, caplog):
+    async_cached_client.handler = lambda request: httpx.Response(404)
+
+    response = asyncio.run(async_cached_client.retrieve('thing'))
+
+    assert response.status_code == 404
+    assert isinstance(response, helpers.LiveResponse)
+    log = caplog.records[-1]
+    assert log.msg == helpers.MESSAGE_NOT_FOUND
+    assert log.status_code == 404
+
+
+def test_async_connection_error_cache_hit(async_cached_client, caplog):
+    expected_data = bytes(json.dumps({'key': 'value'}), 'utf8')
+    async_cached_client.handler = lambda request: httpx.Response(
+        200, content=expected_data
+    )
+    asyncio.run(async_cached_client.retrieve('thing'))
+
+    def handler(request):
+        raise httpx.ConnectError('down', request=request)
+
+    async_cached_client.handler = handler
+    response = asyncio.run(async_cached_client.retrieve('thing'))
+
+    assert isinstance(response, helpers.CacheResponse)
+    assert response.content == expected_data
+    log = caplog.records[-1]
+    assert log.msg == helpers.MESSAGE_CACHE_HIT
+    assert log.url == '/some/path/thing/'
+
+
+def test_async_connection_error_cache_miss(async_cached_client, caplog):
+    def handler(request):
+        raise httpx.ConnectError('down', request=request)
+
+    async_cached_client.handler = handler
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        asyncio.run(async_cached_client.retrieve('thing'))
+
+    assert len(caplog.records) == 0
+
+
+def test_async_logging_noise_filtering(async_cached_client, caplog):
+    async_cached_client.handler = lambda request: httpx.Response(400)
+
+    asyncio.run(async_cached_client.retrieve('thing'))
+    asyncio.run(async_cached_client.retrieve('thing'))
+
+    errors = [item for item in caplog.records if item.levelname == 'ERROR']
+    assert len(errors) == 1
+
+
+def create_log_record(msg='something bad happened', url='https://a.com'):
+    return logging.getLogger().makeRecord(
+        name='',
+        level=logging.ERROR,
+        fn='',
+        lno=0,
+        msg=msg,
+        args=[],
+        exc_info=None,
+        extra={'url': url},
+    )
+
+
+def test_throttling_filter_local_tier(fallback_cache):
+    log_filter = helpers.ThrottlingFilter(cache=fallback_cache)
+    record = create_log_record()
+
+    with patch.object(fallback_cache, 'add', wraps=fallback_cache.add) as add:
+        assert log_filter.filter(record) is True
+        assert log_filter.filter(record) is False
+        assert log_filter.filter(record) is False
+
+    assert add.call_count == 1
+
+
+def test_throttling_filter_shared_tier(fallback_cache):
+    record = create_log_record()
+
+    assert helpers.ThrottlingFilter(cache=fallback_cache).filter(record)
+    # another process has already logged it
+    assert not helpers.ThrottlingFilter(cache=fallback_cache).filter(record)
+
+
+def test_throttling_filter_local_tier_bounded(fallback_cache):
+    log_filter = helpers.ThrottlingFilter(
+        cache=fallback_cache, max_local_keys=2
+    )
+
+    for url in ('https://a.com', 'https://b.com', 'https://c.com'):
+        log_filter.filter(create_log_record(url=url))
+
+    assert len(log_filter.seen) == 2
+    with patch.object(fallback_cache, 'add', wraps=fallback_cache.add) as add:
+        assert log_filter.filter(create_log_record(url='https://a.com')) is False
+        assert log_filter.filter(create_log_record(url='https://c.com')) is False
+
+    assert add.call_count == 1
+
+
+def test_throttling_filter_local_tier_expires(fallback_cache, settings):
+    settings.DIRECTORY_CLIENT_CORE_CACHE_LOG_THROTTLING_SECONDS = 10
+    log_filter = helpers.ThrottlingFilter(cache=fallback_cache)
+    record = create_log_record()
+
+    with patch('time.monotonic', return_value=1000):
+        assert log_filter.filter(record) is True
+    fallback_cache.clear()
+    with patch('time.monotonic', return_value=1011):
+        assert log_filter.filter(record) is True
+
+
+def test_throttling_filter_summary(fallback_cache, settings, caplog):
+    settings.DIRECTORY_CLIENT_CORE_CACHE_LOG_SUMMARY_SECONDS = 60
+    caplog.set_level(logging.INFO)
+    with patch('time.monotonic', return_value=1000):
+        log_filter = helpers.ThrottlingFilter(cache=fallback_cache)
+        for _ in range(3):
+            log_filter.filter(create_log_record())
+        log_filter.filter(create_log_record(msg='other'))
+        log_filter.filter(create_log_record(msg='other'))
+
+    assert caplog.records == []
+
+    with patch('time.monotonic', return_value=1061):
+        log_filter.filter(create_log_record(msg='new'))
+
+    summary, = caplog.records
+    assert summary.getMessage() == helpers.MESSAGE_SUPPRESSED
+    assert summary.suppressed == {'something bad happened': 2, 'other': 1}
+
+    with patch('time.monotonic', return_value=1200):
+        log_filter.filter(create_log_record(msg='newer'))
+
+    # nothing was suppressed since the last summary
+    assert len(caplog.records) == 1
+
+
+def test_install_log_filter_once(fallback_cache):
+    other_filter = logging.Filter()
+    helpers.logger.addFilter(other_filter)
+    try:
+        log_filter = helpers.install_log_filter(fallback_cache)
+        helpers.fallback(cache=fallback_cache)
+        helpers.async_fallback(cache=fallback_cache)
+
+        assert helpers.install_log_filter(fallback_cache) is log_filter
+        assert helpers.logger.filters.count(log_filter) == 1
+        assert other_filter in helpers.logger.filters
+    finally:
+        helpers.logger.removeFilter(other_filter)
+
+
+def test_throttling_filter_async(fallback_cache):
+    log_filter = helpers.ThrottlingFilter(cache=fallback_cache)
+    logger = logging.getLogger()
+    record = logger.makeRecord(
+        name='',
+        level='ERROR',
+        fn='',
+        lno='',
+        msg='something bad happened',
+        args=[],
+        exc_info='',
+        extra={'url': 'https://www.google.com'}
+    )
+
+    assert asyncio.run(log_filter.afilter(record)) is True
+    assert asyncio.run(log_filter.afilter(record)) is False
+
+
+@pytest.fixture
+def local_cache():
+    return LocalCache(fresh_seconds=60)
+
+
+@pytest.fixture
+def local_cached_client(fallback_cache, local_cache):
+    return create_cached_client(fallback_cache, local_cache=local_cache)
+
+
+def test_local_cache_fresh_skips_request(local_cached_client, local_cache):
+    url = 'http://example.com/some/path/'
+
+    with requests_mock.mock() as mock:
+        mock.get(url, content=b'{"key": "value"}')
+        response_one = local_cached_client.get('/some/path/')
+        response_two = local_cached_client.get('/some/path/')
+
+    assert mock.call_count == 1
+    assert isinstance(response_one, helpers.LiveResponse)
+    assert isinstance(response_two, helpers.CacheResponse)
+    assert response_two.content == b'{"key": "value"}'
+    assert local_cache.stats()['hits'] == 1
+
+
+def test_local_cache_stale_skips_shared_cache(
+    local_cached_client, local_cache, fallback_cache
+):
+    url = 'http://example.com/some/path/'
+    local_cache.fresh_seconds = 0
+
+    with requests_mock.mock() as mock:
+        mock.get(url, content=b'{}', headers={'ETag': '"1"'})
+        local_cached_client.get('/some/path/')
+
+    with patch.object(fallback_cache, 'get') as mock_cache_get:
+        with requests_mock.mock() as mock:
+            mock.get(url, status_code=304)
+            response = local_cached_client.get('/some/path/')
+            request = mock.request_history[0]
+
+    assert mock_cache_get.call_count == 0
+    assert request.headers['If-None-Match'] == '"1"'
+    assert isinstance(response, helpers.CacheResponse)
+
+
+def test_local_cache_populated_from_shared_cache(
+    local_cached_client, local_cache, fallback_cache
+):
+    url = 'http://example.com/some/path/'
+    fallback_cache.set(ENTRY_KEY, {'body': b'{}', 'etag': '"1"'})
+
+    with requests_mock.mock() as mock:
+        mock.get(url, status_code=500)
+        response = local_cached_client.get('/some/path/')
+
+    assert isinstance(response, helpers.CacheResponse)
+    assert local_cache.get(ENTRY_KEY) == (
+        {'body': b'{}', 'etag': '"1"'}, False
+    )
+
+
+def test_local_cache_not_modified_refreshes(local_cached_client, local_cache):
+    url = 'http://example.com/some/path/'
+    local_cache.set(ENTRY_KEY, {'body': b'{}', 'etag': '"1"'}, size=2)
+
+    with requests_mock.mock() as mock:
+        mock.get(url, status_code=304)
+        local_cached_client.get('/some/path/')
+        local_cached_client.get('/some/path/')
+
+    assert mock.call_count == 1
+
+
+@pytest.fixture
+def revalidator():
+    return BackgroundRevalidator(max_workers=1)
+
+
+@pytest.fixture
+def stale_cached_client(fallback_cache, revalidator, settings):
+    settings.DIRECTORY_CLIENT_CORE_CACHE_EXPIRE_SECONDS = 100
+
+    return create_cached_client(
+        fallback_cache,
+        stale_seconds=60,
+        revalidator=revalidator,
+    )
+
+
+def test_stale_while_revalidate_serves_cache(
+    stale_cached_client, fallback_cache, revalidator
+):
+    url = 'http://example.com/some/path/'
+
+    with freeze_time('2012-01-14 00:00:00'):
+        with requests_mock.mock() as mock:
+            mock.get(url, content=b'{"v": 1}', headers={'ETag': '"1"'})
+            response_one = stale_cached_client.get('/some/path/')
+
+    with freeze_time('2012-01-14 00:00:30'):
+        with requests_mock.mock() as mock:
+            mock.get(url, content=b'{"v": 2}', headers={'ETag': '"2"'})
+            response_two = stale_cached_client.get('/some/path/')
+            revalidator.shutdown(wait=True)
+            request = mock.request_history[0]
+        cache_entry = fallback_cache.get(ENTRY_KEY)
+
+    assert isinstance(response_one, helpers.LiveResponse)
+    assert isinstance(response_two, helpers.CacheResponse)
+    assert response_two.content == b'{"v": 1}'
+    assert request.headers['If-None-Match'] == '"1"'
+    assert cache_entry['body'] == b'{"v": 2}'
+    assert cache_entry['stored_at'] == 1326499230.0
+
+
+def test_stale_while_revalidate_not_modified_refreshes(
+    stale_cached_client, fallback_cache, revalidator
+):
+    url = 'http://example.com/some/path/'
+    fallback_cache.set(
+        ENTRY_KEY, {'body': b'{}', 'etag': '"1"', 'stored_at': 1326499200}
+    )
+
+    with freeze_time('2012-01-14 00:00:30'):
+        with requests_mock.mock() as mock:
+            mock.get(url, status_code=304)
+            stale_cached_client.get('/some/path/')
+            revalidator.shutdown(wait=True)
+        cache_entry = fallback_cache.get(ENTRY_KEY)
+
+    assert cache_entry['body'] == b'{}'
+    assert cache_entry['stored_at'] == 1326499230.0
+
+
+def test_stale_while_revalidate_failure_keeps_cache(
+    stale_cached_client, fallback_cache, revalidator, caplog
+):
+    url = 'http://example.com/some/path/'
+    cache_entry = {'body': b'{}', 'etag': '"1"', 'stored_at': 1326499200}
+    fallback_cache.set(ENTRY_KEY, cache_entry)
+
+    with freeze_time('2012-01-14 00:00:30'):
+        with requests_mock.mock() as mock:
+            mock.get(url, status_code=500)
+            response = stale_cached_client.get('/some/path/')
+            revalidator.shutdown(wait=True)
+
+    assert isinstance(response, helpers.CacheResponse)
+    assert fallback_cache.get(ENTRY_KEY) == cache_entry
+    log = caplog.records[-1]
+    assert log.msg == helpers.MESSAGE_REVALIDATION_FAILED
+    assert log.status_code == 500
+
+
+def test_stale_while_revalidate_outside_window(
+    stale_cached_client, fallback_cache, revalidator
+):
+    url = 'http://example.com/some/path/'
+    fallback_cache.set(
+        ENTRY_KEY, {'body': b'{}', 'etag': '"1"', 'stored_at': 1326499200}
+    )
+
+    with freeze_time('2012-01-14 00:01:30'):
+        with requests_mock.mock() as mock:
+            mock.get(url, content=b'{"v": 2}')
+            response = stale_cached_client.get('/some/path/')
+
+    assert isinstance(response, helpers.LiveResponse)
+    assert revalidator.executor is None
+
+
+def test_async_stale_while_revalidate(fallback_cache, revalidator, settings):
+    settings.DIRECTORY_CLIENT_CORE_CACHE_EXPIRE_SECONDS = 100
+
+    client = create_async_cached_client(
+        fallback_cache, stale_seconds=60, revalidator=revalidator
+    )
+    client.handler = lambda request: httpx.Response(200, content=b'{"v": 2}')
+    fallback_cache.set(
+        ENTRY_KEY, {'body': b'{}', 'stored_at': 1326499200}
+    )
+
+    async def run():
+        response = await client.get('/some/path/')
+        await asyncio.gather(*revalidator.tasks)
+        return response
+
+    with freeze_time('2012-01-14 00:00:30'):
+        response = asyncio.run(run())
+        cache_entry = fallback_cache.get(ENTRY_KEY)
+
+    assert isinstance(response, helpers.CacheResponse)
+    assert response.content == b'{}'
+    assert cache_entry['body'] == b'{"v": 2}'
+
+
+@freeze_time('2012-01-14 00:00:30')
+@pytest.mark.parametrize('cache_entry,is_current,expected', (
+    ({'body': b'{}', 'stored_at': 1326499200}, True, instrumentation.STALE),
+    ({'body': b'{}', 'stored_at': 1326499200}, False, None),
+    ({'body': b'{}', 'stored_at': 1326499000}, True, None),
+    ({'body': b'', 'stored_at': 1326499200, 'status_code': 404}, True,
+     instrumentation.NEGATIVE_HIT),
+    ({'body': b'', 'stored_at': 1326499200, 'status_code': 404}, False, None),
+    (None, True, None),
+))
+def test_resolve_cache_entry(cache_entry, is_current, expected):
+    outcome, fallback_entry = helpers.resolve_cache_entry(
+        cache_entry, is_current, negative_seconds=60, stale_seconds=60
+    )
+
+    assert outcome == expected
+    if helpers.is_negative(cache_entry) and expected is None:
+        # a negative entry is never fallen back on
+        assert fallback_entry is None
+    else:
+        assert fallback_entry is cache_entry
+
+
+def test_single_flight_coalesces_requests(fallback_cache):
+    single_flight = SingleFlight()
+
+    client = create_cached_client(fallback_cache, single_flight=single_flight)
+    release = threading.Event()
+    responses = []
+
+    def callback(request, context):
+        release.wait()
+        return b'{"key": "value"}'
+
+    def retrieve():
+        responses.append(client.get('/some/path/'))
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', content=callback)
+        threads = [threading.Thread(target=retrieve) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while single_flight.coalesced < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+    assert mock.call_count == 1
+    assert len(responses) == 5
+    assert all(response.content == b'{"key": "value"}' for response in responses)
+
+
+def test_single_flight_not_shared_between_users(fallback_cache):
+    single_flight = SingleFlight()
+
+    client = create_cached_client(fallback_cache, single_flight=single_flight)
+    release = threading.Event()
+    started = []
+    responses = {}
+
+    def callback(request, context):
+        started.append(request)
+        release.wait()
+        return request.headers['Authorization'].encode()
+
+    def retrieve(token):
+        responses[token] = client.get(
+            '/some/path/',
+            authenticator=authentication.BearerAuthenticator(token),
+        )
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', content=callback)
+        threads = [
+            threading.Thread(target=retrieve, args=(token,))
+            for token in ('a', 'b')
+        ]
+        for thread in threads:
+            thread.start()
+        while len(started) < 2:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+    assert single_flight.coalesced == 0
+    assert responses['a'].content == b'Bearer a'
+    assert responses['b'].content == b'Bearer b'
+
+
+def test_build_flight_key():
+    authenticator = authentication.BearerAuthenticator('secret')
+    flight_key = helpers.build_flight_key('/a/', authenticator)
+
+    assert helpers.build_flight_key('/a/', None) == '/a/'
+    assert flight_key.startswith('/a/-')
+    assert 'secret' not in flight_key
+    assert flight_key != helpers.build_flight_key(
+        '/a/', authentication.BearerAuthenticator('other')
+    )
+
+
+def test_single_flight_waiters_get_own_response(fallback_cache):
+    single_flight = SingleFlight()
+
+    client = create_cached_client(
+        fallback_cache,
+        single_flight=single_flight,
+        compressor=compression.Compressor(min_size=10),
+    )
+    body = b'[' + b', '.join([b'{"key": "value"}'] * 100) + b']'
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', content=body)
+        client.get('/some/path/')
+    release = threading.Event()
+    responses = []
+
+    def callback(request, context):
+        release.wait()
+        context.status_code = 500
+        return b''
+
+    def retrieve():
+        responses.append(client.get('/some/path/'))
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', content=callback)
+        threads = [threading.Thread(target=retrieve) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while single_flight.coalesced < 2:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+    # the cached body is decompressed from a stream that is read once
+    assert all(isinstance(r, helpers.CacheResponse) for r in responses)
+    assert len({id(response) for response in responses}) == 3
+    assert all(r.content == body for r in responses)
+    responses[0].json().append('changed')
+    responses[0].headers['X-Changed'] = '1'
+    assert len(responses[1].json()) == 100
+    assert 'X-Changed' not in responses[1].headers
+
+
+def test_single_flight_uses_content_from_other_process(fallback_cache):
+    single_flight = SingleFlight(cache=fallback_cache, poll_interval=0.001)
+
+    client = create_cached_client(fallback_cache, single_flight=single_flight)
+    # another process is retrieving the content
+    fallback_cache.add('single-flight-' + ENTRY_KEY, 1)
+
+    def finish_other_process():
+        fallback_cache.set(
+            ENTRY_KEY, {'body': b'{}', 'stored_at': time.time() + 1}
+        )
+        fallback_cache.delete('single-flight-' + ENTRY_KEY)
+
+    timer = threading.Timer(0.05, finish_other_process)
+    timer.start()
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', content=b'{"v": 2}')
+        response = client.get('/some/path/')
+
+    assert mock.call_count == 0
+    assert isinstance(response, helpers.CacheResponse)
+    assert response.content == b'{}'
+
+
+def test_async_single_flight_coalesces_requests(fallback_cache):
+    single_flight = SingleFlight()
+    requests_seen = []
+
+    async def handler(request):
+        requests_seen.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, content=b'{}')
+
+    client = create_async_cached_client(
+        fallback_cache, single_flight=single_flight
+    )
+    client.handler = handler
+
+    async def run():
+        return await asyncio.gather(
+            *[client.get('/some/path/') for _ in range(5)]
+        )
+
+    responses = asyncio.run(run())
+
+    assert len(requests_seen) == 1
+    assert all(response.content == b'{}' for response in responses)
+
+
+def test_circuit_breaker_open_cache_hit(fallback_cache, caplog):
+    client = create_cached_client(fallback_cache)
+    client.circuit_breaker = CircuitBreaker(minimum_requests=1)
+    fallback_cache.set(ENTRY_KEY, {'body': b'{}'})
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', status_code=500)
+        client.get('/some/path/')
+        response = client.get('/some/path/')
+
+    assert mock.call_count == 1
+    assert isinstance(response, helpers.CacheResponse)
+    assert response.content == b'{}'
+
+
+def get_outcomes(events):
+    return [
+        data['outcome'] for name, data in events
+        if name == instrumentation.FALLBACK
+    ]
+
+
+def test_fallback_outcome_events(cached_client, fallback_cache, events):
+    url = 'http://example.com/some/path/'
+
+    with requests_mock.mock() as mock:
+        mock.get(url, content=b'{}', headers={'ETag': '"1"'})
+        cached_client.get('/some/path/')
+        mock.get(url, status_code=304)
+        cached_client.get('/some/path/')
+        mock.get(url, status_code=500)
+        cached_client.get('/some/path/')
+        fallback_cache.clear()
+        cached_client.get('/some/path/')
+        mock.get(url, exc=requests.exceptions.ConnectTimeout)
+        with pytest.raises(requests.exceptions.ConnectTimeout):
+            cached_client.get('/some/path/')
+
+    assert get_outcomes(events) == [
+        instrumentation.LIVE,
+        instrumentation.NOT_MODIFIED,
+        instrumentation.HIT,
+        instrumentation.MISS,
+        instrumentation.MISS,
+    ]
+    assert events[-1][1]['cache_key'] == ENTRY_KEY
+    assert [
+        data['error'] for name, data in events
+        if name == instrumentation.FALLBACK
+    ] == [None, None, 'status 500', 'status 500', 'ConnectTimeout()']
+
+
+def test_fallback_outcome_local_hit(local_cached_client, local_cache, events):
+    local_cache.set(ENTRY_KEY, {'body': b'{}'}, size=2, fresh=True)
+
+    local_cached_client.get('/some/path/')
+
+    assert get_outcomes(events) == [instrumentation.HIT]
+
+
+def test_fallback_outcome_stale(
+    stale_cached_client, fallback_cache, revalidator, events
+):
+    fallback_cache.set(
+        ENTRY_KEY, {'body': b'{}', 'etag': '"1"', 'stored_at': 1326499200}
+    )
+
+    with freeze_time('2012-01-14 00:00:30'):
+        with requests_mock.mock() as mock:
+            mock.get('http://example.com/some/path/', status_code=304)
+            stale_cached_client.get('/some/path/')
+            revalidator.shutdown(wait=True)
+
+    assert get_outcomes(events) == [instrumentation.STALE]
+
+
+def test_async_fallback_outcome_events(async_cached_client, events):
+    async_cached_client.handler = lambda request: httpx.Response(
+        200, content=b'{}'
+    )
+    asyncio.run(async_cached_client.get('/some/path/'))
+    async_cached_client.handler = lambda request: httpx.Response(500)
+    asyncio.run(async_cached_client.get('/some/path/'))
+
+    assert get_outcomes(events) == [
+        instrumentation.LIVE, instrumentation.HIT,
+    ]
+
+
+def test_stream_cached_once_read(fallback_cache):
+    client = create_cached_client(fallback_cache)
+    url = 'http://example.com/some/path/'
+
+    with requests_mock.mock() as mock:
+        mock.get(url, content=b'{"key": "value"}', headers={'ETag': '"1"'})
+        response = client.get('/some/path/', stream=True)
+
+        assert isinstance(response, helpers.LiveResponse)
+        assert fallback_cache.get(ENTRY_KEY) is None
+
+        assert response.json() == {'key': 'value'}
+
+    cache_entry = fallback_cache.get(ENTRY_KEY)
+    assert cache_entry['body'] == b'{"key": "value"}'
+    assert cache_entry['etag'] == '"1"'
+
+
+def test_stream_not_cached_if_closed_early(fallback_cache):
+    client = create_cached_client(fallback_cache)
+    url = 'http://example.com/some/path/'
+
+    with requests_mock.mock() as mock:
+        mock.get(url, content=b'{"key": "value"}')
+        response = client.get('/some/path/', stream=True)
+        next(response.iter_content(chunk_size=2))
+        response.close()
+
+    assert fallback_cache.get(ENTRY_KEY) is None
+
+
+@pytest.mark.parametrize('create_body_store', (
+    lambda tmp_path: streaming.FileBodyStore(str(tmp_path)),
+    lambda tmp_path: streaming.CacheBodyStore(caches['fallback'], chunk_size=4),
+))
+def test_stream_body_store(fallback_cache, tmp_path, create_body_store):
+    client = create_cached_client(
+        fallback_cache, body_store=create_body_store(tmp_path)
+    )
+    url = 'http://example.com/some/path/'
+    body = b'{"key": "value"}'
+
+    with requests_mock.mock() as mock:
+        mock.get(url, content=body, headers={'ETag': '"1"'})
+        b''.join(client.get('/some/path/', stream=True).iter_content(3))
+
+        cache_entry = fallback_cache.get(ENTRY_KEY)
+        mock.get(url, status_code=500)
+        cached_response = client.get('/some/path/')
+        mock.get(url, status_code=304)
+        not_modified_response = client.get('/some/path/', stream=True)
+
+    assert cache_entry['body'] is None
+    assert cache_entry['size'] == len(body)
+    assert isinstance(cached_response, helpers.CacheResponse)
+    assert cached_response.content == body
+    assert cached_response.headers['ETag'] == '"1"'
+    assert b''.join(not_modified_response.iter_content(4)) == body
+
+
+def test_stream_body_store_retires_replaced_body(fallback_cache):
+    body_store = streaming.CacheBodyStore(fallback_cache, chunk_size=4)
+    client = create_cached_client(fallback_cache, body_store=body_store)
+    url = 'http://example.com/some/path/'
+
+    with requests_mock.mock() as mock:
+        mock.get(url, content=b'{"key": "value"}', headers={'ETag': '"1"'})
+        b''.join(client.get('/some/path/', stream=True).iter_content(3))
+        first_entry = fallback_cache.get(ENTRY_KEY)
+        mock.get(url, status_code=304)
+        b''.join(client.get('/some/path/', stream=True).iter_content(3))
+        mock.get(url, content=b'{"key": "other"}', headers={'ETag': '"2"'})
+        with freeze_time() as frozen_time:
+            b''.join(client.get('/some/path/', stream=True).iter_content(3))
+            # a 304 keeps the body, a new body retires it
+            assert body_store.exists(first_entry['body_ref'])
+            frozen_time.tick(body_store.retired_seconds + 1)
+            assert not body_store.exists(first_entry['body_ref'])
+
+    cache_entry = fallback_cache.get(ENTRY_KEY)
+    assert body_store.open(cache_entry['body_ref']).read() == b'{"key": "other"}'
+
+
+def test_stream_file_body_store_hosts(fallback_cache, tmp_path):
+    # two hosts, each with its own files, sharing the fallback cache
+    host_a = create_cached_client(
+        fallback_cache,
+        body_store=streaming.FileBodyStore(str(tmp_path / 'a')),
+    )
+    host_b = create_cached_client(
+        fallback_cache,
+        body_store=streaming.FileBodyStore(str(tmp_path / 'b')),
+    )
+    url = 'http://example.com/some/path/'
+
+    with requests_mock.mock() as mock:
+        mock.get(url, content=b'v1', headers={'ETag': '"1"'})
+        b''.join(host_a.get('/some/path/', stream=True).iter_content(3))
+        mock.get(url, content=b'v2', headers={'ETag': '"2"'})
+        b''.join(host_b.get('/some/path/', stream=True).iter_content(3))
+        mock.get(url, status_code=500)
+        response = host_a.get('/some/path/')
+
+    # host A does not have the body of the entry host B stored, and does not
+    # serve its own older one
+    assert 'If-None-Match' not in mock.last_request.headers
+    assert isinstance(response, helpers.FailureResponse)
+
+
+def test_stream_body_store_missing_body(fallback_cache, tmp_path):
+    client = create_cached_client(
+        fallback_cache, body_store=streaming.FileBodyStore(str(tmp_path))
+    )
+    fallback_cache.set(
+        ENTRY_KEY, {'body': None, 'body_ref': {'name': 'missing'}}
+    )
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', status_code=500)
+        response = client.get('/some/path/')
+
+    assert isinstance(response, helpers.FailureResponse)
+
+
+@pytest.fixture
+def compressed_client(fallback_cache):
+    return create_cached_client(
+        fallback_cache,
+        compressor=compression.Compressor(min_size=10),
+    )
+
+
+def test_compressed_cache_entry(compressed_client, fallback_cache):
+    url = 'http://example.com/some/path/'
+    body = b'{"key": "value"}' * 100
+
+    with requests_mock.mock() as mock:
+        mock.get(url, content=body, headers={'ETag': '"1"'})
+        compressed_client.get('/some/path/')
+        mock.get(url, status_code=500)
+        response = compressed_client.get('/some/path/')
+
+    cache_entry = fallback_cache.get(ENTRY_KEY)
+    assert cache_entry['encoded'] is True
+    assert cache_entry['etag'] == '"1"'
+    assert len(cache_entry['body']) < len(body)
+    assert isinstance(response, helpers.CacheResponse)
+    assert response.content == body
+
+
+def test_compressed_not_modified_decompressed_when_read(
+    compressed_client, fallback_cache
+):
+    url = 'http://example.com/some/path/'
+    body = b'{"key": "value"}' * 100
+    fallback_cache.set(
+        ENTRY_KEY,
+        compression.Compressor().encode_entry({'body': body, 'etag': '"1"'}),
+    )
+
+    with patch.object(compression, 'decode', wraps=compression.decode) as mock:
+        with requests_mock.mock() as mock_request:
+            mock_request.get(url, status_code=304)
+            response = compressed_client.get('/some/path/')
+
+        assert isinstance(response, helpers.CacheResponse)
+        assert response.headers['ETag'] == '"1"'
+        assert mock.call_count == 0
+        assert response.content == body
+        assert mock.call_count == 1
+
+
+def test_compressed_reads_uncompressed_entry(compressed_client, fallback_cache):
+    fallback_cache.set(ENTRY_KEY, {'body': b'{"a": 1}', 'etag': '"1"'})
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', status_code=500)
+        response = compressed_client.get('/some/path/')
+
+    assert response.content == b'{"a": 1}'
+
+
+def test_uncompressed_reads_compressed_entry(cached_client, fallback_cache):
+    fallback_cache.set(
+        ENTRY_KEY,
+        compression.Compressor().encode_entry({'body': b'{"a": 1}' * 200}),
+    )
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', status_code=500)
+        response = cached_client.get('/some/path/')
+
+    assert response.content == b'{"a": 1}' * 200
+
+
+def test_async_compressed_cache_entry(fallback_cache):
+
+    body = b'{"key": "value"}' * 100
+    responses = [httpx.Response(200, content=body), httpx.Response(500)]
+    client = create_async_cached_client(
+        fallback_cache, compressor=compression.Compressor(min_size=10)
+    )
+    client.handler = lambda request: responses.pop(0)
+
+    asyncio.run(client.get('/some/path/'))
+    response = asyncio.run(client.get('/some/path/'))
+
+    assert fallback_cache.get(ENTRY_KEY)['encoded'] is True
+    assert response.content == body
+
+
+def test_json_decoded_once(cached_client):
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', json={'key': 'value'})
+        response = cached_client.get('/some/path/')
+
+    with patch.object(
+        json_backends.StdlibJSONBackend, 'loads', wraps=json.loads
+    ) as mock_loads:
+        assert response.json() == {'key': 'value'}
+        assert response.json() is response.json()
+
+    assert mock_loads.call_count == 1
+
+
+def test_json_uses_client_backend(fallback_cache):
+
+    client = create_cached_client(fallback_cache)
+    client.json_backend = json_backends.get_backend('orjson')
+    url = 'http://example.com/some/path/'
+
+    with requests_mock.mock() as mock:
+        mock.get(url, json={'key': 'value'})
+        live_response = client.get('/some/path/')
+        mock.get(url, status_code=500)
+        cache_response = client.get('/some/path/')
+
+    assert isinstance(cache_response, helpers.CacheResponse)
+    for response in (live_response, cache_response):
+        assert response.json_backend is client.json_backend
+        with patch.object(
+            json_backends.OrjsonJSONBackend, 'loads', wraps=json.loads
+        ) as mock_loads:
+            assert response.json() == {'key': 'value'}
+        assert mock_loads.call_count == 1
+
+
+def test_json_decode_error(cached_client):
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', text='{"key":')
+        response = cached_client.get('/some/path/')
+
+    with pytest.raises(requests.exceptions.JSONDecodeError):
+        response.json()
+
+
+def test_json_encoding():
+    response = helpers.CacheResponse.from_cached_content(
+        '{"key": "välue"}'.encode('utf-16')
+    )
+
+    assert response.json() == {'key': 'välue'}
+
+
+def test_json_with_arguments(cached_client):
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', json={'key': 'value'})
+        response = cached_client.get('/some/path/')
+
+    assert response.json(object_hook=lambda item: list(item)) == ['key']
+    assert response.json() == {'key': 'value'}
+
+
+def test_legacy_cache_entry_client_backend(fallback_cache):
+
+    client = create_cached_client(fallback_cache)
+    client.json_backend = json_backends.get_backend('orjson')
+    fallback_cache.set(
+        '/some/path/', b'{"key": "value", "etag": "123"}'
+    )
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', status_code=304)
+        with patch.object(
+            json_backends.OrjsonJSONBackend, 'loads', wraps=json.loads
+        ) as mock_loads:
+            client.get('/some/path/')
+
+    assert mock.last_request.headers['If-None-Match'] == '"123"'
+    assert mock_loads.call_count == 1
+
+
+def test_from_response_tags_in_place():
+    raw_response = requests.Response()
+    raw_response.status_code = 200
+    raw_response._content = b'{"key": "value"}'
+
+    response = helpers.LiveResponse.from_response(raw_response)
+
+    assert response is raw_response
+    assert isinstance(response, helpers.LiveResponse)
+    assert isinstance(response, requests.Response)
+    assert response.json() == {'key': 'value'}
+
+
+def test_from_response_streamed_body_left_unread():
+    raw_response = requests.Response()
+    raw_response.status_code = 500
+    raw_response.raw = io.BytesIO(b'error')
+
+    response = helpers.FailureResponse.from_response(raw_response)
+
+    assert isinstance(response, helpers.FailureResponse)
+    assert response._content_consumed is False
+    assert raw_response.raw.tell() == 0
+    assert response.content == b'error'
+
+
+def test_from_response_subclass():
+
+    class CustomResponse(requests.Response):
+        pass
+
+    raw_response = CustomResponse()
+    raw_response.status_code = 200
+    raw_response._content = b'{}'
+
+    response = helpers.LiveResponse.from_response(raw_response)
+
+    assert isinstance(response, helpers.LiveResponse)
+    assert type(raw_response) is CustomResponse
+    assert response.content == b'{}'
+    response.status_code = 201
+    assert raw_response.status_code == 201
+
+
+@pytest.fixture
+def negative_cached_client(fallback_cache, local_cache):
+    return create_cached_client(
+        fallback_cache,
+        local_cache=local_cache,
+        negative_seconds=30,
+        negative_status_codes=(404, 410),
+    )
+
+
+@pytest.mark.parametrize('status_code', (404, 410))
+def test_negative_cache_hit(
+    negative_cached_client, fallback_cache, events, status_code
+):
+    url = 'http://example.com/some/path/'
+
+    with freeze_time('2012-01-14 12:00:00'):
+        with requests_mock.mock() as mock:
+            mock.get(url, status_code=status_code, json={'detail': 'gone'})
+            live_response = negative_cached_client.get('/some/path/')
+            response = negative_cached_client.get('/some/path/')
+        cache_entry = fallback_cache.get(ENTRY_KEY)
+
+    assert mock.call_count == 1
+    assert isinstance(live_response, helpers.LiveResponse)
+    assert isinstance(response, helpers.CacheResponse)
+    assert response.status_code == status_code
+    assert response.json() == {'detail': 'gone'}
+    assert cache_entry['status_code'] == status_code
+    assert get_outcomes(events) == [
+        instrumentation.LIVE, instrumentation.NEGATIVE_HIT
+    ]
+
+
+def test_negative_cache_expires(negative_cached_client, local_cache):
+    url = 'http://example.com/some/path/'
+
+    with requests_mock.mock() as mock:
+        mock.get(url, status_code=404)
+        with freeze_time('2012-01-14 12:00:00'):
+            negative_cached_client.get('/some/path/')
+        mock.get(url, status_code=500)
+        with freeze_time('2012-01-14 12:00:31'):
+            # still fresh in the local cache, but past its TTL
+            assert local_cache.get(ENTRY_KEY)[1] is True
+            response = negative_cached_client.get('/some/path/')
+
+    assert mock.call_count == 2
+    assert 'If-None-Match' not in mock.last_request.headers
+    assert isinstance(response, helpers.FailureResponse)
+    assert response.status_code == 500
+
+
+@freeze_time('2012-01-14')
+def test_negative_cache_timeout(negative_cached_client, fallback_cache):
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', status_code=404)
+        negative_cached_client.get('/some/path/')
+
+    key = fallback_cache.make_key(ENTRY_KEY)
+    assert fallback_cache._expire_info.get(key) == 1326499200.0 + 30
+
+
+def test_negative_cache_replaces_content(negative_cached_client, fallback_cache):
+    fallback_cache.set(ENTRY_KEY, {'body': b'{}', 'stored_at': None})
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', status_code=404)
+        negative_cached_client.get('/some/path/')
+        response = negative_cached_client.get('/some/path/')
+
+    assert mock.call_count == 1
+    assert response.status_code == 404
+
+
+def test_negative_cache_status_codes(cached_client, fallback_cache):
+    # not configured, so a 410 is served from the cache and a 404 is not
+    # stored
+    fallback_cache.set(ENTRY_KEY, {'body': b'{}', 'stored_at': None})
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', status_code=410)
+        response = cached_client.get('/some/path/')
+        mock.get('http://example.com/some/path/', status_code=404)
+        cached_client.get('/some/path/')
+
+    assert isinstance(response, helpers.CacheResponse)
+    assert fallback_cache.get(ENTRY_KEY)['body'] == b'{}'
+
+
+def test_async_negative_cache_hit(fallback_cache, events):
+
+    requests_seen = []
+
+    def handler(request):
+        requests_seen.append(request)
+        return httpx.Response(404, content=b'{"detail": "gone"}')
+
+    client = create_async_cached_client(fallback_cache, negative_seconds=30)
+    client.handler = handler
+
+    asyncio.run(client.get('/some/path/'))
+    response = asyncio.run(client.get('/some/path/'))
+
+    assert len(requests_seen) == 1
+    assert isinstance(response, helpers.CacheResponse)
+    assert response.status_code == 404
+    assert response.json() == {'detail': 'gone'}
+    assert get_outcomes(events) == [
+        instrumentation.LIVE, instrumentation.NEGATIVE_HIT
+    ]
+
+
+def test_entry_stored_alongside_legacy_value(cached_client, fallback_cache):
+    # written by a version that reads the canonical url key as bytes
+    fallback_cache.set('/some/path/', b'{"v": 1}')
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', status_code=500)
+        response = cached_client.get('/some/path/')
+        mock.get('http://example.com/some/path/', content=b'{"v": 2}')
+        cached_client.get('/some/path/')
+
+    assert response.content == b'{"v": 1}'
+    assert fallback_cache.get('/some/path/') == b'{"v": 1}'
+    assert fallback_cache.get(ENTRY_KEY)['body'] == b'{"v": 2}'
+
+
+def test_get_many_spec_without_params(cached_client):
+    authenticator = authentication.BearerAuthenticator('token')
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', content=b'{}')
+        responses = cached_client.get_many([
+            ('/some/path/', None, authenticator)
+        ])
+
+    assert isinstance(responses[0], helpers.LiveResponse)
+    assert mock.last_request.headers['Authorization'] == 'Bearer token'
+    assert helpers.build_cache_key('/some/path/', None) == '/some/path/'
+
+
+def test_build_cache_key_memoized():
+    helpers.canonicalize.cache_clear()
+
+    helpers.build_cache_key('/some/path/', {'b': 1, 'a': 2})
+    key = helpers.build_cache_key('/some/path/', {'b': 1, 'a': 2})
+
+    assert key == '/some/path/?a=2&b=1'
+    assert helpers.canonicalize.cache_info().hits == 1
+    assert helpers.build_cache_key('/some/path/', [('a', 2)]) == '/some/path/?a=2'
+    # not hashable, so not memoized
+    assert helpers.build_cache_key('/some/path/', {'a': ['x']}) == (
+        '/some/path/?a=%5B%27x%27%5D'
+    )
+
+
+def test_key_builder(fallback_cache, events):
+    key_builder = cache_keys.CacheKeyBuilder(namespace='test')
+    client = create_cached_client(fallback_cache, key_builder=key_builder)
+    cache_key = key_builder.build('/some/path/?a=b')
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/?a=b', content=b'{}')
+        client.get('/some/path/', params={'a': 'b'})
+
+    assert fallback_cache.get(cache_key)['body'] == b'{}'
+    assert fallback_cache.get('/some/path/?a=b') is None
+    assert events[-1][1]['cache_key'] == cache_key
+
+
+@pytest.mark.parametrize('read_legacy_keys', (True, False))
+def test_key_builder_legacy_keys(fallback_cache, read_legacy_keys):
+    key_builder = cache_keys.CacheKeyBuilder(read_legacy_keys=read_legacy_keys)
+    client = create_cached_client(fallback_cache, key_builder=key_builder)
+    fallback_cache.set('/some/path/', {'body': b'{"a": 1}', 'etag': '"1"'})
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', status_code=500)
+        response = client.get('/some/path/')
+
+    if read_legacy_keys:
+        assert mock.last_request.headers['If-None-Match'] == '"1"'
+        assert response.content == b'{"a": 1}'
+    else:
+        assert 'If-None-Match' not in mock.last_request.headers
+        assert isinstance(response, helpers.FailureResponse)
+
+
+def test_key_builder_reads_entries_stored_without_builder(
+    cached_client, fallback_cache
+):
+    key_builder = cache_keys.CacheKeyBuilder()
+    client = create_cached_client(fallback_cache, key_builder=key_builder)
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', content=b'{"a": 1}')
+        cached_client.get('/some/path/')
+        mock.get(
+            'http://example.com/some/path/',
+            exc=requests.exceptions.ConnectTimeout,
+        )
+        response = client.get('/some/path/')
+
+    assert isinstance(response, helpers.CacheResponse)
+    assert response.content == b'{"a": 1}'
+
+
+def test_key_builder_new_key_preferred(fallback_cache):
+    key_builder = cache_keys.CacheKeyBuilder()
+    client = create_cached_client(fallback_cache, key_builder=key_builder)
+    fallback_cache.set('/some/path/', {'body': b'old'})
+    fallback_cache.set(key_builder.build('/some/path/'), {'body': b'new'})
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', status_code=500)
+        response = client.get('/some/path/')
+
+    assert response.content == b'new'
+
+
+def test_key_builder_vary_by_authenticator(fallback_cache):
+    key_builder = cache_keys.CacheKeyBuilder(
+        vary=[cache_keys.vary_by_authenticator], read_legacy_keys=False
+    )
+    client = create_cached_client(fallback_cache, key_builder=key_builder)
+    url = 'http://example.com/some/path/'
+    first = authentication.SessionSSOAuthenticator('1')
+    second = authentication.SessionSSOAuthenticator('2')
+
+    with requests_mock.mock() as mock:
+        mock.get(url, content=b'first')
+        client.get('/some/path/', authenticator=first)
+        mock.get(url, content=b'second')
+        client.get('/some/path/', authenticator=second)
+        mock.get(url, status_code=500)
+        first_response = client.get('/some/path/', authenticator=first)
+        second_response = client.get('/some/path/', authenticator=second)
+
+    assert first_response.content == b'first'
+    assert second_response.content == b'second'
+
+
+def test_async_key_builder_legacy_keys(fallback_cache):
+    key_builder = cache_keys.CacheKeyBuilder()
+
+    responses = [httpx.Response(500), httpx.Response(200, content=b'new')]
+    client = create_async_cached_client(fallback_cache, key_builder=key_builder)
+    client.handler = lambda request: responses.pop(0)
+    fallback_cache.set('/some/path/', {'body': b'old'})
+
+    response = asyncio.run(client.get('/some/path/'))
+    asyncio.run(client.get('/some/path/'))
+
+    assert response.content == b'old'
+    assert fallback_cache.get(key_builder.build('/some/path/'))['body'] == b'new'
+
+
+@pytest.fixture
+def invalidator(fallback_cache):
+    return invalidation.TagInvalidator(fallback_cache)
+
+
+@pytest.fixture
+def invalidated_client(fallback_cache, invalidator):
+    return create_cached_client(fallback_cache, invalidator=invalidator)
+
+
+@pytest.mark.parametrize('tag', ['/some/', '/some/path/', 'page-1'])
+def test_invalidator(invalidated_client, invalidator, events, tag):
+    url = 'http://example.com/some/path/'
+
+    with requests_mock.mock() as mock:
+        mock.get(
+            url, content=b'{}', headers={'ETag': '"1"', 'Cache-Tag': 'page-1'}
+        )
+        invalidated_client.get('/some/path/')
+        invalidator.invalidate(tag)
+        mock.get(url, content=b'{"v": 2}', headers={'ETag': '"2"'})
+        response = invalidated_client.get('/some/path/')
+        invalidated_request = mock.last_request
+        mock.get(url, status_code=304)
+        invalidated_client.get('/some/path/')
+
+    # the invalidated entry is not revalidated, the new one is
+    assert 'If-None-Match' not in invalidated_request.headers
+    assert mock.last_request.headers['If-None-Match'] == '"2"'
+    assert response.content == b'{"v": 2}'
+    assert get_outcomes(events) == [
+        instrumentation.LIVE, instrumentation.LIVE, instrumentation.NOT_MODIFIED
+    ]
+
+
+@pytest.mark.parametrize('response_kwargs', (
+    {'status_code': 500},
+    {'exc': requests.exceptions.ConnectTimeout},
+))
+def test_invalidator_keeps_entry_as_fallback(
+    invalidated_client, invalidator, events, response_kwargs
+):
+    url = 'http://example.com/some/path/'
+
+    with requests_mock.mock() as mock:
+        mock.get(url, content=b'{}', headers={'ETag': '"1"'})
+        invalidated_client.get('/some/path/')
+        invalidator.invalidate('/some/path/')
+        mock.get(url, **response_kwargs)
+        response = invalidated_client.get('/some/path/')
+
+    assert isinstance(response, helpers.CacheResponse)
+    assert response.content == b'{}'
+    assert 'If-None-Match' not in mock.last_request.headers
+    assert get_outcomes(events) == [instrumentation.LIVE, instrumentation.HIT]
+
+
+def test_invalidator_not_stale(fallback_cache, invalidator, revalidator):
+
+    client = create_cached_client(
+        fallback_cache,
+        stale_seconds=60,
+        revalidator=revalidator,
+        invalidator=invalidator,
+    )
+    url = 'http://example.com/some/path/'
+
+    with requests_mock.mock() as mock:
+        mock.get(url, content=b'{}')
+        client.get('/some/path/')
+        invalidator.invalidate('/some/')
+        mock.get(url, content=b'{"v": 2}')
+        response = client.get('/some/path/')
+
+    assert isinstance(response, helpers.LiveResponse)
+    assert response.content == b'{"v": 2}'
+
+
+def test_invalidator_during_revalidation(
+    fallback_cache, invalidator, revalidator
+):
+
+    client = create_cached_client(
+        fallback_cache,
+        stale_seconds=60,
+        revalidator=revalidator,
+        invalidator=invalidator,
+    )
+    url = 'http://example.com/some/path/'
+
+    def content(request, context):
+        invalidator.invalidate('/some/path/')
+        return b'{"v": 2}'
+
+    with requests_mock.mock() as mock:
+        mock.get(url, content=b'{}')
+        client.get('/some/path/')
+        mock.get(url, content=content)
+        response = client.get('/some/path/')
+        revalidator.shutdown(wait=True)
+
+    cache_entry = fallback_cache.get(ENTRY_KEY)
+    assert response.content == b'{}'
+    assert cache_entry['body'] == b'{"v": 2}'
+    assert invalidator.validate(cache_entry, {}) is False
+
+
+def test_invalidator_during_request_local_cache(fallback_cache, invalidator):
+    local_cache = LocalCache()
+
+    client = create_cached_client(
+        fallback_cache,
+        local_cache=local_cache,
+        invalidator=invalidator,
+    )
+    # stored before the invalidator was used, so it has no tags
+    local_cache.set(ENTRY_KEY, {'body': b'{}', 'etag': '"1"'}, size=2)
+
+    def content(request, context):
+        invalidator.invalidate('/some/path/')
+        return b'{"v": 2}'
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', content=content)
+        client.get('/some/path/')
+
+    cache_entry = fallback_cache.get(ENTRY_KEY)
+    assert cache_entry['body'] == b'{"v": 2}'
+    assert invalidator.validate(cache_entry, {}) is False
+
+
+def test_invalidator_local_cache_fresh(fallback_cache, invalidator):
+
+    client = create_cached_client(
+        fallback_cache,
+        local_cache=LocalCache(fresh_seconds=60),
+        invalidator=invalidator,
+    )
+
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/some/path/', content=b'{}')
+        client.get('/some/path/')
+        invalidator.invalidate('/some/path/')
+        response = client.get('/some/path/')
+
+    # generations are not read for entries held fresh in the process
+    assert mock.call_count == 1
+    assert response.content == b'{}'
+
+
+def test_invalidator_other_tags(invalidated_client, invalidator):
+    url = 'http://example.com/some/path/'
+
+    with requests_mock.mock() as mock:
+        mock.get(url, content=b'{}')
+        invalidated_client.get('/some/path/')
+        invalidator.invalidate('/other/')
+        invalidator.invalidate('page-1')
+        mock.get(url, status_code=500)
+        response = invalidated_client.get('/some/path/')
+
+    assert isinstance(response, helpers.CacheResponse)
+
+
+def test_invalidator_reads_counters_with_entry(
+    invalidated_client, fallback_cache
+):
+    url = 'http://example.com/some/path/'
+
+    with requests_mock.mock() as mock:
+        mock.get(url, content=b'{}')
+        invalidated_client.get('/some/path/')
+        mock.get(url, status_code=500)
+        with patch.object(
+            fallback_cache, 'get_many', wraps=fallback_cache.get_many
+        ) as get_many:
+            response = invalidated_client.get('/some/path/')
+
+    assert isinstance(response, helpers.CacheResponse)
+    assert get_many.call_count == 1
+    assert get_many.call_args[0][0] == [
+        ENTRY_KEY,
+        '/some/path/',
+        'directory-client-core:tag:/some/',
+        'directory-client-core:tag:/some/path/',
+    ]
+
+
+def test_invalidator_during_request(
+    invalidated_client, invalidator, fallback_cache
+):
+    url = 'http://example.com/some/path/'
+
+    def content(request, context):
+        invalidator.invalidate('/some/path/')
+        return b'{}'
+
+    with requests_mock.mock() as mock:
+        mock.get(url, content=content, headers={'ETag': '"1"'})
+        invalidated_client.get('/some/path/')
+        mock.get(url, status_code=500)
+        response = invalidated_client.get('/some/path/')
+
+    assert fallback_cache.get(ENTRY_KEY)['tags']
+    assert 'If-None-Match' not in mock.last_request.headers
+    assert isinstance(response, helpers.CacheResponse)
+
+
+def test_async_invalidator(fallback_cache, invalidator):
+
+    responses = [
+        httpx.Response(
+            200, content=b'{}', headers={'Cache-Tag': 'page-1', 'ETag': '"1"'}
+        ),
+        httpx.Response(500),
+        httpx.Response(200, content=b'{"v": 2}'),
+    ]
+    requests_made = []
+    client = create_async_cached_client(fallback_cache, invalidator=invalidator)
+    client.handler = (
+        lambda request: requests_made.append(request) or responses.pop(0)
+    )
+
+    async def run():
+        await client.get('/some/path/')
+        cached_response = await client.get('/some/path/')
+        await invalidator.ainvalidate('page-1')
+        return cached_response, await client.get('/some/path/')
+
+    cached_response, response = asyncio.run(run())
+
+    assert isinstance(cached_response, helpers.CacheResponse)
+    assert requests_made[1].headers['If-None-Match'] == '"1"'
+    assert 'If-None-Match' not in requests_made[2].headers
+    assert response.content == b'{"v": 2}'
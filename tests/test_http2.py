@@ -0,0 +1,279 @@
+import asyncio
+import json
+import socket
+import sys
+import threading
+
+from h2.config import H2Configuration
+from h2.connection import H2Connection
+from h2.events import DataReceived, RequestReceived, StreamEnded
+from mohawk import Receiver
+import pytest
+import requests
+
+from django.core.cache import caches
+
+from directory_client_core import helpers, http2, streaming
+from directory_client_core.async_base import AsyncAbstractAPIClient
+from directory_client_core.base import AbstractAPIClient
+
+
+class TestAPIClient(AbstractAPIClient):
+    version = 1
+
+
+class AsyncAPIClient(AsyncAbstractAPIClient):
+    version = 1
+
+
+class H2Server:
+    """
+    A cleartext HTTP/2 server. Requests to /gather/<n>/ are answered once
+    <n> of them are open on the same connection, so they only succeed if
+    they are multiplexed. Requests to /error/ are answered with a 500, and
+    requests to /never/ are not answered.
+
+    """
+
+    def __init__(self):
+        self.socket = socket.create_server(('127.0.0.1', 0))
+        self.url = 'http://127.0.0.1:{}/'.format(
+            self.socket.getsockname()[1]
+        )
+        self.seen = []
+        self.connections = 0
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(
+                target=self.handle, args=(connection,), daemon=True
+            ).start()
+
+    def handle(self, connection):
+        h2_connection = H2Connection(
+            config=H2Configuration(client_side=False, header_encoding='utf-8')
+        )
+        h2_connection.initiate_connection()
+        connection.sendall(h2_connection.data_to_send())
+        requests_open = {}
+        gathered = []
+        with connection:
+            while True:
+                try:
+                    data = connection.recv(65535)
+                except OSError:
+                    return
+                if not data:
+                    return
+                for event in h2_connection.receive_data(data):
+                    if isinstance(event, RequestReceived):
+                        requests_open[event.stream_id] = {
+                            'headers': dict(event.headers), 'body': b''
+                        }
+                    elif isinstance(event, DataReceived):
+                        requests_open[event.stream_id]['body'] += event.data
+                        h2_connection.acknowledge_received_data(
+                            event.flow_controlled_length, event.stream_id
+                        )
+                    elif isinstance(event, StreamEnded):
+                        request = requests_open.pop(event.stream_id)
+                        self.seen.append(request)
+                        path = request['headers'][':path']
+                        if path.startswith('/gather/'):
+                            gathered.append(event.stream_id)
+                            if len(gathered) == int(path.split('/')[2]):
+                                for stream_id in gathered:
+                                    self.respond(h2_connection, stream_id)
+                                gathered.clear()
+                        elif path == '/error/':
+                            self.respond(h2_connection, event.stream_id, 500)
+                        elif path != '/never/':
+                            self.respond(h2_connection, event.stream_id)
+                connection.sendall(h2_connection.data_to_send())
+
+    def respond(self, h2_connection, stream_id, status=200):
+        body = json.dumps({'stream_id': stream_id, 'items': [1, 2, 3]})
+        body = body.encode()
+        h2_connection.send_headers(stream_id, [
+            (':status', str(status)),
+            ('content-type', 'application/json'),
+            ('content-length', str(len(body))),
+            ('etag', '"1"'),
+        ])
+        h2_connection.send_data(stream_id, body, end_stream=True)
+
+    def close(self):
+        # wakes the thread blocked in accept, which close alone does not
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+
+@pytest.fixture
+def server():
+    server = H2Server()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def client(server):
+    client = TestAPIClient(
+        base_url=server.url,
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=0.25,
+        transport=http2.HTTP2Transport(prior_knowledge=True),
+    )
+    yield client
+    client.close()
+
+
+def assert_signature_valid(seen):
+    Receiver(
+        lambda sender_id: {
+            'id': sender_id, 'key': 'test', 'algorithm': 'sha256'
+        },
+        seen['headers']['x-signature'],
+        seen['headers'][':path'],
+        seen['headers'][':method'],
+        content=seen['body'],
+        content_type=seen['headers'].get('content-type', 'text/plain'),
+        seen_nonce=lambda *args: False,
+    )
+
+
+def test_http2_get(client, server):
+    response = client.get('thing/', params={'a': 'b'})
+    second_response = client.get('thing/')
+
+    assert isinstance(response, requests.Response)
+    assert response.status_code == 200
+    assert response.json()['items'] == [1, 2, 3]
+    assert response.headers['ETag'] == '"1"'
+    assert response.url == server.url + 'thing/?a=b'
+    assert isinstance(response.request, requests.PreparedRequest)
+    assert response.connection_reused is False
+    assert second_response.connection_reused is True
+    assert server.connections == 1
+    assert server.seen[0]['headers'][':path'] == '/thing/?a=b'
+    assert_signature_valid(server.seen[0])
+
+
+def test_http2_multiplexes_concurrent_requests(client, server):
+    responses = client.get_many(['gather/3/'] * 3)
+
+    assert [response.status_code for response in responses] == [200] * 3
+    assert len({response.json()['stream_id'] for response in responses}) == 3
+    assert server.connections == 1
+
+
+def test_http2_post(client, server):
+    response = client.post('thing/', data={'key': 'value'})
+
+    assert response.status_code == 200
+    assert json.loads(server.seen[0]['body']) == {'key': 'value'}
+    assert_signature_valid(server.seen[0])
+
+
+def test_http2_stream(client):
+    response = client.get('thing/', stream=True)
+
+    assert list(streaming.iter_json_items(
+        response.iter_content(chunk_size=4), key='items'
+    )) == [1, 2, 3]
+    response.close()
+
+
+def test_http2_read_timeout(client):
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        client.get('never/')
+
+
+def test_http2_connection_error(server):
+    server.close()
+    client = TestAPIClient(
+        base_url=server.url,
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=0.25,
+        transport=http2.HTTP2Transport(prior_knowledge=True),
+    )
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.get('thing/')
+
+
+def test_http2_close(client, server):
+    client.get('thing/')
+    client.close()
+    client.get('thing/')
+
+    assert server.connections == 2
+
+
+def test_http2_requires_h2(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'h2', None)
+
+    with pytest.raises(ImportError):
+        http2.HTTP2Transport()
+
+
+def test_http2_fallback(server):
+    cache = caches['fallback']
+    cache.clear()
+
+    class FallbackAPIClient(TestAPIClient):
+
+        @helpers.fallback(cache=cache)
+        def get(self, *args, **kwargs):
+            return super().get(*args, **kwargs)
+
+    client = FallbackAPIClient(
+        base_url=server.url,
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+        transport=http2.HTTP2Transport(prior_knowledge=True),
+    )
+    with client:
+        live_response = client.get('thing/')
+        cache.set(
+            helpers.build_cache_key('error/', {}),
+            cache.get(helpers.build_entry_key('thing/', {})),
+        )
+        response = client.get('error/')
+
+    assert isinstance(live_response, helpers.LiveResponse)
+    assert live_response.json()['items'] == [1, 2, 3]
+    assert isinstance(response, helpers.CacheResponse)
+    assert response.json() == live_response.json()
+
+
+def test_async_http2_multiplexes_concurrent_requests(server):
+    client = AsyncAPIClient(
+        base_url=server.url,
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+        http2_prior_knowledge=True,
+    )
+
+    async def get_many():
+        async with client:
+            return await client.get_many(['gather/3/'] * 3)
+
+    responses = asyncio.run(get_many())
+
+    assert [response.status_code for response in responses] == [200] * 3
+    assert len({response.json()['stream_id'] for response in responses}) == 3
+    assert server.connections == 1
+    assert_signature_valid(server.seen[0])
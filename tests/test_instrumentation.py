@@ -0,0 +1,52 @@
+import logging
+
+import pytest
+
+from directory_client_core import instrumentation
+
+
+def test_listener_added_and_removed():
+    calls = []
+
+    def listener(name, data):
+        calls.append((name, data))
+
+    instrumentation.add_listener(listener)
+    instrumentation.emit('event', key='value')
+    instrumentation.remove_listener(listener)
+    instrumentation.emit('event', key='value')
+
+    assert calls == [('event', {'key': 'value'})]
+    assert instrumentation.listeners == ()
+
+
+def test_failing_listener_does_not_stop_others(caplog):
+    calls = []
+
+    def failing_listener(name, data):
+        raise ValueError()
+
+    def listener(name, data):
+        calls.append(name)
+
+    instrumentation.add_listener(failing_listener)
+    instrumentation.add_listener(listener)
+    try:
+        with caplog.at_level(logging.ERROR):
+            instrumentation.emit('event')
+    finally:
+        instrumentation.remove_listener(failing_listener)
+        instrumentation.remove_listener(listener)
+
+    assert calls == ['event']
+    assert caplog.records[0].msg == 'Instrumentation listener failed.'
+
+
+@pytest.mark.parametrize('body,expected', (
+    (None, 0),
+    (b'abc', 3),
+    ('£', 2),
+    (iter([b'abc']), None),
+))
+def test_get_size(body, expected):
+    assert instrumentation.get_size(body) == expected
@@ -0,0 +1,136 @@
+import asyncio
+
+from freezegun import freeze_time
+import pytest
+
+from django.core.cache import caches
+
+from directory_client_core import invalidation
+
+
+@pytest.fixture
+def cache():
+    cache = caches['fallback']
+    cache.clear()
+    return cache
+
+
+@pytest.fixture
+def invalidator(cache):
+    return invalidation.TagInvalidator(cache, namespace='test')
+
+
+@pytest.mark.parametrize('url,tags', [
+    ('a/b/c/', ['/a/', '/a/b/', '/a/b/c/']),
+    ('/a/b/c/', ['/a/', '/a/b/', '/a/b/c/']),
+    ('/a/b?x=y', ['/a/', '/a/b']),
+    ('http://example.com/a/', ['/a/']),
+    ('/', []),
+])
+def test_get_path_tags(invalidator, url, tags):
+    assert invalidator.get_path_tags(url) == tags
+
+
+def test_get_path_tags_depth(cache):
+    invalidator = invalidation.TagInvalidator(cache, path_depth=2)
+
+    assert invalidator.get_path_tags('/a/b/c/') == ['/a/', '/a/b/']
+
+
+def test_get_header_tags(invalidator):
+    assert invalidator.get_header_tags({'Cache-Tag': 'page-1, page-2 x'}) == [
+        'page-1', 'page-2', 'x'
+    ]
+    assert invalidator.get_header_tags({}) == []
+
+
+def test_tag_entry(invalidator, cache):
+    cache_entry = invalidator.tag_entry(
+        {'body': b'{}'}, '/a/b/', {'Cache-Tag': 'page-1'}
+    )
+
+    assert list(cache_entry['tags']) == [
+        'test:tag:/a/', 'test:tag:/a/b/', 'test:tag:page-1'
+    ]
+    for key, generation in cache_entry['tags'].items():
+        assert cache.get(key) == generation
+    assert invalidator.validate(cache_entry, {}) is True
+
+
+def test_tag_entry_counters_read_before_request(invalidator, cache):
+    counters = invalidator.read_counters(invalidator.get_path_keys('/a/'), {})
+    invalidator.validate(None, counters)
+    invalidator.invalidate('/a/')
+
+    cache_entry = invalidator.tag_entry({'body': b'{}'}, '/a/', {}, counters)
+
+    assert invalidator.validate(cache_entry, {}) is False
+
+
+@pytest.mark.parametrize('tag', ['/a/', '/a/b/', 'page-1'])
+def test_invalidate(invalidator, tag):
+    cache_entry = invalidator.tag_entry(
+        {'body': b'{}'}, '/a/b/', {'Cache-Tag': 'page-1'}
+    )
+    other_entry = invalidator.tag_entry({'body': b'{}'}, '/c/', {})
+
+    invalidator.invalidate(tag)
+
+    assert invalidator.validate(cache_entry, {}) is False
+    assert invalidator.validate(other_entry, {}) is True
+
+
+def test_invalidate_evicted_counter(invalidator, cache):
+    cache_entry = invalidator.tag_entry({'body': b'{}'}, '/a/', {})
+    cache.delete('test:tag:/a/')
+
+    assert invalidator.validate(cache_entry, {}) is False
+
+    invalidator.invalidate('/a/')
+
+    assert invalidator.validate(cache_entry, {}) is False
+    assert cache.get('test:tag:/a/') > cache_entry['tags']['test:tag:/a/']
+
+
+def test_counters_expire(invalidator, cache, settings):
+    settings.DIRECTORY_CLIENT_CORE_CACHE_EXPIRE_SECONDS = 100
+
+    with freeze_time() as frozen_time:
+        cache_entry = invalidator.tag_entry({'body': b'{}'}, '/a/', {})
+        invalidator.invalidate('/b/')
+        frozen_time.tick(101)
+
+        assert cache.get('test:tag:/a/') is None
+        assert cache.get('test:tag:/b/') is None
+        assert invalidator.validate(cache_entry, {}) is False
+
+
+def test_validate_untagged(invalidator):
+    assert invalidator.validate({'body': b'{}'}, {}) is True
+    assert invalidator.validate(None, {}) is True
+
+
+def test_validate_uses_counters_read(invalidator, cache):
+    cache_entry = invalidator.tag_entry({'body': b'{}'}, '/a/', {})
+    counters = {'test:tag:/a/': cache_entry['tags']['test:tag:/a/']}
+    cache.clear()
+
+    # the counters read with the entry are not read again
+    assert invalidator.validate(cache_entry, counters) is True
+
+
+def test_async_invalidate(invalidator):
+
+    async def run():
+        cache_entry = await invalidator.atag_entry(
+            {'body': b'{}'}, '/a/b/', {'Cache-Tag': 'page-1'}
+        )
+        current = await invalidator.avalidate(cache_entry, {})
+        await invalidator.ainvalidate('page-1')
+        await invalidator.ainvalidate('never-used')
+        return current, await invalidator.avalidate(cache_entry, {})
+
+    current, invalidated = asyncio.run(run())
+
+    assert current is True
+    assert invalidated is False
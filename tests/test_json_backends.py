@@ -0,0 +1,85 @@
+import json
+import sys
+
+import orjson
+import pytest
+
+from django.conf import settings
+from django.utils.functional import empty
+
+from directory_client_core import json_backends
+
+
+@pytest.fixture(autouse=True)
+def clear_backends():
+    json_backends._backends.clear()
+    yield
+    json_backends._backends.clear()
+
+
+def test_get_backend():
+    backend = json_backends.get_backend('stdlib')
+
+    assert isinstance(backend, json_backends.StdlibJSONBackend)
+    assert json_backends.get_backend('stdlib') is backend
+    assert isinstance(
+        json_backends.get_backend('orjson'), json_backends.OrjsonJSONBackend
+    )
+
+
+def test_get_backend_auto():
+    assert isinstance(
+        json_backends.get_backend('auto'), json_backends.OrjsonJSONBackend
+    )
+
+
+def test_get_backend_auto_without_orjson(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'orjson', None)
+
+    assert isinstance(
+        json_backends.get_backend('auto'), json_backends.StdlibJSONBackend
+    )
+
+
+def test_get_default(settings):
+    assert isinstance(
+        json_backends.get_default(), json_backends.StdlibJSONBackend
+    )
+
+    settings.DIRECTORY_CLIENT_CORE_JSON_BACKEND = 'orjson'
+
+    assert isinstance(
+        json_backends.get_default(), json_backends.OrjsonJSONBackend
+    )
+
+
+def test_get_default_settings_not_configured(monkeypatch):
+    monkeypatch.setattr(settings, '_wrapped', empty)
+
+    assert isinstance(
+        json_backends.get_default(), json_backends.StdlibJSONBackend
+    )
+
+
+@pytest.mark.parametrize('name', ('stdlib', 'orjson'))
+def test_round_trip(name):
+    backend = json_backends.get_backend(name)
+    data = {'key': ['value', 1, 2.5, None, True], 'ключ': {}}
+
+    assert json.loads(backend.dumps(data)) == data
+    assert backend.loads(json.dumps(data)) == data
+    assert backend.loads(json.dumps(data).encode()) == data
+
+
+def test_orjson_falls_back_to_stdlib():
+    backend = json_backends.get_backend('orjson')
+
+    assert backend.dumps({'key': 'value'}) == b'{"key":"value"}'
+    assert backend.dumps({1: 'value'}) == b'{"1":"value"}'
+    assert backend.dumps({'key': 2 ** 70}) == json.dumps({'key': 2 ** 70})
+
+
+def test_orjson_decode_error_is_value_error():
+    with pytest.raises(ValueError):
+        json_backends.get_backend('orjson').loads(b'{')
+    assert issubclass(orjson.JSONDecodeError, ValueError)
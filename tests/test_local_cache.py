@@ -0,0 +1,96 @@
+from unittest.mock import patch
+
+from directory_client_core.local_cache import LocalCache
+
+
+def test_local_cache_miss():
+    local_cache = LocalCache()
+
+    assert local_cache.get('a') == (None, False)
+    assert local_cache.stats()['misses'] == 1
+
+
+def test_local_cache_hit():
+    local_cache = LocalCache()
+    local_cache.set('a', 'value', size=5)
+
+    assert local_cache.get('a') == ('value', False)
+    assert local_cache.stats()['hits'] == 1
+
+
+def test_local_cache_fresh():
+    local_cache = LocalCache(fresh_seconds=10)
+
+    with patch('directory_client_core.local_cache.monotonic', return_value=0):
+        local_cache.set('a', 'value', size=5, fresh=True)
+        local_cache.set('b', 'value', size=5)
+
+    with patch('directory_client_core.local_cache.monotonic', return_value=5):
+        assert local_cache.get('a') == ('value', True)
+        assert local_cache.get('b') == ('value', False)
+
+    with patch('directory_client_core.local_cache.monotonic', return_value=11):
+        assert local_cache.get('a') == ('value', False)
+        local_cache.touch('a')
+        assert local_cache.get('a') == ('value', True)
+
+
+def test_local_cache_expiry():
+    local_cache = LocalCache(timeout=10)
+
+    with patch('directory_client_core.local_cache.monotonic', return_value=0):
+        local_cache.set('a', 'value', size=5)
+
+    with patch('directory_client_core.local_cache.monotonic', return_value=10):
+        assert local_cache.get('a') == (None, False)
+
+    assert local_cache.stats()['entries'] == 0
+    assert local_cache.stats()['bytes'] == 0
+
+
+def test_local_cache_evicts_least_recently_used():
+    local_cache = LocalCache(max_entries=2)
+    local_cache.set('a', 'a', size=1)
+    local_cache.set('b', 'b', size=1)
+    local_cache.get('a')
+    local_cache.set('c', 'c', size=1)
+
+    assert local_cache.get('b') == (None, False)
+    assert local_cache.get('a') == ('a', False)
+    assert local_cache.get('c') == ('c', False)
+    assert local_cache.stats()['evictions'] == 1
+
+
+def test_local_cache_evicts_by_size():
+    local_cache = LocalCache(max_bytes=10)
+    local_cache.set('a', 'a', size=6)
+    local_cache.set('b', 'b', size=6)
+
+    assert local_cache.get('a') == (None, False)
+    assert local_cache.stats() == {
+        'hits': 0,
+        'misses': 1,
+        'evictions': 1,
+        'entries': 1,
+        'bytes': 6,
+    }
+
+
+def test_local_cache_ignores_oversized_values():
+    local_cache = LocalCache(max_bytes=10)
+    local_cache.set('a', 'a', size=11)
+
+    assert local_cache.get('a') == (None, False)
+
+
+def test_local_cache_replace_and_delete():
+    local_cache = LocalCache()
+    local_cache.set('a', 'a', size=3)
+    local_cache.set('a', 'b', size=4)
+
+    assert local_cache.stats()['bytes'] == 4
+
+    local_cache.delete('a')
+
+    assert local_cache.get('a') == (None, False)
+    assert local_cache.stats()['bytes'] == 0
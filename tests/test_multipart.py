@@ -0,0 +1,76 @@
+import io
+from unittest.mock import patch
+
+import pytest
+import requests
+
+from directory_client_core.multipart import FilePart, MultipartEncoder
+
+
+def encode_with_requests(data, files, boundary):
+    with patch('urllib3.filepost.choose_boundary', return_value=boundary):
+        prepared_request = requests.Request(
+            'POST', 'https://example.com', data=data, files=files
+        ).prepare()
+    return prepared_request.body, prepared_request.headers['Content-Type']
+
+
+def create_files():
+    return {
+        'logo': io.BytesIO(b'\x89PNG' * 1000),
+        'text': io.StringIO('hello'),
+        'named': ('report.csv', io.BytesIO(b'a,b\n1,2\n'), 'text/csv'),
+        'headers': ('a.txt', b'raw', 'text/plain', {'X-Extra': '1'}),
+        'content': ('b.txt', 'some text'),
+    }
+
+
+@pytest.mark.parametrize('data', (
+    {'key': 'value', 'number': 1, 'list': ['a', 'b'], 'none': None},
+    [('key', 'value'), (b'bytes', b'value')],
+    None,
+))
+def test_body_same_as_requests(data):
+    expected_body, expected_content_type = encode_with_requests(
+        data, create_files(), boundary='boundary'
+    )
+
+    encoder = MultipartEncoder(data, create_files(), boundary='boundary')
+
+    assert encoder.content_type == expected_content_type
+    assert encoder.read() == expected_body
+    assert len(encoder) == len(expected_body)
+
+
+def test_read_in_chunks_and_rewind():
+    encoder = MultipartEncoder({'key': 'value'}, create_files())
+    body = encoder.read()
+    encoder.seek(0)
+
+    chunks = iter(lambda: encoder.read(7), b'')
+
+    assert b''.join(chunks) == body
+    assert encoder.tell() == len(body)
+    assert b''.join(encoder) == body
+
+
+def test_seekable_files_read_when_body_is(tmp_path):
+    path = tmp_path / 'upload.bin'
+    path.write_bytes(b'x' * 100)
+
+    with open(path, 'rb') as file:
+        file.read(10)
+        encoder = MultipartEncoder({}, {'upload': file})
+        part = encoder.parts[1]
+
+        assert isinstance(part, FilePart)
+        assert part.start == 10
+        assert part.size == 90
+        assert b'x' * 90 + b'\r\n' in encoder.read()
+
+
+def test_seek_only_to_start():
+    encoder = MultipartEncoder({}, {'logo': b'hi'})
+
+    with pytest.raises(io.UnsupportedOperation):
+        encoder.seek(5)
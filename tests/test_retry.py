@@ -0,0 +1,134 @@
+from unittest.mock import patch
+
+import pytest
+import requests
+
+from directory_client_core.retry import RetryPolicy, get_total_timeout
+
+
+def create_response(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return response
+
+
+@pytest.mark.parametrize('method,expected', [
+    ('GET', True), ('get', True), ('PUT', True), ('DELETE', True),
+    ('POST', False), ('PATCH', False),
+])
+def test_retry_policy_idempotent_methods_only(method, expected):
+    policy = RetryPolicy()
+
+    assert policy.is_retryable(method, create_response(503)) is expected
+
+
+def test_retry_policy_custom_methods():
+    policy = RetryPolicy(methods=['post'])
+
+    assert policy.is_retryable('POST', create_response(503)) is True
+    assert policy.is_retryable('GET', create_response(503)) is False
+
+
+@pytest.mark.parametrize('status_code,expected', [
+    (200, False), (404, False), (500, False), (429, True), (503, True),
+])
+def test_retry_policy_status_codes(status_code, expected):
+    policy = RetryPolicy()
+
+    assert policy.is_retryable('GET', create_response(status_code)) is (
+        expected
+    )
+
+
+@pytest.mark.parametrize('exception,expected', [
+    (requests.exceptions.ConnectionError(), True),
+    (requests.exceptions.ReadTimeout(), True),
+    (requests.exceptions.TooManyRedirects(), False),
+])
+def test_retry_policy_exceptions(exception, expected):
+    policy = RetryPolicy()
+
+    assert policy.is_retryable('GET', exception=exception) is expected
+
+
+def test_retry_policy_backoff_exponential():
+    policy = RetryPolicy(backoff_factor=0.1, max_backoff=0.3, jitter=False)
+
+    assert policy.get_backoff(1) == 0.1
+    assert policy.get_backoff(2) == 0.2
+    assert policy.get_backoff(3) == 0.3
+
+
+def test_retry_policy_backoff_jitter():
+    policy = RetryPolicy(backoff_factor=1, max_backoff=10)
+
+    with patch('random.uniform', return_value=0.5) as mock_uniform:
+        assert policy.get_backoff(3) == 0.5
+
+    mock_uniform.assert_called_once_with(0, 4)
+
+
+def test_retry_policy_backoff_retry_after():
+    policy = RetryPolicy(backoff_factor=0.1, max_backoff=5, jitter=False)
+
+    response = create_response(503, {'Retry-After': '3'})
+    assert policy.get_backoff(1, response) == 3
+
+    response = create_response(503, {'Retry-After': '5'})
+    assert policy.get_backoff(1, response) == 5
+
+    response = create_response(503, {'Retry-After': '30'})
+    assert policy.get_backoff(1, response) is None
+
+    response = create_response(503, {'Retry-After': 'Fri, 31 Dec 1999'})
+    assert policy.get_backoff(1, response) == 0.1
+
+
+def test_retry_policy_retry_after_too_long():
+    policy = RetryPolicy(max_backoff=2)
+    response = create_response(503, {'Retry-After': '30'})
+
+    assert policy.get_retry_delay('GET', 1, 0, 1, response=response) is None
+    assert policy.retries == 0
+    assert policy.retries_exhausted == 1
+
+
+def test_retry_policy_max_attempts():
+    policy = RetryPolicy(max_attempts=2, jitter=False)
+    response = create_response(503)
+
+    assert policy.get_retry_delay('GET', 1, 0, 1, response=response) == 0.1
+    assert policy.get_retry_delay('GET', 2, 0, 1, response=response) is None
+    assert policy.retries == 1
+    assert policy.retries_exhausted == 1
+
+
+def test_retry_policy_deadline():
+    policy = RetryPolicy(deadline=5, jitter=False)
+    response = create_response(503)
+
+    assert policy.get_retry_delay('GET', 1, 1, 3, response=response) == 0.1
+    assert policy.get_retry_delay('GET', 1, 2, 3, response=response) is None
+    assert policy.get_retry_delay(
+        'GET', 1, 1, (1, 2), response=response
+    ) == 0.1
+    assert policy.get_retry_delay(
+        'GET', 1, 1, (2, 3), response=response
+    ) is None
+
+
+def test_retry_policy_not_retryable_not_counted():
+    policy = RetryPolicy()
+
+    assert policy.get_retry_delay(
+        'POST', 1, 0, 1, response=create_response(503)
+    ) is None
+    assert policy.retries_exhausted == 0
+
+
+@pytest.mark.parametrize('timeout,expected', [
+    (2, 2), (None, 0), ((1, 2), 3), ((1, None), 1),
+])
+def test_get_total_timeout(timeout, expected):
+    assert get_total_timeout(timeout) == expected
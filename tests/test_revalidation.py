@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+from directory_client_core import sessions
+from directory_client_core.revalidation import BackgroundRevalidator
+
+
+def test_revalidator_runs_in_background():
+    revalidator = BackgroundRevalidator()
+    calls = []
+
+    future = revalidator.submit('a', lambda: calls.append(
+        threading.current_thread().name
+    ))
+    future.result()
+
+    assert calls[0].startswith('directory-client-revalidation')
+
+
+def test_revalidator_deduplicates_in_flight_keys():
+    revalidator = BackgroundRevalidator()
+    event = threading.Event()
+
+    future = revalidator.submit('a', event.wait)
+
+    assert revalidator.submit('a', event.wait) is None
+    assert revalidator.submit('b', lambda: None) is not None
+
+    event.set()
+    future.result()
+
+    assert revalidator.submit('a', lambda: None) is not None
+
+
+def test_revalidator_logs_exceptions(caplog):
+    revalidator = BackgroundRevalidator()
+
+    def fail():
+        raise ValueError()
+
+    revalidator.submit('a', fail).result()
+
+    assert caplog.records[-1].msg == 'Background revalidation failed.'
+    assert revalidator.in_flight == set()
+
+
+def test_revalidator_executor_rebuilt_after_fork(monkeypatch):
+    revalidator = BackgroundRevalidator()
+    executor = revalidator.get_executor()
+
+    monkeypatch.setattr(sessions, '_fork_generation', 1)
+
+    assert revalidator.get_executor() is not executor
+
+
+def test_revalidator_async():
+    revalidator = BackgroundRevalidator()
+    calls = []
+
+    async def revalidate():
+        calls.append(1)
+
+    async def run():
+        task = revalidator.submit_async('a', revalidate)
+        assert revalidator.submit_async('a', revalidate) is None
+        await task
+
+    asyncio.run(run())
+
+    assert calls == [1]
+    assert revalidator.tasks == set()
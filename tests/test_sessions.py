@@ -0,0 +1,136 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+import requests_mock
+
+from directory_client_core import sessions
+
+
+def test_session_reused_within_thread():
+    manager = sessions.SessionManager()
+
+    assert manager.get_session() is manager.get_session()
+
+
+def test_session_per_thread_shares_adapter():
+    manager = sessions.SessionManager(thread_local=True)
+    session = manager.get_session()
+    other = {}
+
+    thread = threading.Thread(
+        target=lambda: other.update(session=manager.get_session())
+    )
+    thread.start()
+    thread.join()
+
+    assert other['session'] is not session
+    assert other['session'].get_adapter('https://a.com') is (
+        session.get_adapter('https://a.com')
+    )
+
+
+def test_session_shared_between_threads():
+    manager = sessions.SessionManager(thread_local=False)
+    session = manager.get_session()
+    other = {}
+
+    thread = threading.Thread(
+        target=lambda: other.update(session=manager.get_session())
+    )
+    thread.start()
+    thread.join()
+
+    assert other['session'] is session
+
+
+def test_session_pool_configuration():
+    manager = sessions.SessionManager(
+        pool_connections=3, pool_maxsize=7, pool_block=True
+    )
+    adapter = manager.get_session().get_adapter('https://a.com')
+
+    assert adapter._pool_connections == 3
+    assert adapter._pool_maxsize == 7
+    assert adapter._pool_block is True
+
+
+def test_session_does_not_persist_cookies():
+    manager = sessions.SessionManager()
+    session = manager.get_session()
+
+    with requests_mock.mock() as mock:
+        mock.get('https://a.com', headers={'Set-Cookie': 'sessionid=123'})
+        response = session.get('https://a.com')
+        session.get('https://a.com')
+        second_request = mock.request_history[1]
+
+    assert response.cookies['sessionid'] == '123'
+    assert len(session.cookies) == 0
+    assert 'Cookie' not in second_request.headers
+
+
+def test_session_close():
+    manager = sessions.SessionManager()
+    session = manager.get_session()
+    adapter = manager.adapter
+
+    manager.close()
+
+    assert manager.adapter is None
+    assert len(adapter.poolmanager.pools) == 0
+    assert manager.get_session() is not session
+
+
+def test_session_discarded_after_fork(monkeypatch):
+    manager = sessions.SessionManager()
+    session = manager.get_session()
+    adapter = manager.adapter
+
+    monkeypatch.setattr(sessions, '_fork_generation', 1)
+
+    assert manager.get_session() is not session
+    assert manager.adapter is not adapter
+
+
+def test_proxies_resolved_from_environment_once_per_origin(monkeypatch):
+    monkeypatch.setenv('HTTPS_PROXY', 'http://proxy.example.com:3128')
+    monkeypatch.setenv('NO_PROXY', 'internal.example.com')
+    manager = sessions.SessionManager()
+
+    proxies = manager.get_proxies('https://example.com/a/')
+
+    assert proxies['https'] == 'http://proxy.example.com:3128'
+    assert manager.get_proxies('https://example.com/b/') is proxies
+    assert 'https' not in manager.get_proxies('https://internal.example.com/')
+
+    manager.close()
+
+    assert manager.proxies == {}
+
+
+def test_connection_reused_recorded():
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    manager = sessions.SessionManager()
+    try:
+        first = manager.get_session().get(url)
+        second = manager.get_session().get(url)
+    finally:
+        manager.close()
+        server.shutdown()
+        server.server_close()
+
+    assert first.connection_reused is False
+    assert second.connection_reused is True
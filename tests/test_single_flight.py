@@ -0,0 +1,232 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from django.core.cache import caches
+
+from directory_client_core.single_flight import SingleFlight
+
+
+@pytest.fixture
+def fallback_cache():
+    cache = caches['fallback']
+    cache.clear()
+    return cache
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_single_flight_shares_result_between_threads():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def work():
+        calls.append(1)
+        release.wait()
+        return 'result'
+
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(single_flight.do('a', work))
+        )
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: single_flight.coalesced == 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == ['result'] * 5
+    assert single_flight.calls == {}
+
+
+def test_single_flight_copies_result_for_waiters():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    results = []
+
+    def work():
+        release.wait()
+        return ['result']
+
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(
+                single_flight.do('a', work, copy=list)
+            )
+        )
+        for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: single_flight.coalesced == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == [['result']] * 3
+    assert len({id(result) for result in results}) == 3
+
+
+def test_single_flight_shares_exception_between_threads():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def work():
+        release.wait()
+        raise ValueError('bad')
+
+    def call():
+        try:
+            single_flight.do('a', work)
+        except ValueError as exception:
+            errors.append(exception)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: single_flight.coalesced == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 3
+
+
+def test_single_flight_sequential_calls_not_shared():
+    single_flight = SingleFlight()
+    calls = []
+
+    single_flight.do('a', lambda: calls.append(1))
+    single_flight.do('a', lambda: calls.append(1))
+
+    assert calls == [1, 1]
+
+
+def test_single_flight_async():
+    single_flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    async def run():
+        return await asyncio.gather(
+            *[single_flight.ado('a', work) for _ in range(5)]
+        )
+
+    results = asyncio.run(run())
+
+    assert calls == [1]
+    assert results == ['result'] * 5
+    assert single_flight.async_calls == {}
+
+
+def test_single_flight_async_copies_result_for_waiters():
+    single_flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        return ['result']
+
+    async def run():
+        return await asyncio.gather(
+            *[single_flight.ado('a', work, copy=list) for _ in range(3)]
+        )
+
+    results = asyncio.run(run())
+
+    assert results == [['result']] * 3
+    assert len({id(result) for result in results}) == 3
+
+
+def test_single_flight_async_exception():
+    single_flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError('bad')
+
+    async def run():
+        return await asyncio.gather(
+            *[single_flight.ado('a', work) for _ in range(2)],
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_single_flight_cache_lock_released(fallback_cache):
+    single_flight = SingleFlight(cache=fallback_cache)
+
+    assert single_flight.do('a', lambda: 'result') == 'result'
+    assert fallback_cache.get('single-flight-a') is None
+
+
+def test_single_flight_waits_for_other_process(fallback_cache):
+    single_flight = SingleFlight(
+        cache=fallback_cache, lock_timeout=5, poll_interval=0.001
+    )
+    # another process holds the lock
+    fallback_cache.add('single-flight-a', 1)
+    timer = threading.Timer(
+        0.05, lambda: fallback_cache.delete('single-flight-a')
+    )
+    timer.start()
+
+    result = single_flight.do(
+        'a', lambda: 'own result', after_wait=lambda: 'their result'
+    )
+
+    assert result == 'their result'
+
+
+def test_single_flight_other_process_times_out(fallback_cache):
+    single_flight = SingleFlight(
+        cache=fallback_cache, lock_timeout=0.01, poll_interval=0.001
+    )
+    fallback_cache.add('single-flight-a', 1)
+
+    result = single_flight.do(
+        'a', lambda: 'own result', after_wait=lambda: None
+    )
+
+    assert result == 'own result'
+
+
+def test_single_flight_async_waits_for_other_process(fallback_cache):
+    single_flight = SingleFlight(
+        cache=fallback_cache, lock_timeout=5, poll_interval=0.001
+    )
+    fallback_cache.add('single-flight-a', 1)
+
+    async def work():
+        return 'own result'
+
+    async def after_wait():
+        return 'their result'
+
+    async def run():
+        asyncio.get_running_loop().call_later(
+            0.05, fallback_cache.delete, 'single-flight-a'
+        )
+        return await single_flight.ado('a', work, after_wait=after_wait)
+
+    assert asyncio.run(run()) == 'their result'
@@ -0,0 +1,179 @@
+import io
+import json
+
+import pytest
+
+from django.core.cache import caches
+from freezegun import freeze_time
+
+from directory_client_core import streaming
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('chunk_size', (1, 3, 1000))
+def test_iter_json_items(chunk_size):
+    items = [{'name': 'café', 'id': 12345}, 3.25, 'text', None, [1, 2], True]
+    data = json.dumps(items).encode()
+
+    result = list(streaming.iter_json_items(split(data, chunk_size)))
+
+    assert result == items
+
+
+@pytest.mark.parametrize('chunk_size', (1, 7, 1000))
+def test_iter_json_items_key(chunk_size):
+    data = json.dumps({
+        'count': 2,
+        'next': {'page': 2},
+        'results': [{'id': 1}, {'id': 2}],
+        'previous': None,
+    }).encode()
+
+    result = list(
+        streaming.iter_json_items(split(data, chunk_size), key='results')
+    )
+
+    assert result == [{'id': 1}, {'id': 2}]
+
+
+@pytest.mark.parametrize('data,key', (
+    (b' [ ] ', None),
+    (b'{"results": []}', 'results'),
+    (b'{"count": 0}', 'results'),
+))
+def test_iter_json_items_empty(data, key):
+    assert list(streaming.iter_json_items([data], key=key)) == []
+
+
+def test_iter_json_items_truncated():
+    with pytest.raises(ValueError):
+        list(streaming.iter_json_items([b'[{"id": 1}, {"id"']))
+
+
+class Writer(streaming.MemoryWriter):
+    aborted = False
+
+    def abort(self):
+        self.aborted = True
+
+
+def test_tee_stream_read_to_end():
+    writer = Writer()
+    completed = []
+    tee = streaming.TeeStream(io.BytesIO(b'abcdef'), writer, completed.append)
+
+    assert tee.read(4) == b'abcd'
+    assert completed == []
+    assert tee.read(4) == b'ef'
+    assert tee.read(4) == b''
+    assert completed == [{'body': b'abcdef'}]
+
+
+def test_tee_stream_closed_early():
+    writer = Writer()
+    completed = []
+    tee = streaming.TeeStream(io.BytesIO(b'abcdef'), writer, completed.append)
+
+    tee.read(4)
+    tee.close()
+
+    assert completed == []
+    assert writer.aborted is True
+
+
+def write_body(store, key, chunks):
+    writer = store.open_writer(key)
+    for chunk in chunks:
+        writer.write(chunk)
+    return writer.commit()
+
+
+def test_file_body_store(tmp_path):
+    store = streaming.FileBodyStore(str(tmp_path))
+
+    fields = write_body(store, '/some/path/', [b'abc', b'def'])
+
+    assert fields['body'] is None
+    assert fields['size'] == 6
+    assert store.exists(fields['body_ref'])
+    assert store.open(fields['body_ref']).read() == b'abcdef'
+    # no partial files left behind
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_file_body_store_retire(tmp_path):
+    store = streaming.FileBodyStore(str(tmp_path))
+    first = write_body(store, '/some/path/', [b'abc'])
+    second = write_body(store, '/some/path/', [b'def'])
+    reader = store.open(first['body_ref'])
+
+    store.retire(first['body_ref'])
+    store.retire({'name': 'written-on-another-host'})
+
+    assert first['body_ref'] != second['body_ref']
+    assert store.exists(first['body_ref']) is False
+    assert reader.read() == b'abc'
+    assert store.open(second['body_ref']).read() == b'def'
+
+
+def test_file_body_store_aborted(tmp_path):
+    store = streaming.FileBodyStore(str(tmp_path))
+    writer = store.open_writer('/some/path/')
+    writer.write(b'abc')
+
+    writer.abort()
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_file_body_store_missing(tmp_path):
+    store = streaming.FileBodyStore(str(tmp_path))
+
+    assert store.exists({'name': 'missing'}) is False
+    assert store.open({'name': 'missing'}) is None
+
+
+def test_cache_body_store():
+    cache = caches['fallback']
+    store = streaming.CacheBodyStore(cache, chunk_size=4)
+
+    fields = write_body(store, '/some/path/', [b'abc', b'defghij'])
+
+    assert fields['body_ref']['chunks'] == 3
+    assert cache.get(store.create_chunk_key(fields['body_ref'], 0)) == b'abcd'
+    assert store.open(fields['body_ref']).read() == b'abcdefghij'
+
+
+def test_cache_body_store_empty_body():
+    store = streaming.CacheBodyStore(caches['fallback'])
+
+    fields = write_body(store, '/some/path/', [])
+
+    assert store.open(fields['body_ref']).read() == b''
+
+
+def test_cache_body_store_retire():
+    cache = caches['fallback']
+    store = streaming.CacheBodyStore(cache, chunk_size=2, retired_seconds=5)
+    fields = write_body(store, '/some/path/', [b'abcd'])
+
+    with freeze_time() as frozen_time:
+        store.retire(fields['body_ref'])
+        assert store.open(fields['body_ref']).read() == b'abcd'
+        frozen_time.tick(6)
+        assert store.exists(fields['body_ref']) is False
+
+
+def test_cache_body_store_aborted():
+    cache = caches['fallback']
+    store = streaming.CacheBodyStore(cache, chunk_size=2)
+    writer = store.open_writer('/some/path/')
+    writer.write(b'abcd')
+
+    writer.abort()
+
+    assert store.exists(writer.reference) is False
+    assert store.open(writer.reference) is None
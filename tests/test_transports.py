@@ -0,0 +1,257 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+import json
+import socket
+import threading
+import time
+
+from mohawk import Receiver
+import pytest
+import requests
+
+from django.core.cache import caches
+
+from directory_client_core import helpers, sessions, transports
+from directory_client_core.base import AbstractAPIClient
+
+
+class TestAPIClient(AbstractAPIClient):
+    version = 1
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def respond(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.seen.append({
+            'path': self.path, 'headers': self.headers, 'body': b''
+        })
+        if self.path == '/redirect/':
+            self.respond(302, headers={'Location': '/elsewhere/'})
+        elif self.path == '/error/':
+            self.respond(500)
+        elif self.path == '/slow/':
+            time.sleep(0.5)
+            self.respond(200)
+        else:
+            self.respond(
+                200,
+                b'{"key": "value"}',
+                {
+                    'Content-Type': 'application/json',
+                    'ETag': '"1"',
+                    'Set-Cookie': 'a=b; Path=/',
+                },
+            )
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        self.server.seen.append({
+            'path': self.path,
+            'headers': self.headers,
+            'body': self.rfile.read(length),
+        })
+        self.respond(201, b'{}', {'Content-Type': 'application/json'})
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.seen = []
+    server.url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    threading.Thread(
+        target=server.serve_forever, args=(0.01,), daemon=True
+    ).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(server):
+    client = TestAPIClient(
+        base_url=server.url,
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=0.25,
+        transport=transports.Urllib3Transport(),
+    )
+    yield client
+    client.close()
+
+
+def assert_signature_valid(seen):
+    Receiver(
+        lambda sender_id: {
+            'id': sender_id, 'key': 'test', 'algorithm': 'sha256'
+        },
+        seen['headers']['X-Signature'],
+        seen['path'],
+        'POST' if seen['body'] else 'GET',
+        content=seen['body'],
+        content_type=seen['headers'].get('Content-Type', 'text/plain'),
+        seen_nonce=lambda *args: False,
+    )
+
+
+def test_default_transport():
+    client = TestAPIClient(
+        base_url='https://example.com/',
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+    )
+
+    assert isinstance(client.transport, transports.RequestsTransport)
+    assert client.session_manager is client.transport.session_manager
+
+
+def test_urllib3_get(client, server):
+    first = client.get('thing/', params={'a': 'b'})
+    second = client.get('thing/')
+
+    assert type(first) is requests.Response
+    assert first.status_code == 200
+    assert first.reason == 'OK'
+    assert first.url == server.url + 'thing/?a=b'
+    assert first.json() == {'key': 'value'}
+    assert first.headers['etag'] == '"1"'
+    assert first.cookies['a'] == 'b'
+    assert first.request.method == 'GET'
+    assert first.elapsed.total_seconds() > 0
+    assert first.connection_reused is False
+    assert second.connection_reused is True
+    assert server.seen[0]['path'] == '/thing/?a=b'
+    assert_signature_valid(server.seen[0])
+
+
+def test_urllib3_post(client, server):
+    response = client.post('thing/', data={'key': 'value'})
+
+    assert response.status_code == 201
+    assert json.loads(server.seen[0]['body']) == {'key': 'value'}
+    assert_signature_valid(server.seen[0])
+
+
+def test_urllib3_post_streamed_upload(client, server):
+    upload = BytesIO(b'\x00\x01' * 100000)
+
+    response = client.post('thing/', data={'key': 'value'}, files={'a': upload})
+
+    assert response.status_code == 201
+    assert len(server.seen[0]['body']) == int(
+        server.seen[0]['headers']['Content-Length']
+    )
+    assert b'\x00\x01' * 100000 in server.seen[0]['body']
+    assert_signature_valid(server.seen[0])
+
+
+def test_urllib3_stream(client):
+    response = client.get('thing/', stream=True)
+
+    assert response._content_consumed is False
+    assert b''.join(response.iter_content(4)) == b'{"key": "value"}'
+
+
+def test_urllib3_redirect_not_followed(client, server):
+    response = client.get('redirect/')
+
+    assert response.status_code == 302
+    assert response.headers['Location'] == '/elsewhere/'
+    assert len(server.seen) == 1
+
+
+def test_urllib3_read_timeout(client):
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        client.get('slow/')
+
+
+def test_urllib3_connection_error():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    client = TestAPIClient(
+        base_url=f'http://127.0.0.1:{port}/',
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+        transport=transports.Urllib3Transport(),
+    )
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.get('thing/')
+
+
+def test_urllib3_proxy_from_environment(server, monkeypatch):
+    monkeypatch.setenv('HTTP_PROXY', server.url)
+    monkeypatch.delenv('NO_PROXY', raising=False)
+    monkeypatch.delenv('no_proxy', raising=False)
+    transport = transports.Urllib3Transport()
+    prepared_request = requests.Request(
+        'GET', 'http://example.invalid/thing/'
+    ).prepare()
+
+    response = transport.send(prepared_request, timeout=2)
+    transport.close()
+
+    assert response.status_code == 200
+    assert server.seen[0]['path'] == 'http://example.invalid/thing/'
+
+
+def test_urllib3_after_fork(client, monkeypatch):
+    client.get('thing/')
+    managers = client.transport.managers
+
+    monkeypatch.setattr(sessions, '_fork_generation', sessions._fork_generation + 1)
+    response = client.get('thing/')
+
+    assert client.transport.managers is not managers
+    assert response.connection_reused is False
+
+
+def test_urllib3_close(client):
+    client.get('thing/')
+    client.close()
+
+    assert client.get('thing/').connection_reused is False
+
+
+def test_urllib3_fallback(server):
+    cache = caches['fallback']
+    cache.clear()
+
+    class FallbackAPIClient(TestAPIClient):
+
+        @helpers.fallback(cache=cache)
+        def get(self, *args, **kwargs):
+            return super().get(*args, **kwargs)
+
+    client = FallbackAPIClient(
+        base_url=server.url,
+        api_key='test',
+        sender_id='test-sender-id',
+        timeout=2,
+        transport=transports.Urllib3Transport(),
+    )
+    with client:
+        live_response = client.get('thing/')
+        cache.set(
+            helpers.build_cache_key('error/', {}),
+            cache.get(helpers.build_entry_key('thing/', {})),
+        )
+        response = client.get('error/')
+
+    assert isinstance(live_response, helpers.LiveResponse)
+    assert isinstance(response, helpers.CacheResponse)
+    assert response.json() == {'key': 'value'}
@@ -0,0 +1,275 @@
+from io import StringIO
+import threading
+import time
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+import pytest
+import requests
+import requests_mock
+
+from directory_client_core import helpers, warm_up
+from directory_client_core.local_cache import LocalCache
+from directory_client_core.base import AbstractAPIClient
+from directory_client_core.management.commands import warm_fallback_cache
+
+
+class APIClient(AbstractAPIClient):
+    version = 1
+
+
+class CachedAPIClient(APIClient):
+
+    @helpers.fallback(cache=caches['fallback'])
+    def get(self, *args, **kwargs):
+        return super().get(*args, **kwargs)
+
+
+def create_client(client_class=CachedAPIClient):
+    return client_class(
+        base_url='http://example.com',
+        api_key='debug',
+        sender_id='test-sender',
+        timeout=5,
+    )
+
+
+@pytest.fixture(autouse=True)
+def clear_fallback_cache():
+    caches['fallback'].clear()
+
+
+@pytest.fixture
+def mock():
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/a/', content=b'{"a": 1}')
+        mock.get('http://example.com/b/?q=x', content=b'{"b": 2}')
+        mock.get('http://example.com/missing/', status_code=404)
+        mock.get('http://example.com/error/', status_code=500)
+        yield mock
+
+
+def test_warm_cache(mock):
+    progress = []
+
+    report = warm_up.warm_cache(
+        create_client(),
+        ['/a/', ('/b/', {'q': 'x'}), '/missing/', {'url': '/error/'}],
+        progress=lambda report, call, outcome: progress.append(
+            (report.done, outcome)
+        ),
+    )
+
+    cache = caches['fallback']
+    assert cache.get(helpers.build_entry_key('/a/', {}))['body'] == b'{"a": 1}'
+    assert cache.get(helpers.build_entry_key('/b/', {'q': 'x'}))
+    assert report.total == 4
+    assert report.written == 2
+    assert report.unchanged == 0
+    assert report.bytes_written == 16
+    assert sorted(report.failures, key=str) == [
+        ('/missing/', 'status 404'), ({'url': '/error/'}, 'status 500')
+    ]
+    assert sorted(done for done, _ in progress) == [1, 2, 3, 4]
+    assert sorted(outcome for _, outcome in progress) == [
+        warm_up.FAILED, warm_up.FAILED, warm_up.WRITTEN, warm_up.WRITTEN,
+    ]
+
+
+def test_warm_cache_unchanged():
+    client = create_client()
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/a/', content=b'{}', headers={'ETag': '1'})
+        warm_up.warm_cache(client, ['/a/'])
+        mock.get('http://example.com/a/', status_code=304)
+        report = warm_up.warm_cache(client, ['/a/'])
+
+    assert mock.last_request.headers['If-None-Match'] == '1'
+    assert report.written == 0
+    assert report.unchanged == 1
+    assert report.bytes_written == 0
+
+
+def test_warm_cache_local_cache_fresh():
+
+    class LocalCachedAPIClient(APIClient):
+
+        @helpers.fallback(
+            cache=caches['fallback'], local_cache=LocalCache(fresh_seconds=60)
+        )
+        def get(self, *args, **kwargs):
+            return super().get(*args, **kwargs)
+
+    client = create_client(LocalCachedAPIClient)
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/a/', content=b'{}')
+        warm_up.warm_cache(client, ['/a/'])
+        report = warm_up.warm_cache(client, ['/a/'])
+
+    assert mock.call_count == 1
+    assert report.unchanged == 1
+    assert report.failures == []
+
+
+@pytest.mark.parametrize('response_kwargs,reason', (
+    ({'status_code': 500}, 'status 500'),
+    ({'exc': requests.exceptions.ConnectTimeout}, 'ConnectTimeout()'),
+))
+def test_warm_cache_served_from_cache(response_kwargs, reason):
+    client = create_client()
+    with requests_mock.mock() as mock:
+        mock.get('http://example.com/a/', content=b'{}')
+        warm_up.warm_cache(client, ['/a/'])
+        mock.get('http://example.com/a/', **response_kwargs)
+        report = warm_up.warm_cache(client, ['/a/'])
+
+    assert report.unchanged == 0
+    assert report.failures == [('/a/', reason)]
+
+
+def test_warm_cache_exception():
+    with requests_mock.mock() as mock:
+        mock.get(
+            'http://example.com/a/', exc=requests.exceptions.ConnectionError
+        )
+        report = warm_up.warm_cache(create_client(), ['/a/'])
+
+    assert report.failures == [('/a/', 'ConnectionError()')]
+
+
+def test_warm_cache_not_decorated(mock):
+    report = warm_up.warm_cache(create_client(APIClient), ['/a/'])
+
+    assert report.failures == [
+        ('/a/', 'get is not decorated with helpers.fallback')
+    ]
+
+
+def test_warm_cache_concurrency():
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def content(request, context):
+        with lock:
+            running.append(request)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(request)
+        return b'{}'
+
+    with requests_mock.mock() as mock:
+        mock.get(requests_mock.ANY, content=content)
+        report = warm_up.warm_cache(
+            create_client(), [f'/{i}/' for i in range(8)], concurrency=2
+        )
+
+    assert report.written == 8
+    assert max(peak) == 2
+
+
+@pytest.mark.parametrize('call,url', (
+    ('/a/', '/a/'),
+    (('/b/', {'q': 'x'}), '/b/?q=x'),
+    ({'url': '/c/', 'params': {'q': ['x', 'y']}}, '/c/?q=x&q=y'),
+))
+def test_describe_call(call, url):
+    assert warm_up.describe_call(call) == url
+
+
+def test_load_calls_json(tmp_path):
+    path = tmp_path / 'calls.json'
+    path.write_text('["/a/", ["/b/", {"q": "x"}], {"url": "/c/"}]')
+
+    assert warm_up.load_calls(path) == [
+        '/a/', ['/b/', {'q': 'x'}], {'url': '/c/'}
+    ]
+
+
+def test_load_calls_sitemap(tmp_path):
+    path = tmp_path / 'sitemap.xml'
+    path.write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        '<url><loc>http://example.com/a/</loc></url>'
+        '<url><loc> http://example.com/b/?q=x&amp;r= </loc></url>'
+        '<url><loc>http://other.com/c/</loc></url>'
+        '</urlset>'
+    )
+
+    assert warm_up.load_calls(path, base_url='http://example.com') == [
+        ('/a/', {}),
+        ('/b/', {'q': 'x', 'r': ''}),
+        ('http://other.com/c/', {}),
+    ]
+
+
+def test_load_calls_text(tmp_path):
+    path = tmp_path / 'calls.txt'
+    path.write_text('/a/\n\n  /b/?q=x\nhttp://example.com/c/\n')
+
+    assert warm_up.load_calls(path, base_url='http://example.com') == [
+        ('/a/', {}), ('/b/', {'q': 'x'}), ('/c/', {}),
+    ]
+
+
+def test_warm_cache_text_keys(mock, tmp_path):
+    path = tmp_path / 'calls.txt'
+    path.write_text('/b/?q=x\n')
+
+    warm_up.warm_cache(create_client(), warm_up.load_calls(path))
+
+    assert caches['fallback'].get(helpers.build_entry_key('/b/', {'q': 'x'}))
+
+
+def test_command(mock, tmp_path):
+    path = tmp_path / 'calls.json'
+    path.write_text('["/a/", ["/b/", {"q": "x"}]]')
+    stdout = StringIO()
+
+    call_command(
+        warm_fallback_cache.Command(),
+        'tests.test_warm_up.create_client',
+        str(path),
+        '--progress-every=1',
+        stdout=stdout,
+    )
+
+    assert stdout.getvalue().splitlines() == [
+        '1/2 calls made',
+        '2/2 calls made',
+        '2 calls: 2 written (16 bytes), 0 unchanged, 0 failed.',
+    ]
+    assert caches['fallback'].get(helpers.build_entry_key('/a/', {}))
+
+
+def test_command_failures(mock, tmp_path):
+    path = tmp_path / 'calls.txt'
+    path.write_text('/a/\n/error/\n')
+    stdout = StringIO()
+    stderr = StringIO()
+
+    with pytest.raises(CommandError, match='1 calls failed.'):
+        call_command(
+            warm_fallback_cache.Command(),
+            'tests.test_warm_up.create_client',
+            str(path),
+            stdout=stdout,
+            stderr=stderr,
+        )
+
+    assert stderr.getvalue() == 'Failed /error/: status 500\n'
+    assert stdout.getvalue() == (
+        '2 calls: 1 written (8 bytes), 0 unchanged, 1 failed.\n'
+    )
+
+
+def test_command_cannot_read(tmp_path):
+    with pytest.raises(CommandError, match='Cannot read'):
+        call_command(
+            warm_fallback_cache.Command(),
+            'tests.test_warm_up.create_client',
+            str(tmp_path / 'missing.json'),
+        )